@@ -0,0 +1,80 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from model import db, User, Patient, Appointment
+import tenants
+
+
+# --- Doctor agenda ---
+# Today's and the coming week's appointments for one doctor. The range
+# query on (doctor_id, start_time) is served by ix_appointment_doctor_start,
+# so its cost depends on the size of the week, not on the doctor's history.
+# Patient names come from the same query via joins.
+
+def _load(doctor_id, day):
+    start = datetime.combine(day, datetime.min.time())
+    end = start + timedelta(days=current_app.config.get('AGENDA_DAYS', 7) + 1)
+    rows = db.session.query(Appointment.id, Appointment.start_time, Appointment.end_time,
+                            Appointment.status, Patient.id, User.full_name) \
+        .join(Patient, Patient.id == Appointment.patient_id) \
+        .join(User, User.id == Patient.user_id) \
+        .filter(Appointment.doctor_id == doctor_id,
+                Appointment.start_time >= start,
+                Appointment.start_time < end) \
+        .order_by(Appointment.start_time, Appointment.id) \
+        .all()
+    return [
+        {'id': appointment_id, 'start_time': start_time, 'end_time': end_time,
+         'status': status, 'patient_id': patient_id, 'patient_name': patient_name}
+        for appointment_id, start_time, end_time, status, patient_id, patient_name in rows
+    ]
+
+
+def _group_by_day(appointments):
+    days = OrderedDict()
+    for appointment in appointments:
+        days.setdefault(appointment['start_time'].date(), []).append(appointment)
+    return days
+
+
+# --- Per-doctor cache ---
+# Holds each doctor's agenda for AGENDA_CACHE_TTL seconds (0 disables it).
+# Every appointment write in this process calls invalidate() for the
+# doctor concerned; the TTL bounds how stale other worker processes can be.
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def invalidate(doctor_id=None):
+    # No doctor_id drops every cached agenda (e.g. after a bulk import)
+    with _cache_lock:
+        if doctor_id is None:
+            _cache.clear()
+        else:
+            _cache.pop((tenants.current(), doctor_id), None)
+
+
+def agenda(doctor_id, day=None):
+    day = day or datetime.now().date()
+    ttl = current_app.config.get('AGENDA_CACHE_TTL', 60)
+    key = (tenants.current(), doctor_id)
+    if ttl:
+        with _cache_lock:
+            entry = _cache.get(key)
+            if entry is not None and entry[0] == day and entry[1] >= time.monotonic():
+                _cache.move_to_end(key)
+                return entry[2]
+
+    days = _group_by_day(_load(doctor_id, day))
+    if ttl:
+        with _cache_lock:
+            _cache[key] = (day, time.monotonic() + ttl, days)
+            _cache.move_to_end(key)
+            while len(_cache) > current_app.config.get('AGENDA_CACHE_SIZE', 1024):
+                _cache.popitem(last=False)
+    return days
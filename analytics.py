@@ -0,0 +1,297 @@
+from datetime import date, datetime, time, timedelta
+
+import click
+from flask import current_app
+from sqlalchemy import Integer, and_, case, cast, delete, func, insert, select
+from sqlalchemy.exc import SQLAlchemyError
+
+from model import db, User, Doctor, Department, Appointment, \
+    AppointmentDayRollup, HourRollup, ScheduleDayRollup, AnalyticsWatermark, AnalyticsDirtyDay
+from schedules import RELEASED_STATUSES
+import schedules
+import archive
+
+
+# Appointments still in one of these once their day is over are no-shows
+PENDING_STATUSES = ('Booked', 'Confirmed')
+
+BUCKETS = ('day', 'week', 'month')
+
+# Per-doctor figures that are summed into the department rows
+TOTALS = ('appointments', 'canceled', 'completed', 'no_show', 'booked_minutes', 'scheduled_minutes')
+
+# Schedule days are expanded and written this many at a time
+SCHEDULE_CHUNK_DAYS = 28
+
+
+# --- Dialect helpers ---
+
+def _hour(column):
+    if db.engine.dialect.name == 'sqlite':
+        return cast(func.strftime('%H', column), Integer)
+    return cast(func.extract('hour', column), Integer)
+
+
+def _minutes(start, end):
+    if db.engine.dialect.name == 'sqlite':
+        return func.round((func.julianday(end) - func.julianday(start)) * 1440)
+    return func.extract('epoch', end - start) / 60
+
+
+def _as_date(value):
+    # SQLite returns date() results as text
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _as_datetime(value):
+    # ... and untyped aggregates over a union as text too
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+# --- Watermarks ---
+
+def _watermark(name):
+    return db.session.get(AnalyticsWatermark, name)
+
+
+def _set_watermark(name, value):
+    mark = _watermark(name)
+    if mark is None:
+        mark = AnalyticsWatermark(name=name)
+        db.session.add(mark)
+    mark.value = value
+    mark.refreshed_at = datetime.utcnow()
+
+
+def _day_runs(days):
+    # Sorted dates -> contiguous (first, last) ranges, so each range is
+    # recomputed with one statement per table
+    runs = []
+    for day in days:
+        if runs and day == runs[-1][1] + timedelta(days=1):
+            runs[-1][1] = day
+        else:
+            runs.append([day, day])
+    return runs
+
+
+# --- Rollup refresh ---
+# Appointment days are refreshed from a high-water mark on
+# Appointment.updated_at: every day with a row changed since the last
+# refresh is recomputed in full with INSERT ... SELECT ... GROUP BY, which
+# makes re-running a day harmless. The mark is moved back by
+# ANALYTICS_REFRESH_LAG seconds on each run so rows committed late by a
+# slow transaction are still picked up. Deleted rows leave no updated_at
+# behind, so deletes queue their days with invalidate_days() instead.
+# Scheduled minutes are rolled up day by day up to today; today is
+# recomputed until it is over.
+
+def invalidate_days(*criteria, model=Appointment):
+    # Call before deleting the appointments (or, with model, archived
+    # appointments) matching criteria; one INSERT ... SELECT DISTINCT,
+    # whatever the number of rows.
+    day = func.date(model.start_time)
+    db.session.execute(insert(AnalyticsDirtyDay).from_select(
+        ['day'],
+        select(day).distinct().where(*criteria, day.notin_(select(AnalyticsDirtyDay.day)))))
+
+
+def _rollup_appointments(first, last):
+    start = datetime.combine(first, time.min)
+    end = datetime.combine(last + timedelta(days=1), time.min)
+    # Live rows, plus archived ones when the range reaches the archive
+    rows = archive.appointment_rows(start, end)
+    day = func.date(rows.c.start_time)
+    hour = _hour(rows.c.start_time)
+
+    db.session.execute(delete(AppointmentDayRollup).where(AppointmentDayRollup.day.between(first, last)))
+    db.session.execute(insert(AppointmentDayRollup).from_select(
+        ['day', 'doctor_id', 'status', 'appointments', 'minutes'],
+        select(day, rows.c.doctor_id, rows.c.status, func.count(),
+               cast(func.sum(_minutes(rows.c.start_time, rows.c.end_time)), Integer))
+        .group_by(day, rows.c.doctor_id, rows.c.status)))
+
+    db.session.execute(delete(HourRollup).where(HourRollup.day.between(first, last)))
+    db.session.execute(insert(HourRollup).from_select(
+        ['day', 'department_id', 'hour', 'appointments'],
+        select(day, Doctor.specialization_id, hour, func.count())
+        .join(Doctor, Doctor.id == rows.c.doctor_id)
+        .where(rows.c.status.notin_(RELEASED_STATUSES))
+        .group_by(day, Doctor.specialization_id, hour)))
+
+
+def _rollup_schedules(first, last):
+    db.session.execute(delete(ScheduleDayRollup).where(ScheduleDayRollup.day.between(first, last)))
+    while first <= last:
+        days = min(SCHEDULE_CHUNK_DAYS, (last - first).days + 1)
+        grid = schedules.load_grid(first, days)
+        rows = [{'day': first + timedelta(days=offset), 'doctor_id': doctor_id,
+                 'scheduled_minutes': count * grid.minutes}
+                for doctor_id in grid.slots
+                for offset, count in enumerate(grid.daily_counts(doctor_id)) if count]
+        if rows:
+            db.session.execute(insert(ScheduleDayRollup), rows)
+        first += timedelta(days=days)
+
+
+def refresh(rebuild=False):
+    now = datetime.utcnow()
+    today = date.today()
+
+    # Read the new mark before looking for changed rows: anything written
+    # in between is seen now and again on the next run, never skipped.
+    newest = db.session.query(func.max(Appointment.updated_at)).scalar()
+    mark = None if rebuild else _watermark('appointments')
+    if mark is None:
+        db.session.execute(delete(AppointmentDayRollup))
+        db.session.execute(delete(HourRollup))
+        db.session.execute(delete(AnalyticsDirtyDay))
+        rows = archive.appointment_rows()
+        first, last = db.session.query(func.min(rows.c.start_time), func.max(rows.c.start_time)).one()
+        runs = [[_as_datetime(first).date(), _as_datetime(last).date()]] if first else []
+    else:
+        since = mark.value - timedelta(seconds=current_app.config.get('ANALYTICS_REFRESH_LAG', 300))
+        changed = db.session.query(func.date(Appointment.start_time)).distinct() \
+            .filter(Appointment.updated_at > since)
+        dirty = [day for (day,) in db.session.query(AnalyticsDirtyDay.day)]
+        runs = _day_runs(sorted({_as_date(day) for (day,) in changed} | set(dirty)))
+        for chunk in range(0, len(dirty), 500):
+            db.session.execute(delete(AnalyticsDirtyDay).where(AnalyticsDirtyDay.day.in_(dirty[chunk:chunk + 500])))
+    for first, last in runs:
+        _rollup_appointments(first, last)
+    _set_watermark('appointments', newest or (mark.value if mark else now))
+
+    mark = None if rebuild else _watermark('schedules')
+    if mark is None:
+        db.session.execute(delete(ScheduleDayRollup))
+        rows = archive.appointment_rows()
+        earliest = db.session.query(func.min(rows.c.start_time)).scalar()
+        first = min(_as_datetime(earliest).date(), today) if earliest else today
+    else:
+        first = mark.value.date() + timedelta(days=1)
+    _rollup_schedules(first, today)
+    _set_watermark('schedules', datetime.combine(today - timedelta(days=1), time.min))
+
+    db.session.commit()
+    return {'appointment_days': sum((last - first).days + 1 for first, last in runs),
+            'schedule_days': max(0, (today - first).days + 1)}
+
+
+def refreshed_at():
+    # Reports only read this; refreshing is the job worker's (or cron's)
+    mark = _watermark('appointments')
+    return mark.refreshed_at if mark else None
+
+
+def refresh_if_stale():
+    # Called from the job worker's housekeeping: refreshes at most every
+    # ANALYTICS_MAX_AGE seconds. A refresh that collides with another
+    # worker's is dropped; the next round tries again.
+    max_age = current_app.config.get('ANALYTICS_MAX_AGE', 300)
+    mark = _watermark('appointments')
+    if mark is not None and mark.refreshed_at and \
+            mark.refreshed_at >= datetime.utcnow() - timedelta(seconds=max_age):
+        return mark.refreshed_at
+    try:
+        refresh()
+    except SQLAlchemyError:
+        db.session.rollback()
+    mark = _watermark('appointments')
+    return mark.refreshed_at if mark else None
+
+
+# --- Reports ---
+# Every query below reads the rollup tables only; a year of data is at
+# most a few hundred thousand small rows, scanned through their (day, ...)
+# primary keys.
+
+def _bucket(day, bucket):
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())
+    if bucket == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def _rate(part, whole):
+    return round(part / whole, 4) if whole else None
+
+
+def report(start, end, bucket='day', department_id=None):
+    R = AppointmentDayRollup
+    today = date.today()
+    canceled = case((R.status.in_(RELEASED_STATUSES), R.appointments), else_=0)
+    completed = case((R.status == 'Completed', R.appointments), else_=0)
+    no_show = case((and_(R.day < today, R.status.in_(PENDING_STATUSES)), R.appointments), else_=0)
+    booked_minutes = case((R.status.notin_(RELEASED_STATUSES), R.minutes), else_=0)
+    totals = (func.sum(R.appointments), func.sum(canceled), func.sum(completed),
+              func.sum(no_show), func.sum(booked_minutes))
+
+    by_doctor = select(R.doctor_id, *totals).where(R.day.between(start, end)).group_by(R.doctor_id)
+    by_day = select(R.day, *totals).where(R.day.between(start, end)).group_by(R.day).order_by(R.day)
+    scheduled = select(ScheduleDayRollup.doctor_id, func.sum(ScheduleDayRollup.scheduled_minutes)) \
+        .where(ScheduleDayRollup.day.between(start, end)).group_by(ScheduleDayRollup.doctor_id)
+    hours = select(HourRollup.hour, func.sum(HourRollup.appointments)) \
+        .where(HourRollup.day.between(start, end)).group_by(HourRollup.hour).order_by(HourRollup.hour)
+    if department_id:
+        in_department = select(Doctor.id).where(Doctor.specialization_id == department_id)
+        by_doctor = by_doctor.where(R.doctor_id.in_(in_department))
+        by_day = by_day.where(R.doctor_id.in_(in_department))
+        scheduled = scheduled.where(ScheduleDayRollup.doctor_id.in_(in_department))
+        hours = hours.where(HourRollup.department_id == department_id)
+
+    counts = {doctor_id: values for doctor_id, *values in db.session.execute(by_doctor)}
+    scheduled = dict(db.session.execute(scheduled).all())
+    doctor_ids = set(counts) | set(scheduled)
+    names = {}
+    if doctor_ids:
+        names = {doctor_id: (name, department_id, department)
+                 for doctor_id, name, department_id, department in db.session.execute(
+                     select(Doctor.id, User.full_name, Department.id, Department.name)
+                     .join(User, User.id == Doctor.user_id)
+                     .join(Department, Department.id == Doctor.specialization_id)
+                     .where(Doctor.id.in_(doctor_ids)))}
+
+    doctors, departments = [], {}
+    # Rollups of deleted doctors are left out
+    for doctor_id in sorted(doctor_ids & set(names), key=lambda doctor_id: names[doctor_id][0]):
+        appointments, canceled, completed, no_show, booked = counts.get(doctor_id, (0, 0, 0, 0, 0))
+        name, dept_id, dept_name = names[doctor_id]
+        row = {'doctor_id': doctor_id, 'doctor': name, 'department': dept_name,
+               'appointments': appointments, 'canceled': canceled, 'completed': completed,
+               'no_show': no_show, 'booked_minutes': booked,
+               'scheduled_minutes': scheduled.get(doctor_id, 0)}
+        doctors.append(row)
+        total = departments.setdefault(dept_id, dict(dict.fromkeys(TOTALS, 0), department=dept_name))
+        for key in TOTALS:
+            total[key] += row[key]
+
+    timeline = {}
+    for day, *values in db.session.execute(by_day):
+        key = _bucket(_as_date(day), bucket)
+        entry = timeline.get(key)
+        timeline[key] = values if entry is None else [a + b for a, b in zip(entry, values)]
+
+    for row in doctors + list(departments.values()):
+        row['utilization'] = _rate(row['booked_minutes'], row['scheduled_minutes'])
+        row['cancel_rate'] = _rate(row['canceled'], row['appointments'])
+        row['no_show_rate'] = _rate(row['no_show'], row['appointments'])
+
+    return {
+        'start': start.isoformat(), 'end': end.isoformat(), 'bucket': bucket,
+        'departments': sorted(departments.values(), key=lambda row: row['department']),
+        'doctors': doctors,
+        'timeline': [{'period': key.isoformat(), 'appointments': appointments, 'canceled': canceled,
+                      'completed': completed, 'no_show': no_show, 'booked_minutes': booked}
+                     for key, (appointments, canceled, completed, no_show, booked) in timeline.items()],
+        'peak_hours': [{'hour': hour, 'appointments': count} for hour, count in db.session.execute(hours)],
+    }
+
+
+def init_commands(app):
+    @app.cli.command('refresh-analytics')
+    @click.option('--rebuild', is_flag=True, help='Recompute every rollup from scratch.')
+    def refresh_analytics_command(rebuild):
+        result = refresh(rebuild=rebuild)
+        click.echo(f"Rolled up {result['appointment_days']} appointment day(s) "
+                   f"and {result['schedule_days']} schedule day(s).")
@@ -1,28 +1,47 @@
-from flask import Flask, render_template
-from werkzeug.security import generate_password_hash
-app = Flask(__name__)
+from flask import Flask
 
-from model import db, User  
 import routes
 import config
+import database
+import migrations
+import diagnostics
+import stats
+import search_index
+import bulk_io
+import analytics
+import archive
+import instrumentation
+import fragments
+import jobs
+import replicas
+import tenants
 
-routes.init_routes(app)
-config.apply_config(app)
-db.init_app(app)
 
-with app.app_context(): 
-    db.create_all()
-    admin = User.query.filter_by(role='admin').first()
-    if not admin:
-        admin_user = User(
-            full_name='System Admin', 
-            username='admin',
-            password_hash=generate_password_hash('admin123'),
-            email='admin@hospital.com',
-            role='admin'
-        )
-        db.session.add(admin_user)
-        db.session.commit()
+def create_app():
+    # No database work happens here; run `flask init-db` once per
+    # deployment to create the schema and the admin account.
+    app = Flask(__name__)
+    config.apply_config(app)
+    database.init_app(app)
+    tenants.init_app(app)
+    replicas.init_app(app)
+    instrumentation.init_app(app)
+    fragments.init_app(app)
+
+    routes.init_routes(app)
+    migrations.init_commands(app)
+    diagnostics.init_commands(app)
+    stats.init_commands(app)
+    search_index.init_app(app)
+    bulk_io.init_commands(app)
+    analytics.init_commands(app)
+    archive.init_commands(app)
+    jobs.init_commands(app)
+    return app
+
 
 if __name__ == '__main__':
+    app = create_app()
+    with app.app_context():
+        migrations.init_db()
     app.run(debug=True)
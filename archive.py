@@ -0,0 +1,123 @@
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from sqlalchemy import delete, func, insert, select, union_all
+
+from model import db, Appointment, Treatment, PrescriptionItem, \
+    ArchivedAppointment, ArchivedTreatment, ArchivedPrescriptionItem
+from pagination import encode_cursor, keyset_page
+
+
+# Only appointments in a final status are archived; anything still Booked
+# or Confirmed stays in the live table whatever its age.
+ARCHIVE_STATUSES = ('Completed', 'Canceled')
+
+APPOINTMENT_COLUMNS = ('id', 'patient_id', 'doctor_id', 'start_time', 'end_time', 'status')
+
+
+# --- Moving rows ---
+# Each batch copies the oldest archivable appointments, their treatments
+# and prescription items with INSERT ... SELECT, deletes the originals and
+# commits, so a run holds locks for one batch at a time and can stop after
+# any of them.
+
+def cutoff(now=None):
+    return (now or datetime.now()) - timedelta(days=current_app.config.get('ARCHIVE_AFTER_DAYS', 365))
+
+
+def _copy(target, source, criterion):
+    columns = [column.name for column in target.__table__.columns if column.name in source.__table__.c]
+    db.session.execute(insert(target).from_select(
+        columns, select(*[source.__table__.c[name] for name in columns]).where(criterion)))
+
+
+def archive_batch(before, batch_size):
+    ids = [id_ for (id_,) in db.session.query(Appointment.id)
+           .filter(Appointment.start_time < before, Appointment.status.in_(ARCHIVE_STATUSES))
+           .order_by(Appointment.start_time, Appointment.id)
+           .limit(batch_size)]
+    if not ids:
+        return 0
+    treatment_ids = select(Treatment.id).where(Treatment.appointment_id.in_(ids))
+
+    _copy(ArchivedAppointment, Appointment, Appointment.id.in_(ids))
+    _copy(ArchivedTreatment, Treatment, Treatment.appointment_id.in_(ids))
+    _copy(ArchivedPrescriptionItem, PrescriptionItem, PrescriptionItem.treatment_id.in_(treatment_ids))
+    # Children first, so this does not depend on FK enforcement being on
+    db.session.execute(delete(PrescriptionItem).where(PrescriptionItem.treatment_id.in_(treatment_ids)))
+    db.session.execute(delete(Treatment).where(Treatment.appointment_id.in_(ids)))
+    db.session.execute(delete(Appointment).where(Appointment.id.in_(ids)))
+    db.session.commit()
+    return len(ids)
+
+
+def archive(before=None, batch_size=None, max_batches=None):
+    before = before or cutoff()
+    batch_size = batch_size or current_app.config.get('ARCHIVE_BATCH_SIZE', 1000)
+    moved = batches = 0
+    while max_batches is None or batches < max_batches:
+        count = archive_batch(before, batch_size)
+        if not count:
+            break
+        moved += count
+        batches += 1
+    return moved
+
+
+# --- Reading across both tables ---
+# Archived rows are all older than the horizon (the newest archived
+# start_time), so a read whose range ends after it never touches the
+# archive. Only reads that reach back past it pay for the second query.
+
+def horizon():
+    # Served by ix_archived_appointment_start_time_id; None when empty
+    return db.session.query(func.max(ArchivedAppointment.start_time)).scalar()
+
+
+def reaches(start):
+    newest = horizon()
+    return newest is not None and (start is None or start <= newest)
+
+
+def appointment_rows(start=None, end=None):
+    # Subquery with APPOINTMENT_COLUMNS for start_time in [start, end)
+    def branch(model):
+        query = select(*[getattr(model, name).label(name) for name in APPOINTMENT_COLUMNS])
+        if start is not None:
+            query = query.where(model.start_time >= start)
+        if end is not None:
+            query = query.where(model.start_time < end)
+        return query
+
+    if not reaches(start):
+        return branch(Appointment).subquery('appointments')
+    return union_all(branch(Appointment), branch(ArchivedAppointment)).subquery('appointments')
+
+
+def keyset_page_with_archive(live, archived, cursor, limit, key_fn):
+    # live and archived are (query, [start_time, id] columns) pairs; pages
+    # run newest first over both, with the same cursor format as
+    # pagination.keyset_page.
+    rows, next_cursor = keyset_page(live[0], live[1], cursor, limit, key_fn, descending=True)
+    newest = horizon()
+    if newest is None or (next_cursor is not None and key_fn(rows[-1])[0] > newest):
+        return rows, next_cursor
+
+    older, older_cursor = keyset_page(archived[0], archived[1], cursor, limit, key_fn, descending=True)
+    rows = sorted(rows + older, key=key_fn, reverse=True)
+    if len(rows) > limit or next_cursor or older_cursor:
+        rows = rows[:limit]
+        return rows, encode_cursor(key_fn(rows[-1]))
+    return rows, None
+
+
+def init_commands(app):
+    @app.cli.command('archive-appointments')
+    @click.option('--before', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+                  help='Defaults to ARCHIVE_AFTER_DAYS ago.')
+    @click.option('--batch-size', type=int, default=None)
+    @click.option('--max-batches', type=int, default=None)
+    def archive_appointments_command(before, batch_size, max_batches):
+        moved = archive(before, batch_size, max_batches)
+        click.echo(f'Archived {moved} appointment(s).')
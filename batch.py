@@ -0,0 +1,184 @@
+from collections import Counter
+from datetime import datetime, timedelta
+
+from model import db, User, Doctor, Patient, DoctorSchedule, Appointment
+from schedules import RELEASED_STATUSES
+from bulk_io import chunked
+import stats
+import identity
+import agenda
+import removal
+import live
+
+
+# Kept well below SQLite's bound-parameter limit
+ID_CHUNK = 500
+
+
+class BatchError(Exception):
+    pass
+
+
+# --- Batch results ---
+# Every batch action returns one outcome per requested id, so the caller
+# can see exactly which rows changed and why the others did not.
+
+class BatchResult:
+    def __init__(self):
+        self.outcomes = {}
+
+    def set(self, ids, outcome):
+        for id_ in ids:
+            self.outcomes[id_] = outcome
+
+    def ids(self, outcome):
+        return [id_ for id_, value in self.outcomes.items() if value == outcome]
+
+    def counts(self):
+        return dict(Counter(self.outcomes.values()))
+
+    def as_dict(self):
+        return {'counts': self.counts(),
+                'results': {str(id_): outcome for id_, outcome in sorted(self.outcomes.items())}}
+
+
+def parse_ids(values):
+    # Accepts repeated fields and/or comma-separated lists: ['1,2', '3']
+    ids = []
+    for value in values:
+        for part in str(value).replace(',', ' ').split():
+            try:
+                ids.append(int(part))
+            except ValueError:
+                raise BatchError(f'Invalid id: {part}')
+    return list(dict.fromkeys(ids))
+
+
+def _rows(columns, id_column, ids):
+    rows = []
+    for chunk in chunked(ids, ID_CHUNK):
+        rows.extend(db.session.query(*columns).filter(id_column.in_(chunk)).all())
+    return rows
+
+
+def _execute_in_chunks(statement, id_column, ids):
+    for chunk in chunked(ids, ID_CHUNK):
+        db.session.execute(statement.where(id_column.in_(chunk)),
+                           execution_options={'synchronize_session': False})
+
+
+# --- Appointment status ---
+
+def appointment_ids(ids=None, doctor_id=None, day=None, status=None):
+    # Either explicit ids or a filter anchored on one doctor, e.g. every
+    # Booked appointment of doctor X on day D. Served by
+    # ix_appointment_doctor_start.
+    if ids:
+        return ids
+    if not doctor_id:
+        raise BatchError('Select appointment ids or a doctor to filter on.')
+    query = db.session.query(Appointment.id).filter(Appointment.doctor_id == doctor_id)
+    if day:
+        start = datetime.combine(day, datetime.min.time())
+        query = query.filter(Appointment.start_time >= start,
+                             Appointment.start_time < start + timedelta(days=1))
+    if status:
+        query = query.filter(Appointment.status == status)
+    return [id_ for (id_,) in query.order_by(Appointment.start_time, Appointment.id)]
+
+
+def update_appointment_statuses(ids, new_status):
+    if new_status not in stats.APPOINTMENT_STATUSES:
+        raise BatchError(f"Invalid status: {new_status}. Must be one of: {', '.join(stats.APPOINTMENT_STATUSES)}")
+    result = BatchResult()
+    rows = {row.id: row for row in _rows(
+        (Appointment.id, Appointment.doctor_id, Appointment.start_time, Appointment.status),
+        Appointment.id, ids)}
+    result.set([id_ for id_ in ids if id_ not in rows], 'not found')
+    result.set([id_ for id_ in ids if id_ in rows and rows[id_].status == new_status], 'unchanged')
+    changing = [rows[id_] for id_ in ids if id_ in rows and rows[id_].status != new_status]
+
+    # Reviving a canceled appointment must not double-book its slot
+    if new_status not in RELEASED_STATUSES:
+        reviving = [row for row in changing if row.status in RELEASED_STATUSES]
+        taken = set()
+        for chunk in chunked(reviving, ID_CHUNK):
+            taken.update(db.session.query(Appointment.doctor_id, Appointment.start_time).filter(
+                Appointment.doctor_id.in_({row.doctor_id for row in chunk}),
+                Appointment.start_time.in_({row.start_time for row in chunk}),
+                Appointment.status.notin_(RELEASED_STATUSES)).all())
+        kept = []
+        for row in changing:
+            slot = (row.doctor_id, row.start_time)
+            if row.status in RELEASED_STATUSES and slot in taken:
+                result.set([row.id], 'slot taken')
+                continue
+            if row.status in RELEASED_STATUSES:
+                taken.add(slot)
+            kept.append(row)
+        changing = kept
+
+    # One UPDATE for every changed row; updated_at is set by its onupdate
+    _execute_in_chunks(db.update(Appointment).values(status=new_status), Appointment.id,
+                       [row.id for row in changing])
+    for old_status, count in Counter(row.status for row in changing).items():
+        stats.bump(stats.status_key(old_status), -count)
+    stats.bump(stats.status_key(new_status), len(changing))
+    result.set([row.id for row in changing], 'updated')
+    live.appointments_changed(changing, new_status)
+    db.session.commit()
+
+    for doctor_id in {row.doctor_id for row in changing}:
+        agenda.invalidate(doctor_id)
+    return result
+
+
+# --- Blacklisting ---
+
+def set_blacklisted(user_ids, blacklisted, acting_user_id=None):
+    result = BatchResult()
+    users = {row.id: row for row in _rows((User.id, User.role), User.id, user_ids)}
+    result.set([id_ for id_ in user_ids if id_ not in users], 'not found')
+    result.set([id_ for id_ in user_ids if id_ == acting_user_id], 'own account')
+
+    for model, role in ((Doctor, 'doctor'), (Patient, 'patient')):
+        targets = [id_ for id_ in user_ids
+                   if id_ in users and users[id_].role == role and id_ != acting_user_id]
+        profiles = dict(_rows((model.user_id, model.is_blacklisted), model.user_id, targets))
+        result.set([id_ for id_ in targets if id_ not in profiles], 'profile not found')
+        result.set([id_ for id_ in targets if id_ in profiles and profiles[id_] == blacklisted], 'unchanged')
+        changing = [id_ for id_ in targets if id_ in profiles and profiles[id_] != blacklisted]
+        _execute_in_chunks(db.update(model).values(is_blacklisted=blacklisted), model.user_id, changing)
+        result.set(changing, 'updated')
+    result.set([id_ for id_ in user_ids if id_ in users and id_ not in result.outcomes], 'unsupported role')
+    db.session.commit()
+
+    for user_id in result.ids('updated'):
+        identity.invalidate(user_id)
+    return result
+
+
+# --- Deletes ---
+
+def delete_schedules(schedule_ids):
+    result = BatchResult()
+    found = {id_ for (id_,) in _rows((DoctorSchedule.id,), DoctorSchedule.id, schedule_ids)}
+    result.set([id_ for id_ in schedule_ids if id_ not in found], 'not found')
+    deleting = [id_ for id_ in schedule_ids if id_ in found]
+    _execute_in_chunks(db.delete(DoctorSchedule), DoctorSchedule.id, deleting)
+    result.set(deleting, 'deleted')
+    live.schedules_removed(deleting)
+    db.session.commit()
+    return result
+
+
+def delete_doctors(doctor_ids):
+    # Removes the doctors with everything that belongs to them; see
+    # removal.py
+    result = BatchResult()
+    doctors = dict(_rows((Doctor.id, Doctor.user_id), Doctor.id, doctor_ids))
+    result.set([id_ for id_ in doctor_ids if id_ not in doctors], 'not found')
+    deleting = [id_ for id_ in doctor_ids if id_ in doctors]
+    removal.remove_users([doctors[id_] for id_ in deleting])
+    result.set(deleting, 'deleted')
+    return result
@@ -0,0 +1,88 @@
+"""Login latency benchmark.
+
+Drives POST /patient-login through Flask's test client from a pool of
+threads against a throwaway SQLite database and reports p50/p99 latency and
+throughput. Hash parameters come from the usual environment variables
+(PASSWORD_HASH_METHOD, PASSWORD_VERIFY_WORKERS, ...), so runs can be
+compared across settings:
+
+    python benchmarks/login_benchmark.py --concurrency 16 --requests 400
+    PASSWORD_HASH_METHOD=pbkdf2:sha256:600000 python benchmarks/login_benchmark.py
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--invalid-fraction', type=float, default=0.0,
+                        help='share of attempts using a wrong password')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='hms-bench-')
+    os.environ['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+
+    from app import create_app
+    from model import db, User
+    import migrations
+    import passwords
+
+    app = create_app()
+    with app.app_context():
+        migrations.init_db()
+        password_hash = passwords.hash_password('benchmark')
+        db.session.add_all(User(full_name=f'Bench User {i}', username=f'bench{i}',
+                                email=f'bench{i}@example.com', password_hash=password_hash)
+                           for i in range(args.users))
+        db.session.commit()
+
+    invalid_every = int(1 / args.invalid_fraction) if args.invalid_fraction else 0
+
+    def attempt(i):
+        client = app.test_client()
+        password = 'wrong' if invalid_every and i % invalid_every == 0 else 'benchmark'
+        started = time.perf_counter()
+        response = client.post('/patient-login', data={'username': f'bench{i % args.users}',
+                                                       'password': password})
+        elapsed = time.perf_counter() - started
+        return elapsed, response.status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(attempt, range(args.requests)))
+    wall = time.perf_counter() - started
+
+    latencies = [elapsed * 1000 for elapsed, _ in results]
+    report = {
+        'hash_method': app.config['PASSWORD_HASH_METHOD'],
+        'verify_workers': app.config['PASSWORD_VERIFY_WORKERS'],
+        'concurrency': args.concurrency,
+        'requests': args.requests,
+        'p50_ms': round(percentile(latencies, 0.50), 2),
+        'p99_ms': round(percentile(latencies, 0.99), 2),
+        'mean_ms': round(statistics.mean(latencies), 2),
+        'throughput_rps': round(args.requests / wall, 1),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
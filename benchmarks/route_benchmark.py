@@ -0,0 +1,420 @@
+"""Route benchmark.
+
+For each data scale (doctors:patients:appointments) builds a throwaway
+SQLite database with synthetic.generate(), then drives the main routes from
+a pool of threads, either in-process through Flask's test client or over
+HTTP against a local multi-worker server (--server: gunicorn with
+gunicorn.conf.py when installed, otherwise Werkzeug's forking server). Per
+route it reports latency percentiles, throughput, SQL statements per request
+and peak Python memory per request (the last two in test-client mode only),
+and can save the results as JSON and compare them with an earlier run:
+
+    python benchmarks/route_benchmark.py --scales 20:200:2000,100:2000:50000 --output before.json
+    python benchmarks/route_benchmark.py --scales 20:200:2000,100:2000:50000 --baseline before.json
+    python benchmarks/route_benchmark.py --server --workers 4 --concurrency 16 --routes admin_dashboard,login_patient
+
+Each scale runs in a fresh process, so module-level caches and memory
+measurements never carry over between scales. Everything runs offline.
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import platform
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from login_benchmark import percentile  # noqa: E402
+
+
+DEFAULT_SCALES = '20:200:2000,100:2000:50000'
+
+# path and data take the generated sample and the request number
+Route = namedtuple('Route', 'name role method path data')
+
+ROUTES = [
+    Route('login_patient', None, 'POST', lambda s, i: '/patient-login',
+          lambda s, i: {'username': s['patient_usernames'][i % len(s['patient_usernames'])], 'password': PASSWORD}),
+    Route('login_staff', None, 'POST', lambda s, i: '/doctor-admin-login',
+          lambda s, i: {'username': s['doctor_usernames'][i % len(s['doctor_usernames'])], 'password': PASSWORD}),
+    Route('admin_dashboard', 'admin', 'GET', lambda s, i: '/admin-dashboard', None),
+    Route('admin_appointments', 'admin', 'GET', lambda s, i: '/admin-dashboard/appointments', None),
+    Route('search_users', 'admin', 'POST', lambda s, i: '/search-users',
+          lambda s, i: {'query': s['search_terms'][i % len(s['search_terms'])]}),
+    Route('search_results', 'admin', 'GET',
+          lambda s, i: '/search-users/results?' + urllib.parse.urlencode(
+              {'query': s['search_terms'][i % len(s['search_terms'])]}), None),
+    Route('analytics', 'admin', 'GET', lambda s, i: '/admin/analytics?format=json', None),
+    Route('capacity', 'admin', 'GET', lambda s, i: '/admin/capacity?weeks=4', None),
+    Route('doctor_dashboard', 'doctor', 'GET', lambda s, i: '/doctor-dashboard', None),
+    Route('patient_dashboard', 'patient', 'GET', lambda s, i: '/patient-dashboard', None),
+    Route('patient_history', 'patient', 'GET', lambda s, i: '/patient-dashboard/history', None),
+    Route('doctor_slots', 'patient', 'GET',
+          lambda s, i: f"/doctors/{s['doctor_ids'][i % len(s['doctor_ids'])]}/slots?days=7", None),
+]
+
+PASSWORD = 'benchmark'
+ADMIN = ('admin', 'admin123')
+
+
+def parse_scale(text):
+    doctors, patients, appointments = (int(part) for part in text.split(':'))
+    return {'doctors': doctors, 'patients': patients, 'appointments': appointments}
+
+
+def scale_label(scale):
+    return f"{scale['doctors']}:{scale['patients']}:{scale['appointments']}"
+
+
+def credentials(role, sample, worker):
+    # Each worker thread signs in as its own doctor or patient
+    if role == 'admin':
+        return '/doctor-admin-login', ADMIN
+    if role == 'doctor':
+        names = sample['doctor_usernames']
+        return '/doctor-admin-login', (names[worker % len(names)], PASSWORD)
+    names = sample['patient_usernames']
+    return '/patient-login', (names[worker % len(names)], PASSWORD)
+
+
+def summarize(results, wall, peaks=None):
+    latencies = [elapsed * 1000 for elapsed, _, _ in results]
+    queries = [count for _, _, count in results if count is not None]
+    return {
+        'requests': len(results),
+        'errors': sum(1 for _, status, _ in results if status is None or status >= 400),
+        'statuses': {str(status): count for status, count in sorted(
+            Counter(status for _, status, _ in results).items(), key=lambda item: str(item[0]))},
+        'p50_ms': round(percentile(latencies, 0.50), 2),
+        'p95_ms': round(percentile(latencies, 0.95), 2),
+        'p99_ms': round(percentile(latencies, 0.99), 2),
+        'mean_ms': round(statistics.mean(latencies), 2),
+        'max_ms': round(max(latencies), 2),
+        'throughput_rps': round(len(results) / wall, 1),
+        'queries_median': statistics.median(queries) if queries else None,
+        'queries_max': max(queries) if queries else None,
+        'peak_kb': round(max(peaks) / 1024, 1) if peaks else None,
+    }
+
+
+# --- Test-client driver ---
+# SQL statements are counted per thread with a before_cursor_execute
+# listener; the test client runs each request on the calling thread.
+
+class ClientDriver:
+    def __init__(self, app, sample):
+        from model import db
+        self.app = app
+        self.sample = sample
+        self.local = threading.local()
+        with app.app_context():
+            self.engine = db.engine
+
+        def count(*args):
+            self.local.queries = getattr(self.local, 'queries', 0) + 1
+
+        from sqlalchemy import event
+        event.listen(self.engine, 'before_cursor_execute', count)
+
+    def _client(self, role, worker):
+        clients = self.local.__dict__.setdefault('clients', {})
+        if role not in clients:
+            client = self.app.test_client()
+            if role:
+                path, (username, password) = credentials(role, self.sample, worker)
+                client.post(path, data={'username': username, 'password': password})
+            clients[role] = client
+        return clients[role]
+
+    def request(self, route, i, worker=0):
+        # Logins get a fresh client so every request really signs in
+        client = self.app.test_client() if route.role is None else self._client(route.role, worker)
+        path = route.path(self.sample, i)
+        data = route.data(self.sample, i) if route.data else None
+        self.local.queries = 0
+        started = time.perf_counter()
+        response = client.open(path, method=route.method, data=data)
+        elapsed = time.perf_counter() - started
+        response.close()
+        return elapsed, response.status_code, self.local.queries
+
+    def close(self):
+        pass
+
+
+# --- HTTP driver ---
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _serve_werkzeug(port, workers):
+    import logging
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    from app import create_app
+    make_server('127.0.0.1', port, create_app(), processes=workers).serve_forever()
+
+
+class ServerDriver:
+    def __init__(self, sample, workers):
+        self.sample = sample
+        self.local = threading.local()
+        port = _free_port()
+        self.base = f'http://127.0.0.1:{port}'
+        try:
+            import gunicorn  # noqa: F401
+        except ImportError:
+            self.server = get_context('fork').Process(target=_serve_werkzeug, args=(port, workers), daemon=True)
+            self.server.start()
+        else:
+            env = dict(os.environ, BIND=f'127.0.0.1:{port}', WEB_CONCURRENCY=str(workers))
+            self.server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+                                           cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    self.close()
+                    raise RuntimeError('Benchmark server did not start.')
+                time.sleep(0.1)
+
+    def _opener(self):
+        return urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+                                           _NoRedirect())
+
+    def _open(self, opener, method, path, data):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        try:
+            with opener.open(urllib.request.Request(self.base + path, data=body, method=method)) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as error:
+            error.read()
+            return error.code
+
+    def _client(self, role, worker):
+        openers = self.local.__dict__.setdefault('openers', {})
+        if role not in openers:
+            opener = self._opener()
+            path, (username, password) = credentials(role, self.sample, worker)
+            self._open(opener, 'POST', path, {'username': username, 'password': password})
+            openers[role] = opener
+        return openers[role]
+
+    def request(self, route, i, worker=0):
+        opener = self._opener() if route.role is None else self._client(route.role, worker)
+        path = route.path(self.sample, i)
+        data = route.data(self.sample, i) if route.data else None
+        started = time.perf_counter()
+        try:
+            status = self._open(opener, route.method, path, data)
+        except OSError:
+            status = None
+        return time.perf_counter() - started, status, None
+
+    def close(self):
+        if isinstance(self.server, subprocess.Popen):
+            self.server.terminate()
+            self.server.wait()
+        else:
+            self.server.terminate()
+            self.server.join()
+
+
+# --- Running one scale ---
+
+def run_route(driver, route, requests, concurrency, warmup):
+    # Requests are dealt round-robin to the worker threads; worker w
+    # always sends as the same user
+    def work(worker):
+        return [driver.request(route, i, worker) for i in range(worker, requests, concurrency)]
+
+    for i in range(warmup):
+        driver.request(route, i)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = [result for batch in pool.map(work, range(concurrency)) for result in batch]
+    return results, time.perf_counter() - started
+
+
+def measure_memory(driver, route, samples):
+    peaks = []
+    tracemalloc.start()
+    try:
+        for i in range(samples):
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            driver.request(route, i)
+            peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+    finally:
+        tracemalloc.stop()
+    return peaks
+
+
+def run_scale(options, scale):
+    workdir = tempfile.mkdtemp(prefix='hms-bench-')
+    os.environ['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    # One log line per request would mostly measure the terminal
+    os.environ.setdefault('REQUEST_LOG', 'false')
+
+    from app import create_app
+    import migrations
+    import synthetic
+
+    app = create_app()
+    started = time.perf_counter()
+    with app.app_context():
+        migrations.init_db()
+        sample = synthetic.generate(scale['doctors'], scale['patients'], scale['appointments'], options['seed'])
+    generate_seconds = time.perf_counter() - started
+
+    driver = ServerDriver(sample, options['workers']) if options['server'] else ClientDriver(app, sample)
+    routes = {}
+    try:
+        for route in ROUTES:
+            if options['routes'] and route.name not in options['routes']:
+                continue
+            results, wall = run_route(driver, route, options['requests'], options['concurrency'], options['warmup'])
+            peaks = None
+            if not options['server'] and options['memory_samples']:
+                peaks = measure_memory(driver, route, options['memory_samples'])
+            routes[route.name] = summarize(results, wall, peaks)
+            print(f"  {route.name:<20} p50 {routes[route.name]['p50_ms']:>8} ms  "
+                  f"p95 {routes[route.name]['p95_ms']:>8} ms  "
+                  f"queries {routes[route.name]['queries_max']}", file=sys.stderr, flush=True)
+    finally:
+        driver.close()
+    return {'scale': scale, 'label': scale_label(scale),
+            'generate_seconds': round(generate_seconds, 2), 'routes': routes}
+
+
+# --- Comparing runs ---
+
+def compare(report, baseline, threshold, noise_ms):
+    # Regressions: p95 more than threshold (and noise_ms) slower, or more
+    # SQL statements per request than the baseline run
+    regressions = []
+    earlier = {(scale['label'], name): result
+               for scale in baseline['scales'] for name, result in scale['routes'].items()}
+    for scale in report['scales']:
+        for name, result in scale['routes'].items():
+            before = earlier.get((scale['label'], name))
+            if not before:
+                continue
+            slower = result['p95_ms'] > before['p95_ms'] * (1 + threshold) \
+                and result['p95_ms'] - before['p95_ms'] > noise_ms
+            more_queries = None not in (result['queries_max'], before['queries_max']) \
+                and result['queries_max'] > before['queries_max']
+            change = (result['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 if before['p95_ms'] else 0
+            line = (f"{scale['label']:<20} {name:<20} p95 {before['p95_ms']:>8} -> {result['p95_ms']:>8} ms "
+                    f"({change:+.0f}%)  queries {before['queries_max']} -> {result['queries_max']}")
+            if slower or more_queries:
+                regressions.append(line)
+            print(('REGRESSION ' if slower or more_queries else '           ') + line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scales', default=DEFAULT_SCALES,
+                        help='comma-separated doctors:patients:appointments triples')
+    parser.add_argument('--routes', default='', help='comma-separated route names (default: all)')
+    parser.add_argument('--requests', type=int, default=100, help='measured requests per route')
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--server', action='store_true', help='drive a local multi-worker server over HTTP')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--memory-samples', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare with the results in this JSON file')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='allowed p95 slowdown against the baseline (0.25 = 25%%)')
+    parser.add_argument('--noise-ms', type=float, default=1.0,
+                        help='p95 differences below this are never regressions')
+    parser.add_argument('--list', action='store_true', help='list the route names and exit')
+    args = parser.parse_args()
+
+    if args.list:
+        for route in ROUTES:
+            print(f"{route.name:<20} {route.method:<5} {route.role or 'anonymous':<10}")
+        return
+    names = {route.name for route in ROUTES}
+    selected = [name for name in args.routes.split(',') if name]
+    unknown = set(selected) - names
+    if unknown:
+        parser.error(f"unknown route(s): {', '.join(sorted(unknown))}")
+
+    options = {'routes': selected, 'requests': args.requests, 'warmup': args.warmup,
+               'concurrency': args.concurrency, 'server': args.server, 'workers': args.workers,
+               'memory_samples': args.memory_samples, 'seed': args.seed}
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    report = {
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'commit': commit,
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'mode': 'server' if args.server else 'test-client',
+            **{key: value for key, value in options.items() if key not in ('routes', 'server')},
+        },
+        'scales': [],
+    }
+
+    for text in args.scales.split(','):
+        scale = parse_scale(text)
+        print(f'Scale {scale_label(scale)}', file=sys.stderr, flush=True)
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+            report['scales'].append(pool.submit(run_scale, options, scale).result())
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as stream:
+            json.dump(report, stream, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as stream:
+            regressions = compare(report, json.load(stream), args.threshold, args.noise_ms)
+        if regressions:
+            print(f'{len(regressions)} regression(s) against {args.baseline}.', file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""Synthetic hospital data for the benchmarks.
+
+generate() fills an initialised database (migrations.init_db()) with N
+doctors, patients and appointments through bulk Core inserts, then brings
+the derived state up to date the way a real deployment would have it: the
+search index, the dashboard counters and the analytics rollups. Every
+generated user shares the password PASSWORD, hashed once with the
+configured method.
+"""
+import random
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import insert
+
+from model import db, User, Department, Doctor, Patient, DoctorSchedule, Appointment
+from bulk_io import chunked
+import analytics
+import passwords
+import search_index
+import stats
+
+
+PASSWORD = 'benchmark'
+
+FIRST_NAMES = ['Asha', 'Ben', 'Chen', 'Dana', 'Elif', 'Farid', 'Grace', 'Hugo', 'Ines', 'Jonas',
+               'Kira', 'Liam', 'Maya', 'Nikhil', 'Olga', 'Pablo', 'Quinn', 'Rosa', 'Sami', 'Tara']
+LAST_NAMES = ['Anders', 'Bose', 'Costa', 'Dubois', 'Evans', 'Fischer', 'Garcia', 'Hansen', 'Ito',
+              'Jensen', 'Khan', 'Lopez', 'Moreau', 'Novak', 'Okafor', 'Patel', 'Rossi', 'Silva']
+STATUSES = ['Booked', 'Confirmed', 'Completed', 'Completed', 'Canceled']
+
+# Morning clinics on weekdays; appointments fill these slots
+CLINIC_START = time(9)
+SLOTS_PER_DAY = 8
+SLOT_MINUTES = 30
+
+INSERT_CHUNK = 5000
+
+
+def _name(i):
+    return f'{FIRST_NAMES[i % len(FIRST_NAMES)]} {LAST_NAMES[i // len(FIRST_NAMES) % len(LAST_NAMES)]} {i}'
+
+
+def _insert(model, rows):
+    for chunk in chunked(rows, INSERT_CHUNK):
+        db.session.execute(insert(model), list(chunk))
+
+
+def _weekdays_around(today, count):
+    # count weekdays, two thirds in the past and one third ahead
+    day = today - timedelta(days=count * 7 // 5 * 2 // 3)
+    days = []
+    while len(days) < count:
+        if day.weekday() < 5:
+            days.append(day)
+        day += timedelta(days=1)
+    return days
+
+
+def generate(doctors, patients, appointments, seed=0):
+    # Returns the generated usernames, ids and search terms the route
+    # benchmark drives requests with.
+    rng = random.Random(seed)
+    password_hash = passwords.hash_password(PASSWORD)
+    now = datetime.utcnow()
+
+    departments = max(1, doctors // 10)
+    _insert(Department, [dict(name=f'Department {i}', description=f'Synthetic department {i}')
+                         for i in range(departments)])
+    department_ids = [id_ for (id_,) in db.session.query(Department.id).order_by(Department.id)]
+
+    _insert(User, [dict(full_name=f'Dr {_name(i)}', username=f'doctor{i}', email=f'doctor{i}@example.com',
+                        password_hash=password_hash, role='doctor', is_active=True, created_at=now)
+                   for i in range(doctors)])
+    _insert(User, [dict(full_name=_name(i), username=f'patient{i}', email=f'patient{i}@example.com',
+                        password_hash=password_hash, role='patient', is_active=True, created_at=now)
+                   for i in range(patients)])
+    user_ids = dict(db.session.query(User.username, User.id).filter(User.role != 'admin'))
+
+    _insert(Doctor, [dict(user_id=user_ids[f'doctor{i}'], specialization_id=department_ids[i % departments],
+                          contact_number=f'555-{i:06d}', licence_number=f'LIC-{i:06d}', is_blacklisted=False)
+                     for i in range(doctors)])
+    _insert(Patient, [dict(user_id=user_ids[f'patient{i}'],
+                           date_of_birth=date(1940, 1, 1) + timedelta(days=rng.randrange(365 * 80)),
+                           contact_number=f'0{i:09d}', is_blacklisted=False)
+                      for i in range(patients)])
+    doctor_ids = [id_ for (id_,) in db.session.query(Doctor.id).order_by(Doctor.id)]
+    patient_ids = [id_ for (id_,) in db.session.query(Patient.id).order_by(Patient.id)]
+
+    clinic_end = (datetime.combine(date.min, CLINIC_START)
+                  + timedelta(minutes=SLOTS_PER_DAY * SLOT_MINUTES)).time()
+    _insert(DoctorSchedule, [dict(doctor_id=doctor_id, weekday=weekday, start_time=CLINIC_START, end_time=clinic_end)
+                             for doctor_id in doctor_ids for weekday in range(5)])
+
+    # Appointment i takes the next free slot of doctor i % doctors, so the
+    # double-booking index is never violated
+    per_doctor = -(-appointments // doctors) if doctors else 0
+    days = _weekdays_around(date.today(), max(1, -(-per_doctor // SLOTS_PER_DAY)))
+
+    def appointment_rows():
+        for i in range(appointments if doctors and patients else 0):
+            slot = i // doctors
+            start = datetime.combine(days[slot // SLOTS_PER_DAY], CLINIC_START) \
+                + timedelta(minutes=slot % SLOTS_PER_DAY * SLOT_MINUTES)
+            yield dict(patient_id=rng.choice(patient_ids), doctor_id=doctor_ids[i % doctors],
+                       start_time=start, end_time=start + timedelta(minutes=SLOT_MINUTES),
+                       status=rng.choice(STATUSES), updated_at=now)
+
+    _insert(Appointment, appointment_rows())
+    db.session.commit()
+
+    search_index.rebuild()
+    stats.reconcile()
+    analytics.refresh(rebuild=True)
+    return {
+        'doctor_usernames': [f'doctor{i}' for i in range(doctors)],
+        'patient_usernames': [f'patient{i}' for i in range(patients)],
+        'doctor_ids': doctor_ids,
+        'search_terms': [LAST_NAMES[i % len(LAST_NAMES)] for i in range(8)] + ['Dr Maya', 'patient1'],
+    }
@@ -0,0 +1,117 @@
+from bisect import bisect_left
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from model import db, Doctor, Appointment, Patient
+from schedules import RELEASED_STATUSES, slot_minutes
+import schedules
+import stats
+import agenda
+import identity
+import live
+
+
+class BookingError(Exception):
+    pass
+
+
+# --- Busy-interval index ---
+
+class IntervalIndex:
+    # Sorted interval starts plus a running maximum of interval ends. Any
+    # interval that starts before `end` overlaps [start, end) iff the largest
+    # end among them is after `start`, so each probe is one bisect.
+
+    def __init__(self, intervals):
+        intervals = sorted(intervals)
+        self.starts = [start for start, _ in intervals]
+        self.max_ends = []
+        running = None
+        for _, end in intervals:
+            running = end if running is None or end > running else running
+            self.max_ends.append(running)
+
+    def overlaps(self, start, end):
+        i = bisect_left(self.starts, end)
+        return i > 0 and self.max_ends[i - 1] > start
+
+
+def busy_intervals(doctor_id, range_start, range_end):
+    return db.session.query(Appointment.start_time, Appointment.end_time) \
+        .filter(
+            Appointment.doctor_id == doctor_id,
+            Appointment.start_time < range_end,
+            Appointment.end_time > range_start,
+            Appointment.status.notin_(RELEASED_STATUSES)
+        ).all()
+
+
+def available_slots(doctor_id, start_date, days):
+    slots = schedules.load_grid(start_date, days, doctor_ids=[doctor_id]).intervals(doctor_id)
+    if not slots:
+        return []
+
+    busy = IntervalIndex(busy_intervals(doctor_id, slots[0][0], slots[-1][1]))
+    now = datetime.now()
+    return [(start, end) for start, end in slots
+            if start > now and not busy.overlaps(start, end)]
+
+
+# --- Booking ---
+
+def _patient_for_user(user):
+    # Returns (patient, created)
+    patient = Patient.query.filter_by(user_id=user.id).first()
+    if patient:
+        return patient, False
+    # Registration only creates the User row; the profile is created lazily
+    # the first time the patient books.
+    patient = Patient(user_id=user.id)
+    db.session.add(patient)
+    db.session.flush()
+    return patient, True
+
+
+def book_appointment(user, doctor_id, start_time):
+    doctor = db.session.get(Doctor, doctor_id)
+    if not doctor or doctor.is_blacklisted:
+        raise BookingError('This doctor is not accepting appointments.')
+
+    if start_time <= datetime.now():
+        raise BookingError('Appointments must be booked in the future.')
+
+    step = timedelta(minutes=slot_minutes())
+    end_time = start_time + step
+    # The requested start must be one of the doctor's slots for that day
+    # (schedule, validity dates and leave/holidays applied); this keeps every
+    # booking on the slot grid, which is what makes the unique
+    # (doctor_id, start_time) index a complete double-booking guard.
+    day_grid = schedules.load_grid(start_time.date(), 1, doctor_ids=[doctor_id])
+    if not day_grid.has_slot(doctor_id, start_time):
+        raise BookingError('The selected time is outside the doctor\'s schedule.')
+
+    if IntervalIndex(busy_intervals(doctor_id, start_time, end_time)).overlaps(start_time, end_time):
+        raise BookingError('This slot has just been taken. Please pick another time.')
+
+    patient, new_profile = _patient_for_user(user)
+    if patient.is_blacklisted:
+        raise BookingError('Your account is not allowed to book appointments.')
+
+    appointment = Appointment(patient_id=patient.id, doctor_id=doctor_id,
+                              start_time=start_time, end_time=end_time, status='Booked')
+    try:
+        db.session.add(appointment)
+        db.session.flush()
+        stats.appointment_added(appointment.status)
+        live.appointments_changed([appointment], appointment.status)
+        db.session.commit()
+    except IntegrityError:
+        # Lost the race against a concurrent booking for the same slot
+        db.session.rollback()
+        raise BookingError('This slot has just been taken. Please pick another time.')
+    agenda.invalidate(doctor_id)
+    if new_profile:
+        # The cached identity still has no patient profile
+        identity.invalidate(user.id)
+    return appointment
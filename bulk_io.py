@@ -0,0 +1,464 @@
+import csv
+import io
+import json
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, time
+from itertools import islice
+
+import click
+from flask import current_app
+from sqlalchemy import case, insert, select
+from sqlalchemy.orm import aliased
+
+from model import db, User, Doctor, Department, DoctorSchedule, Appointment, Patient
+from schedules import WEEKDAYS, RELEASED_STATUSES, ScheduleError, Window, parse_weekday, check_window, windows_overlap
+import passwords
+import search_index
+import stats
+import agenda
+import archive
+import tenants
+
+
+KINDS = ('doctors', 'patients', 'schedules', 'appointments')
+FORMATS = ('csv', 'jsonl')
+
+
+class BulkIOError(Exception):
+    pass
+
+
+# --- Reading and writing records ---
+
+def read_records(stream, fmt):
+    # Lazily yields one dict per input row; nothing is read ahead.
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+    elif fmt == 'jsonl':
+        for line in stream:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+    else:
+        raise BulkIOError(f'Unsupported format: {fmt}')
+
+
+def chunked(records, size):
+    records = iter(records)
+    while True:
+        chunk = list(islice(records, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _text(value):
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    return value
+
+
+def write_records(rows, columns, fmt):
+    # Yields the export one line at a time so it can be streamed.
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow([_text(value) for value in row])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+    elif fmt == 'jsonl':
+        for row in rows:
+            yield json.dumps({column: _text(value) for column, value in zip(columns, row)}) + '\n'
+    else:
+        raise BulkIOError(f'Unsupported format: {fmt}')
+
+
+def _parse_date(value):
+    return date.fromisoformat(value) if value else None
+
+
+def _parse_time(value):
+    return time.fromisoformat(value)
+
+
+def _parse_datetime(value):
+    return datetime.fromisoformat(value)
+
+
+# Raised by the parsers above for a missing column or an unparseable value;
+# importers catch these per row and skip the row.
+_ROW_ERRORS = (KeyError, TypeError, ValueError)
+
+
+def _row_error(error):
+    if isinstance(error, KeyError):
+        return f'missing {error.args[0]}'
+    return f'invalid value: {error}'
+
+
+# --- Import ---
+
+class ImportResult:
+    def __init__(self):
+        self.inserted = 0
+        self.skipped = []
+
+    def skip(self, record, reason):
+        self.skipped.append((record.get('username') or record.get('doctor_username') or '?', reason))
+
+    def as_dict(self):
+        return {'inserted': self.inserted, 'skipped': len(self.skipped),
+                'skipped_examples': self.skipped[:20]}
+
+
+def _department_map():
+    return {name: department_id for department_id, name in
+            db.session.execute(select(Department.id, Department.name))}
+
+
+def _ensure_departments(departments, names):
+    missing = sorted({name for name in names if name and name not in departments})
+    if missing:
+        created = db.session.execute(
+            insert(Department).returning(Department.id, Department.name, sort_by_parameter_order=True),
+            [{'name': name} for name in missing])
+        departments.update({name: department_id for department_id, name in created})
+
+
+def _new_accounts(chunk, result):
+    # Drops records that are incomplete, repeated within the chunk or that
+    # clash with an existing username, email or full name (one IN query per
+    # column for the whole chunk).
+    fresh = []
+    seen = {'username': set(), 'email': set(), 'full_name': set()}
+    for record in chunk:
+        if not record.get('username') or not record.get('email') or not record.get('full_name'):
+            result.skip(record, 'missing username, email or full_name')
+        elif not record.get('password') and not record.get('password_hash'):
+            result.skip(record, 'missing password')
+        elif any(record[field] in values for field, values in seen.items()):
+            result.skip(record, 'duplicate in file')
+        else:
+            for field, values in seen.items():
+                values.add(record[field])
+            fresh.append(record)
+
+    taken = {field: set() for field in seen}
+    for field in seen:
+        column = getattr(User, field)
+        taken[field].update(value for (value,) in db.session.execute(
+            select(column).where(column.in_(seen[field]))))
+
+    accounts = []
+    for record in fresh:
+        if any(record[field] in taken[field] for field in seen):
+            result.skip(record, 'already exists')
+        else:
+            accounts.append(record)
+    return accounts
+
+
+def _insert_users(accounts, role, hash_pool):
+    # Rows that already carry a password_hash are stored as-is; the rest are
+    # hashed together in a process pool.
+    plain = [account for account in accounts if not account.get('password_hash')]
+    for account, password_hash in zip(plain, passwords.hash_passwords(
+            [account['password'] for account in plain], pool=hash_pool)):
+        account['password_hash'] = password_hash
+
+    created = db.session.execute(
+        insert(User).returning(User.id, sort_by_parameter_order=True),
+        [{'full_name': account['full_name'], 'username': account['username'],
+          'email': account['email'], 'password_hash': account['password_hash'],
+          'role': role} for account in accounts])
+    return [user_id for (user_id,) in created]
+
+
+def _import_doctors(chunk, result, departments, hash_pool):
+    licences = {record['licence_number'] for record in chunk if record.get('licence_number')}
+    taken = {licence for (licence,) in db.session.execute(
+        select(Doctor.licence_number).where(Doctor.licence_number.in_(licences)))}
+    accounts = []
+    for account in _new_accounts(chunk, result):
+        licence = account.get('licence_number') or None
+        if not account.get('specialization'):
+            result.skip(account, 'missing specialization')
+        elif licence in taken:
+            result.skip(account, 'licence number already exists')
+        else:
+            if licence:
+                taken.add(licence)
+            accounts.append(account)
+    if not accounts:
+        return []
+    _ensure_departments(departments, [account['specialization'] for account in accounts])
+    user_ids = _insert_users(accounts, 'doctor', hash_pool)
+    db.session.execute(insert(Doctor), [
+        {'user_id': user_id, 'specialization_id': departments[account['specialization']],
+         'contact_number': account.get('contact_number'),
+         'licence_number': account.get('licence_number') or None}
+        for user_id, account in zip(user_ids, accounts)])
+    stats.bump('doctors', len(user_ids))
+    return user_ids
+
+
+def _import_patients(chunk, result, departments, hash_pool):
+    accounts = []
+    for account in _new_accounts(chunk, result):
+        try:
+            account['date_of_birth'] = _parse_date(account.get('date_of_birth'))
+        except _ROW_ERRORS as e:
+            result.skip(account, _row_error(e))
+            continue
+        accounts.append(account)
+    if not accounts:
+        return []
+    user_ids = _insert_users(accounts, 'patient', hash_pool)
+    db.session.execute(insert(Patient), [
+        {'user_id': user_id, 'contact_number': account.get('contact_number'),
+         'date_of_birth': account['date_of_birth'],
+         'medical_history_summary': account.get('medical_history_summary')}
+        for user_id, account in zip(user_ids, accounts)])
+    stats.bump('patients', len(user_ids))
+    return user_ids
+
+
+def _profile_ids(model, usernames):
+    return dict(db.session.execute(
+        select(User.username, model.id).join(model, model.user_id == User.id)
+        .where(User.username.in_(set(usernames)))).all())
+
+
+def _import_schedules(chunk, result, departments, hash_pool):
+    doctors = _profile_ids(Doctor, [record.get('doctor_username') for record in chunk])
+    # Existing windows of the chunk's doctors, so overlaps are skipped
+    # against the table and within the chunk without a query per row
+    windows = {}
+    if doctors:
+        for doctor_id, *fields in db.session.execute(
+                select(DoctorSchedule.doctor_id, DoctorSchedule.weekday, DoctorSchedule.start_time,
+                       DoctorSchedule.end_time, DoctorSchedule.effective_from, DoctorSchedule.effective_to)
+                .where(DoctorSchedule.doctor_id.in_(set(doctors.values())))):
+            windows.setdefault(doctor_id, []).append(Window(*fields))
+    rows = []
+    for record in chunk:
+        doctor_id = doctors.get(record.get('doctor_username'))
+        if doctor_id is None:
+            result.skip(record, 'unknown doctor')
+            continue
+        try:
+            window = Window(weekday=parse_weekday(record.get('weekday', record.get('day_of_week'))),
+                            start_time=_parse_time(record['start_time']),
+                            end_time=_parse_time(record['end_time']),
+                            effective_from=_parse_date(record.get('effective_from')),
+                            effective_to=_parse_date(record.get('effective_to')))
+            check_window(window)
+        except ScheduleError as e:
+            result.skip(record, str(e))
+            continue
+        except _ROW_ERRORS as e:
+            result.skip(record, _row_error(e))
+            continue
+        if any(windows_overlap(window, other) for other in windows.get(doctor_id, ())):
+            result.skip(record, 'overlaps an existing window')
+            continue
+        windows.setdefault(doctor_id, []).append(window)
+        rows.append({'doctor_id': doctor_id, **window._asdict()})
+    if rows:
+        db.session.execute(insert(DoctorSchedule), rows)
+    result.inserted += len(rows)
+    return []
+
+
+def _import_appointments(chunk, result, departments, hash_pool):
+    doctors = _profile_ids(Doctor, [record.get('doctor_username') for record in chunk])
+    patients = _profile_ids(Patient, [record.get('patient_username') for record in chunk])
+    candidates = []
+    for record in chunk:
+        doctor_id = doctors.get(record.get('doctor_username'))
+        patient_id = patients.get(record.get('patient_username'))
+        if doctor_id is None or patient_id is None:
+            result.skip(record, 'unknown doctor or patient')
+            continue
+        status = record.get('status') or 'Booked'
+        if status not in stats.APPOINTMENT_STATUSES:
+            result.skip(record, f'unknown status {status!r}')
+            continue
+        try:
+            start_time = _parse_datetime(record['start_time'])
+            end_time = _parse_datetime(record['end_time'])
+        except _ROW_ERRORS as e:
+            result.skip(record, _row_error(e))
+            continue
+        if end_time <= start_time:
+            result.skip(record, 'end_time must be after start_time')
+            continue
+        candidates.append((record, {'doctor_id': doctor_id, 'patient_id': patient_id,
+                                    'start_time': start_time, 'end_time': end_time,
+                                    'status': status}))
+
+    # Live appointments must respect uq_appointment_doctor_slot; check the
+    # whole chunk against the table in one query instead of failing the batch.
+    live = [row for _, row in candidates if row['status'] not in RELEASED_STATUSES]
+    booked = set()
+    if live:
+        booked = set(db.session.execute(
+            select(Appointment.doctor_id, Appointment.start_time)
+            .where(Appointment.doctor_id.in_({row['doctor_id'] for row in live}),
+                   Appointment.start_time.in_({row['start_time'] for row in live}),
+                   Appointment.status.notin_(RELEASED_STATUSES))).all())
+    rows = []
+    for record, row in candidates:
+        if row['status'] not in RELEASED_STATUSES:
+            slot = (row['doctor_id'], row['start_time'])
+            if slot in booked:
+                result.skip(record, 'slot already booked')
+                continue
+            booked.add(slot)
+        rows.append(row)
+
+    if rows:
+        db.session.execute(insert(Appointment), rows)
+        stats.bump('appointments', len(rows))
+        for status in {row['status'] for row in rows}:
+            stats.bump(stats.status_key(status), sum(1 for row in rows if row['status'] == status))
+    result.inserted += len(rows)
+    return []
+
+
+IMPORTERS = {
+    'doctors': _import_doctors,
+    'patients': _import_patients,
+    'schedules': _import_schedules,
+    'appointments': _import_appointments,
+}
+
+
+# Password hashing for account imports runs in one process pool per
+# process, created on first use and kept, so an upload does not pay for
+# spawning workers.
+
+_hash_pool = None
+_hash_pool_lock = threading.Lock()
+
+
+def _get_hash_pool(workers):
+    global _hash_pool
+    with _hash_pool_lock:
+        if _hash_pool is None:
+            _hash_pool = ProcessPoolExecutor(max_workers=workers)
+        return _hash_pool
+
+
+def import_records(kind, records, batch_size=None, hash_workers=None):
+    # Each batch is one transaction; a failing batch is rolled back on its
+    # own and does not undo batches that were already committed.
+    if kind not in IMPORTERS:
+        raise BulkIOError(f'Unknown import kind: {kind}')
+    batch_size = batch_size or current_app.config.get('IMPORT_BATCH_SIZE', 1000)
+    if hash_workers is None:
+        hash_workers = current_app.config.get('IMPORT_HASH_WORKERS', os.cpu_count() or 1)
+
+    result = ImportResult()
+    departments = _department_map()
+    # A single worker hashes in-process; schedules and appointments have
+    # no passwords
+    hash_pool = None
+    if hash_workers > 1 and kind in ('doctors', 'patients'):
+        hash_pool = _get_hash_pool(hash_workers)
+    try:
+        for chunk in chunked(records, batch_size):
+            try:
+                user_ids = IMPORTERS[kind](chunk, result, departments, hash_pool)
+                if user_ids:
+                    # Core inserts bypass the ORM flush hook, so index explicitly
+                    search_index.sync_users(db.session.connection(), user_ids)
+                    tenants.sync_logins(db.session, user_ids)
+                    result.inserted += len(user_ids)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+    finally:
+        if kind == 'appointments':
+            agenda.invalidate()
+    return result
+
+
+# --- Export ---
+# Rows are streamed from the database with yield_per, which uses a
+# server-side cursor where the driver supports one, so the full result set
+# is never held in memory.
+
+def _export_query(kind):
+    if kind == 'doctors':
+        return ['full_name', 'username', 'email', 'contact_number', 'specialization', 'licence_number'], \
+            select(User.full_name, User.username, User.email, Doctor.contact_number,
+                   Department.name, Doctor.licence_number) \
+            .join(Doctor, Doctor.user_id == User.id) \
+            .join(Department, Department.id == Doctor.specialization_id) \
+            .order_by(Doctor.id)
+    if kind == 'patients':
+        return ['full_name', 'username', 'email', 'contact_number', 'date_of_birth', 'medical_history_summary'], \
+            select(User.full_name, User.username, User.email, Patient.contact_number,
+                   Patient.date_of_birth, Patient.medical_history_summary) \
+            .join(Patient, Patient.user_id == User.id) \
+            .order_by(Patient.id)
+    if kind == 'schedules':
+        weekday = case({number: name for number, name in enumerate(WEEKDAYS)}, value=DoctorSchedule.weekday)
+        return ['doctor_username', 'weekday', 'start_time', 'end_time', 'effective_from', 'effective_to'], \
+            select(User.username, weekday, DoctorSchedule.start_time, DoctorSchedule.end_time,
+                   DoctorSchedule.effective_from, DoctorSchedule.effective_to) \
+            .join(Doctor, Doctor.id == DoctorSchedule.doctor_id) \
+            .join(User, User.id == Doctor.user_id) \
+            .order_by(DoctorSchedule.id)
+    if kind == 'appointments':
+        PatientUser = aliased(User)
+        DoctorUser = aliased(User)
+        # Archived appointments keep their ids, so ordering the union by id
+        # gives the same export as before they were archived
+        rows = archive.appointment_rows()
+        return ['patient_username', 'doctor_username', 'start_time', 'end_time', 'status'], \
+            select(PatientUser.username, DoctorUser.username, rows.c.start_time,
+                   rows.c.end_time, rows.c.status) \
+            .join(Patient, Patient.id == rows.c.patient_id) \
+            .join(PatientUser, PatientUser.id == Patient.user_id) \
+            .join(Doctor, Doctor.id == rows.c.doctor_id) \
+            .join(DoctorUser, DoctorUser.id == Doctor.user_id) \
+            .order_by(rows.c.id)
+    raise BulkIOError(f'Unknown export kind: {kind}')
+
+
+def export_records(kind, fmt):
+    columns, query = _export_query(kind)
+    rows = db.session.execute(query.execution_options(yield_per=1000))
+    return write_records(rows, columns, fmt)
+
+
+def init_commands(app):
+    @app.cli.command('import-data')
+    @click.argument('kind', type=click.Choice(KINDS))
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--format', 'fmt', type=click.Choice(FORMATS), default=None,
+                  help='Defaults to the file extension.')
+    @click.option('--batch-size', type=int, default=None)
+    @click.option('--hash-workers', type=int, default=None)
+    def import_data_command(kind, path, fmt, batch_size, hash_workers):
+        fmt = fmt or os.path.splitext(path)[1].lstrip('.').lower()
+        with open(path, newline='', encoding='utf-8') as stream:
+            result = import_records(kind, read_records(stream, fmt), batch_size, hash_workers)
+        click.echo(json.dumps(result.as_dict(), indent=2))
+
+    @app.cli.command('export-data')
+    @click.argument('kind', type=click.Choice(KINDS))
+    @click.option('--format', 'fmt', type=click.Choice(FORMATS), default='csv')
+    @click.option('--output', type=click.File('w', encoding='utf-8'), default='-')
+    def export_data_command(kind, fmt, output):
+        for chunk in export_records(kind, fmt):
+            output.write(chunk)
@@ -1,9 +1,79 @@
 from dotenv import load_dotenv
 import os
+import tempfile
 
 
 load_dotenv()
 def apply_config(app):
  app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
  app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('SQLALCHEMY_DATABASE_URI')
- app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = os.getenv('SQLALCHEMY_TRACK_MODIFICATIONS')
\ No newline at end of file
+ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = os.getenv('SQLALCHEMY_TRACK_MODIFICATIONS', 'false').lower() == 'true'
+ app.config['TENANTS'] = os.getenv('TENANTS', '')
+ app.config['TENANT_DATABASE_URI'] = os.getenv('TENANT_DATABASE_URI')
+ app.config['TENANT_HEADER'] = os.getenv('TENANT_HEADER', 'X-Hospital')
+ app.config['TENANT_DOMAIN'] = os.getenv('TENANT_DOMAIN', '')
+ app.config['TENANT_FANOUT_WORKERS'] = int(os.getenv('TENANT_FANOUT_WORKERS', 8))
+ app.config['TENANT_REPORT_TOKEN'] = os.getenv('TENANT_REPORT_TOKEN')
+ app.config['DEFAULT_TENANT'] = os.getenv('HMS_TENANT')
+ app.config['DATABASE_REPLICA_URIS'] = os.getenv('DATABASE_REPLICA_URIS', '')
+ app.config['REPLICA_MAX_LAG'] = float(os.getenv('REPLICA_MAX_LAG', 10))
+ app.config['REPLICA_LAG_CHECK_INTERVAL'] = float(os.getenv('REPLICA_LAG_CHECK_INTERVAL', 2))
+ app.config['REPLICA_STICKY_SECONDS'] = int(os.getenv('REPLICA_STICKY_SECONDS', 15))
+ app.config['DB_POOL_SIZE'] = int(os.getenv('DB_POOL_SIZE', 5))
+ app.config['DB_MAX_OVERFLOW'] = int(os.getenv('DB_MAX_OVERFLOW', 10))
+ app.config['DB_POOL_TIMEOUT'] = int(os.getenv('DB_POOL_TIMEOUT', 30))
+ app.config['DB_POOL_RECYCLE'] = int(os.getenv('DB_POOL_RECYCLE', 1800))
+ app.config['DB_POOL_PRE_PING'] = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+ app.config['SQLITE_JOURNAL_MODE'] = os.getenv('SQLITE_JOURNAL_MODE', 'WAL')
+ app.config['SQLITE_SYNCHRONOUS'] = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+ app.config['SQLITE_BUSY_TIMEOUT'] = int(os.getenv('SQLITE_BUSY_TIMEOUT', 5000))
+ app.config['SQLITE_FOREIGN_KEYS'] = os.getenv('SQLITE_FOREIGN_KEYS', 'ON')
+ app.config['DASHBOARD_PAGE_SIZE'] = int(os.getenv('DASHBOARD_PAGE_SIZE', 50))
+ app.config['APPOINTMENT_SLOT_MINUTES'] = int(os.getenv('APPOINTMENT_SLOT_MINUTES', 30))
+ app.config['BOOKING_HORIZON_DAYS'] = int(os.getenv('BOOKING_HORIZON_DAYS', 28))
+ app.config['SEARCH_RESULT_LIMIT'] = int(os.getenv('SEARCH_RESULT_LIMIT', 25))
+ app.config['SEARCH_BACKEND'] = os.getenv('SEARCH_BACKEND', 'auto')
+ app.config['PASSWORD_HASH_METHOD'] = os.getenv('PASSWORD_HASH_METHOD', 'scrypt')
+ app.config['PASSWORD_SALT_LENGTH'] = int(os.getenv('PASSWORD_SALT_LENGTH', 16))
+ app.config['PASSWORD_VERIFY_WORKERS'] = int(os.getenv('PASSWORD_VERIFY_WORKERS', 0))
+ app.config['LOGIN_MAX_ATTEMPTS'] = int(os.getenv('LOGIN_MAX_ATTEMPTS', 5))
+ app.config['LOGIN_MAX_ATTEMPTS_PER_ADDR'] = int(os.getenv('LOGIN_MAX_ATTEMPTS_PER_ADDR', 100))
+ app.config['LOGIN_THROTTLE_WINDOW'] = int(os.getenv('LOGIN_THROTTLE_WINDOW', 300))
+ app.config['IDENTITY_CACHE_TTL'] = int(os.getenv('IDENTITY_CACHE_TTL', 0))
+ app.config['IDENTITY_CACHE_SIZE'] = int(os.getenv('IDENTITY_CACHE_SIZE', 1024))
+ app.config['IMPORT_BATCH_SIZE'] = int(os.getenv('IMPORT_BATCH_SIZE', 1000))
+ app.config['IMPORT_HASH_WORKERS'] = int(os.getenv('IMPORT_HASH_WORKERS', os.cpu_count() or 1))
+ app.config['AGENDA_DAYS'] = int(os.getenv('AGENDA_DAYS', 7))
+ app.config['AGENDA_CACHE_TTL'] = int(os.getenv('AGENDA_CACHE_TTL', 60))
+ app.config['AGENDA_CACHE_SIZE'] = int(os.getenv('AGENDA_CACHE_SIZE', 1024))
+ app.config['ANALYTICS_REFRESH_LAG'] = int(os.getenv('ANALYTICS_REFRESH_LAG', 300))
+ app.config['ANALYTICS_MAX_AGE'] = int(os.getenv('ANALYTICS_MAX_AGE', 300))
+ app.config['ARCHIVE_AFTER_DAYS'] = int(os.getenv('ARCHIVE_AFTER_DAYS', 365))
+ app.config['ARCHIVE_BATCH_SIZE'] = int(os.getenv('ARCHIVE_BATCH_SIZE', 1000))
+ app.config['SQL_INSTRUMENTATION'] = os.getenv('SQL_INSTRUMENTATION', 'true').lower() == 'true'
+ app.config['SQL_SLOW_QUERY_MS'] = float(os.getenv('SQL_SLOW_QUERY_MS', 100))
+ app.config['SQL_EXPLAIN_SLOW'] = os.getenv('SQL_EXPLAIN_SLOW', 'true').lower() == 'true'
+ app.config['SQL_TOP_STATEMENTS'] = int(os.getenv('SQL_TOP_STATEMENTS', 3))
+ app.config['SERVER_TIMING'] = os.getenv('SERVER_TIMING', 'true').lower() == 'true'
+ app.config['REQUEST_LOG'] = os.getenv('REQUEST_LOG', 'true').lower() == 'true'
+ app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN')
+ app.config['FRAGMENT_CACHE_SIZE'] = int(os.getenv('FRAGMENT_CACHE_SIZE', 256))
+ app.config['LIVE_UPDATES'] = os.getenv('LIVE_UPDATES', 'true' if os.getenv('GUNICORN_WORKER_CLASS', 'sync') in ('gevent', 'eventlet') else 'false').lower() == 'true'
+ app.config['LIVE_POLL_INTERVAL'] = float(os.getenv('LIVE_POLL_INTERVAL', 1.0))
+ app.config['LIVE_HEARTBEAT'] = int(os.getenv('LIVE_HEARTBEAT', 15))
+ app.config['LIVE_STREAM_SECONDS'] = int(os.getenv('LIVE_STREAM_SECONDS', 25))
+ app.config['LIVE_EVENT_RETENTION'] = int(os.getenv('LIVE_EVENT_RETENTION', 3600))
+ app.config['LIVE_QUEUE_SIZE'] = int(os.getenv('LIVE_QUEUE_SIZE', 100))
+ app.config['JOB_OFFLOAD'] = os.getenv('JOB_OFFLOAD', 'false').lower() == 'true'
+ app.config['JOB_BATCH_SIZE'] = int(os.getenv('JOB_BATCH_SIZE', 500))
+ app.config['JOB_POLL_INTERVAL'] = float(os.getenv('JOB_POLL_INTERVAL', 1.0))
+ app.config['JOB_MAX_ATTEMPTS'] = int(os.getenv('JOB_MAX_ATTEMPTS', 5))
+ app.config['JOB_RETRY_DELAY'] = int(os.getenv('JOB_RETRY_DELAY', 10))
+ app.config['JOB_RETRY_MAX_DELAY'] = int(os.getenv('JOB_RETRY_MAX_DELAY', 3600))
+ app.config['JOB_HEARTBEAT'] = int(os.getenv('JOB_HEARTBEAT', 30))
+ app.config['JOB_LOCK_TIMEOUT'] = int(os.getenv('JOB_LOCK_TIMEOUT', 120))
+ app.config['JOB_HOUSEKEEPING'] = int(os.getenv('JOB_HOUSEKEEPING', 60))
+ app.config['JOB_RETENTION'] = int(os.getenv('JOB_RETENTION', 7 * 24 * 3600))
+ app.config['JOB_SPOOL_DIR'] = os.getenv('JOB_SPOOL_DIR', os.path.join(tempfile.gettempdir(), 'hms-job-spool'))
+ app.config['REMINDER_LEAD_HOURS'] = int(os.getenv('REMINDER_LEAD_HOURS', 24))
+ app.config['JINJA_BYTECODE_CACHE_DIR'] = os.getenv('JINJA_BYTECODE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'hms-jinja-bytecode'))
@@ -0,0 +1,143 @@
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import case, func
+from sqlalchemy.orm import aliased, joinedload, selectinload
+
+from model import db, User, Doctor, Department, DoctorSchedule, Appointment, Patient, Treatment, \
+    ArchivedAppointment, ArchivedTreatment
+from pagination import keyset_page
+import archive
+
+
+MAX_PAGE_SIZE = 200
+
+
+def page_size(requested=None):
+    default = current_app.config.get('DASHBOARD_PAGE_SIZE', 50)
+    try:
+        size = int(requested) if requested else default
+    except (TypeError, ValueError):
+        size = default
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+# --- Doctors: keyset on Doctor.id ---
+
+def _doctor_query():
+    return db.session.query(User, Doctor, Department) \
+        .join(Doctor, User.id == Doctor.user_id) \
+        .join(Department, Doctor.specialization_id == Department.id)
+
+
+DOCTOR_PAGE_KEY = [Doctor.id]
+
+
+def doctor_page(cursor=None, limit=None):
+    return keyset_page(_doctor_query(), DOCTOR_PAGE_KEY, cursor, page_size(limit),
+                       key_fn=lambda row: [row[1].id])
+
+
+def doctor_options():
+    # Only the three columns the schedule form's <select> needs, so the
+    # dropdown never drags full User/Doctor rows into the session.
+    return db.session.query(Doctor.id, User.full_name, Department.name) \
+        .join(User, Doctor.user_id == User.id) \
+        .join(Department, Doctor.specialization_id == Department.id) \
+        .order_by(User.full_name) \
+        .all()
+
+
+# --- Schedules: keyset on (doctor name, weekday, schedule id) ---
+
+def _schedule_query():
+    # The always-true range on full_name lets SQLite walk user's full_name
+    # index in page order and stop at the limit; without it the first page
+    # sorts every schedule.
+    return db.session.query(DoctorSchedule, Doctor, User) \
+        .join(Doctor, DoctorSchedule.doctor_id == Doctor.id) \
+        .join(User, Doctor.user_id == User.id) \
+        .filter(User.full_name >= '')
+
+
+SCHEDULE_PAGE_KEY = [User.full_name, DoctorSchedule.weekday, DoctorSchedule.id]
+
+
+def schedule_page(cursor=None, limit=None):
+    return keyset_page(_schedule_query(), SCHEDULE_PAGE_KEY, cursor, page_size(limit),
+                       key_fn=lambda row: [row[2].full_name, row[0].weekday, row[0].id])
+
+
+# --- Appointments: keyset on (start_time, id), newest first ---
+# Archived appointments are merged in once the pages reach back past the
+# archive horizon (see archive.py).
+
+def _appointment_query(model):
+    PatientUser = aliased(User)
+    DoctorUser = aliased(User)
+
+    return db.session.query(
+        model,
+        PatientUser.full_name.label('patient_name'),
+        DoctorUser.full_name.label('doctor_name')
+    ) \
+        .join(Patient, model.patient_id == Patient.id) \
+        .join(Doctor, model.doctor_id == Doctor.id) \
+        .join(PatientUser, Patient.user_id == PatientUser.id) \
+        .join(DoctorUser, Doctor.user_id == DoctorUser.id)
+
+
+def appointment_page(cursor=None, limit=None):
+    return archive.keyset_page_with_archive(
+        (_appointment_query(Appointment), [Appointment.start_time, Appointment.id]),
+        (_appointment_query(ArchivedAppointment), [ArchivedAppointment.start_time, ArchivedAppointment.id]),
+        cursor, page_size(limit), key_fn=lambda row: [row[0].start_time, row[0].id])
+
+
+# --- Patient history: keyset on (start_time, id) per patient ---
+# Loader strategies are explicit so a page costs the same number of queries
+# however many appointments it shows: the doctor, their user row and
+# department are joined into the appointment query (many-to-one, so LIMIT is
+# unaffected); treatment records and their prescription items come from one
+# selectin query each per page. Pages that reach the archive repeat this
+# for the archived tables.
+
+def _history_query(patient_id, model=Appointment, treatment=Treatment):
+    return model.query \
+        .filter(model.patient_id == patient_id) \
+        .options(
+            joinedload(model.doctor).joinedload(Doctor.user),
+            joinedload(model.doctor).joinedload(Doctor.department),
+            selectinload(model.treatment_record).joinedload(treatment.doctor_creator).joinedload(Doctor.user),
+            selectinload(model.treatment_record).selectinload(treatment.items),
+        )
+
+
+def upcoming_appointments(patient_id, limit=None):
+    return _history_query(patient_id) \
+        .filter(Appointment.start_time >= datetime.now()) \
+        .order_by(Appointment.start_time, Appointment.id) \
+        .limit(page_size(limit)) \
+        .all()
+
+
+def history_page(patient_id, cursor=None, limit=None):
+    live = _history_query(patient_id).filter(Appointment.start_time < datetime.now())
+    archived = _history_query(patient_id, ArchivedAppointment, ArchivedTreatment)
+    return archive.keyset_page_with_archive(
+        (live, [Appointment.start_time, Appointment.id]),
+        (archived, [ArchivedAppointment.start_time, ArchivedAppointment.id]),
+        cursor, page_size(limit), key_fn=lambda appt: [appt.start_time, appt.id])
+
+
+def history_counts(patient_id):
+    # (upcoming, past) in one pass over ix_appointment_patient_start
+    now = datetime.now()
+    upcoming, past = db.session.query(
+        func.count(case((Appointment.start_time >= now, 1))),
+        func.count(case((Appointment.start_time < now, 1))),
+    ).filter(Appointment.patient_id == patient_id).one()
+    # Everything archived is in the past
+    past += db.session.query(func.count(ArchivedAppointment.id)) \
+        .filter(ArchivedAppointment.patient_id == patient_id).scalar()
+    return upcoming, past
@@ -0,0 +1,70 @@
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+
+from model import db
+
+
+# --- Engine setup ---
+# Pool sizing comes from config (DB_POOL_*). SQLite gets per-connection
+# pragmas instead: WAL lets readers run alongside a writer, synchronous
+# NORMAL is safe under WAL, and busy_timeout makes concurrent writers wait
+# rather than fail with "database is locked". foreign_keys turns on FK
+# enforcement, which SQLite leaves off by default; the ON DELETE CASCADE
+# rules in model.py depend on it.
+
+def engine_options(app, uri=None):
+    url = make_url(uri or app.config['SQLALCHEMY_DATABASE_URI'])
+    options = {'pool_pre_ping': app.config['DB_POOL_PRE_PING']}
+    if url.get_backend_name() == 'sqlite':
+        if url.database in (None, '', ':memory:'):
+            # In-memory databases use a single-connection pool
+            return options
+        options['connect_args'] = {'timeout': app.config['SQLITE_BUSY_TIMEOUT'] / 1000}
+    else:
+        options['pool_recycle'] = app.config['DB_POOL_RECYCLE']
+    options['pool_size'] = app.config['DB_POOL_SIZE']
+    options['max_overflow'] = app.config['DB_MAX_OVERFLOW']
+    options['pool_timeout'] = app.config['DB_POOL_TIMEOUT']
+    return options
+
+
+def _sqlite_pragmas(app):
+    pragmas = {
+        'journal_mode': app.config['SQLITE_JOURNAL_MODE'],
+        'synchronous': app.config['SQLITE_SYNCHRONOUS'],
+        'busy_timeout': app.config['SQLITE_BUSY_TIMEOUT'],
+        'foreign_keys': app.config['SQLITE_FOREIGN_KEYS'],
+    }
+
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+    return on_connect
+
+
+def current_engine():
+    # The engine db.session uses here; a hospital's own in multi-hospital
+    # deployments (see tenants.py)
+    return db.session.get_bind()
+
+
+def make_engine(app, uri):
+    # An engine set up like the app's own, for databases beside it (the
+    # per-hospital databases in tenants.py)
+    engine = create_engine(uri, **engine_options(app, uri))
+    if engine.dialect.name == 'sqlite':
+        event.listen(engine, 'connect', _sqlite_pragmas(app))
+    return engine
+
+
+def init_app(app):
+    # Call after config is applied. Creating the engine opens no connection;
+    # the first one is made on the first query.
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app))
+    db.init_app(app)
+    with app.app_context():
+        if db.engine.dialect.name == 'sqlite':
+            event.listen(db.engine, 'connect', _sqlite_pragmas(app))
@@ -0,0 +1,139 @@
+import sys
+from datetime import datetime
+
+import click
+from sqlalchemy import event, text
+
+from model import db, User, DoctorSchedule, Appointment, PrescriptionItem, AppointmentDayRollup
+from pagination import keyset_filter
+import dashboard
+import database
+
+
+# --- Query plan check ---
+# Dashboard queries that must be served from an index. EXPLAIN QUERY PLAN
+# rows of the form "SCAN <table>" (without "USING ... INDEX") are full table
+# scans and fail the check, as do sorts of a whole result (temp B-trees for
+# ORDER BY) on paged queries.
+
+def _dashboard_queries():
+    yield 'patient count', User.query.filter_by(role='patient').with_entities(db.func.count())
+    yield 'appointments by doctor', Appointment.query \
+        .filter(Appointment.doctor_id == 1) \
+        .order_by(Appointment.start_time)
+    yield 'appointments by status', Appointment.query \
+        .filter(Appointment.status == 'Booked') \
+        .order_by(Appointment.start_time)
+    yield 'schedules by doctor', DoctorSchedule.query \
+        .filter(DoctorSchedule.doctor_id == 1) \
+        .order_by(DoctorSchedule.weekday)
+
+    yield 'pharmacy report', PrescriptionItem.query \
+        .filter(PrescriptionItem.drug == 'Amoxicillin',
+                PrescriptionItem.prescribed_at >= datetime(2025, 1, 1),
+                PrescriptionItem.prescribed_at < datetime(2025, 2, 1))
+    yield 'patient history', Appointment.query \
+        .filter(Appointment.patient_id == 1, Appointment.start_time < datetime.utcnow()) \
+        .order_by(Appointment.start_time.desc(), Appointment.id.desc()) \
+        .limit(dashboard.MAX_PAGE_SIZE)
+    yield 'analytics changed rows', Appointment.query \
+        .filter(Appointment.updated_at > datetime.utcnow())
+    yield 'analytics report', AppointmentDayRollup.query \
+        .filter(AppointmentDayRollup.day.between(datetime(2025, 1, 1).date(), datetime(2025, 12, 31).date()))
+
+    columns = [Appointment.start_time, Appointment.id]
+    yield 'appointment page', Appointment.query \
+        .filter(keyset_filter(columns, [datetime.utcnow(), 0], descending=True)) \
+        .order_by(Appointment.start_time.desc(), Appointment.id.desc()) \
+        .limit(dashboard.MAX_PAGE_SIZE)
+
+    # The first doctor page walks doctor in id order and stops at the limit;
+    # later pages must seek
+    yield 'doctor page', dashboard._doctor_query() \
+        .filter(keyset_filter(dashboard.DOCTOR_PAGE_KEY, [1])) \
+        .order_by(*dashboard.DOCTOR_PAGE_KEY) \
+        .limit(dashboard.MAX_PAGE_SIZE)
+    yield 'schedule first page', dashboard._schedule_query() \
+        .order_by(*dashboard.SCHEDULE_PAGE_KEY) \
+        .limit(dashboard.MAX_PAGE_SIZE)
+    yield 'schedule page', dashboard._schedule_query() \
+        .filter(keyset_filter(dashboard.SCHEDULE_PAGE_KEY, ['M', 0, 0])) \
+        .order_by(*dashboard.SCHEDULE_PAGE_KEY) \
+        .limit(dashboard.MAX_PAGE_SIZE)
+
+
+def table_scans():
+    scans = []
+    for name, query in _dashboard_queries():
+        statement = query.statement.compile(database.current_engine(), compile_kwargs={'literal_binds': True})
+        plan = db.session.execute(text(f'EXPLAIN QUERY PLAN {statement}')).all()
+        for row in plan:
+            detail = row[-1]
+            # A full scan, or a sort of every matching row
+            if (detail.startswith('SCAN') and 'INDEX' not in detail) or detail == 'USE TEMP B-TREE FOR ORDER BY':
+                scans.append((name, detail))
+    return scans
+
+
+# --- Patient history query budget ---
+# Upper bound for rendering the upcoming list plus one history page: each
+# list is one appointment query and, when non-empty, one query each for
+# treatments and their prescription items. A history page that reaches the
+# archive adds the horizon lookup and the same three queries against the
+# archive tables.
+HISTORY_QUERY_BUDGET = 10
+
+
+def history_query_counts():
+    # Statements issued to render one history page (plus the upcoming list)
+    # for the patient with the fewest and the one with the most
+    # appointments. Both must stay within HISTORY_QUERY_BUDGET.
+    per_patient = db.session.query(Appointment.patient_id, db.func.count()) \
+        .group_by(Appointment.patient_id) \
+        .order_by(db.func.count()) \
+        .all()
+    if not per_patient:
+        return {}
+
+    counts = {}
+    for patient_id, appointments in (per_patient[0], per_patient[-1]):
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        db.session.expunge_all()
+        engine = database.current_engine()
+        event.listen(engine, 'before_cursor_execute', listener)
+        try:
+            dashboard.upcoming_appointments(patient_id)
+            dashboard.history_page(patient_id)
+        finally:
+            event.remove(engine, 'before_cursor_execute', listener)
+        counts[patient_id] = (appointments, len(statements))
+    return counts
+
+
+def init_commands(app):
+    @app.cli.command('check-query-plans')
+    def check_query_plans_command():
+        if db.engine.dialect.name != 'sqlite':
+            click.echo('Query plan check is only implemented for SQLite.')
+            return
+        scans = table_scans()
+        for name, detail in scans:
+            click.echo(f'{name}: {detail}', err=True)
+        if scans:
+            sys.exit(1)
+        click.echo('All dashboard queries are index-backed.')
+
+    @app.cli.command('check-query-counts')
+    def check_query_counts_command():
+        counts = history_query_counts()
+        if not counts:
+            # Nothing was measured, which must not read as a pass
+            click.echo('No patient has appointments; seed some data (or run tests/test_query_counts.py).',
+                       err=True)
+            sys.exit(1)
+        for patient_id, (appointments, statements) in counts.items():
+            click.echo(f'patient {patient_id}: {appointments} appointments, {statements} queries')
+        if any(statements > HISTORY_QUERY_BUDGET for _, statements in counts.values()):
+            click.echo(f'Patient history needs more than {HISTORY_QUERY_BUDGET} queries.', err=True)
+            sys.exit(1)
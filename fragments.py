@@ -0,0 +1,229 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from datetime import date
+
+from flask import current_app, g, has_app_context, request
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.dml import Delete, UpdateBase
+
+from model import db, CacheVersion
+import tenants
+
+
+# --- Table versions ---
+# Every INSERT, UPDATE or DELETE run through the engine records its table
+# on the connection; a DELETE also records every table that its ON DELETE
+# CASCADE foreign keys reach. Once the session has committed, the
+# cache_version row of each of those tables is bumped once, in a short
+# transaction of its own. Bumping inside the writer's transaction would
+# hold the row lock of e.g. 'appointment' until commit and queue every
+# concurrent booking behind it. A request that reads between the commit
+# and the bump caches the new rows under the old key, which the bump then
+# retires. Writes made outside db.session (raw engine connections,
+# migrations) are not tracked.
+
+# Nothing is cached from these, and the job worker writes them constantly
+UNTRACKED_TABLES = {CacheVersion.__tablename__, 'live_event', 'job', 'replica_heartbeat', 'tenant_login'}
+
+_cascades = None
+
+
+def _cascading_tables():
+    global _cascades
+    if _cascades is None:
+        children = {}
+        for table in db.metadata.tables.values():
+            for fk in table.foreign_keys:
+                if (fk.ondelete or '').upper() == 'CASCADE':
+                    children.setdefault(fk.column.table.name, set()).add(table.name)
+
+        def reach(name, seen):
+            for child in children.get(name, ()):
+                if child not in seen:
+                    seen.add(child)
+                    reach(child, seen)
+            return seen
+
+        _cascades = {name: reach(name, set()) for name in children}
+    return _cascades
+
+
+def _after_execute(conn, clauseelement, multiparams, params, execution_options, result):
+    if not isinstance(clauseelement, UpdateBase):
+        return
+    name = getattr(getattr(clauseelement, 'table', None), 'name', None)
+    if not name or name in UNTRACKED_TABLES:
+        return
+    written = conn.info.setdefault('written_tables', set())
+    written.add(name)
+    if isinstance(clauseelement, Delete):
+        written.update(_cascading_tables().get(name, ()))
+
+
+def _before_commit(session):
+    if not session.in_transaction():
+        return
+    # Pending ORM changes are flushed after this hook; flush them now so
+    # their tables are recorded too
+    session.flush()
+    written = session.connection().info.pop('written_tables', None)
+    if written:
+        session.info.setdefault('written_tables', set()).update(written)
+
+
+def _after_commit(session):
+    written = session.info.pop('written_tables', None)
+    if not written:
+        return
+    with session.get_bind().begin() as connection:
+        connection.execute(db.update(CacheVersion)
+                           .where(CacheVersion.table.in_(sorted(written)))
+                           .values(version=CacheVersion.version + 1))
+    if has_app_context():
+        # Later reads in this request must see the new versions
+        g.pop('table_versions', None)
+
+
+def _after_rollback(session):
+    session.info.pop('written_tables', None)
+
+
+def _discard(conn):
+    conn.info.pop('written_tables', None)
+
+
+def _discard_on_reset(dbapi_connection, connection_record, reset_state):
+    # A connection returned to the pool without commit or rollback
+    connection_record.info.pop('written_tables', None)
+
+
+def seed_versions():
+    # One row per mapped table; run by the migration and on first read
+    existing = {table for (table,) in db.session.query(CacheVersion.table)}
+    missing = sorted(set(db.metadata.tables) - existing - UNTRACKED_TABLES)
+    if missing:
+        db.session.add_all(CacheVersion(table=table, version=0) for table in missing)
+        db.session.commit()
+
+
+def versions():
+    # One query per request, memoized on g
+    if 'table_versions' not in g:
+        values = dict(db.session.query(CacheVersion.table, CacheVersion.version))
+        if not values:
+            seed_versions()
+            values = dict(db.session.query(CacheVersion.table, CacheVersion.version))
+        g.table_versions = values
+    return g.table_versions
+
+
+def version_key(tables):
+    current = versions()
+    return tuple(current.get(table, 0) for table in tables)
+
+
+# --- Fragment cache ---
+# Rendered fragments are kept per process under (name, hospital, table
+# versions, params). A write to any of a fragment's tables changes its key,
+# so stale entries are never served; they simply age out of the LRU.
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_counts = {'hits': {}, 'misses': {}}
+
+
+def cached(name, tables, params, render):
+    size = current_app.config.get('FRAGMENT_CACHE_SIZE', 0)
+    if not size:
+        return render()
+    key = (name, tenants.current(), version_key(tables), params)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            _counts['hits'][name] = _counts['hits'].get(name, 0) + 1
+            return _cache[key]
+        _counts['misses'][name] = _counts['misses'].get(name, 0) + 1
+    value = render()
+    with _cache_lock:
+        _cache[key] = value
+        while len(_cache) > size:
+            _cache.popitem(last=False)
+    return value
+
+
+def cache_counts():
+    with _cache_lock:
+        return {kind: dict(counts) for kind, counts in _counts.items()}
+
+
+def clear():
+    with _cache_lock:
+        _cache.clear()
+
+
+# --- Conditional GET ---
+# ETags hash the signed-in user, the versions of the tables a response is
+# built from, the request's own parameters and the template set, so a
+# deploy with changed templates never matches an old tag.
+
+_template_stamp = None
+
+
+def _templates_stamp():
+    global _template_stamp
+    if _template_stamp is None:
+        folder = os.path.join(current_app.root_path, current_app.template_folder)
+        _template_stamp = max((os.stat(os.path.join(folder, name)).st_mtime_ns
+                               for name in os.listdir(folder)), default=0)
+    return _template_stamp
+
+
+def etag(user_id, tables, *params):
+    parts = (tenants.current(), user_id, version_key(tables), params, _templates_stamp(), date.today().isoformat())
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def not_modified(tag):
+    # A 304 for the tag, or None when the client's copy is out of date
+    if tag and request.if_none_match.contains(tag):
+        response = current_app.response_class(status=304)
+        return conditional(response, tag)
+    return None
+
+
+def conditional(response, tag):
+    if tag:
+        response.set_etag(tag)
+        # Browsers revalidate on every visit instead of reusing blindly
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+# --- Setup ---
+
+def listen(engine):
+    if not event.contains(engine, 'after_execute', _after_execute):
+        event.listen(engine, 'after_execute', _after_execute)
+        event.listen(engine, 'rollback', _discard)
+        event.listen(engine, 'commit', _discard)
+        event.listen(engine, 'reset', _discard_on_reset)
+
+
+def init_app(app):
+    # Call after database.init_app()
+    with app.app_context():
+        listen(db.engine)
+    if not event.contains(Session, 'before_commit', _before_commit):
+        event.listen(Session, 'before_commit', _before_commit)
+        event.listen(Session, 'after_commit', _after_commit)
+        event.listen(Session, 'after_rollback', _after_rollback)
+
+    # Compiled templates persist across restarts and are shared by workers
+    directory = app.config.get('JINJA_BYTECODE_CACHE_DIR')
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
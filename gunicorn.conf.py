@@ -0,0 +1,26 @@
+import multiprocessing
+import os
+
+
+bind = os.getenv('BIND', '0.0.0.0:8000')
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv('GUNICORN_THREADS', 1))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+
+# Each open /events stream holds a sync worker (or thread) for up to
+# LIVE_STREAM_SECONDS, so LIVE_UPDATES stays off unless
+# GUNICORN_WORKER_CLASS is gevent or eventlet (pip install gevent), which
+# keep many idle listeners on a few workers.
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'sync')
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 1000))
+
+# Load the app once in the master so workers share its memory copy-on-write.
+preload_app = True
+
+
+def post_fork(server, worker):
+    # Never share pooled connections opened in the master with a worker
+    from model import db
+    from wsgi import app
+    with app.app_context():
+        db.engine.dispose(close=False)
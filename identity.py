@@ -0,0 +1,116 @@
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, g, session
+from sqlalchemy.orm import joinedload, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+
+from model import db, User, Doctor, Patient
+import tenants
+
+
+# --- Process-level identity cache ---
+# Optional (IDENTITY_CACHE_TTL > 0). Holds plain column snapshots of a user
+# and their doctor/patient profile, keyed by hospital and user id. Entries
+# expire after the TTL and are dropped explicitly by invalidate() whenever
+# the app changes a user (blacklisting, removal, profile edits).
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _columns(obj):
+    return {column.key: getattr(obj, column.key) for column in obj.__table__.columns}
+
+
+def _snapshot(user):
+    return {
+        'user': _columns(user),
+        'doctor_profile': _columns(user.doctor_profile) if user.doctor_profile else None,
+        'patient_profile': _columns(user.patient_profile) if user.patient_profile else None,
+    }
+
+
+def _restore(snapshot):
+    # Rebuild detached instances and attach them to this request's session
+    # without a SELECT (merge with load=False trusts the given state).
+    user = User(**snapshot['user'])
+    make_transient_to_detached(user)
+    for attribute, model in (('doctor_profile', Doctor), ('patient_profile', Patient)):
+        profile = None
+        if snapshot[attribute]:
+            profile = model(**snapshot[attribute])
+            make_transient_to_detached(profile)
+        set_committed_value(user, attribute, profile)
+    return db.session.merge(user, load=False)
+
+
+def _cache_get(user_id):
+    ttl = current_app.config.get('IDENTITY_CACHE_TTL', 0)
+    if not ttl:
+        return None
+    key = (tenants.current(), user_id)
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is None:
+            return None
+        expires_at, snapshot = entry
+        if expires_at < time.monotonic():
+            del _cache[key]
+            return None
+        _cache.move_to_end(key)
+        return snapshot
+
+
+def _cache_put(user_id, snapshot):
+    ttl = current_app.config.get('IDENTITY_CACHE_TTL', 0)
+    if not ttl:
+        return
+    key = (tenants.current(), user_id)
+    with _cache_lock:
+        _cache[key] = (time.monotonic() + ttl, snapshot)
+        _cache.move_to_end(key)
+        while len(_cache) > current_app.config.get('IDENTITY_CACHE_SIZE', 1024):
+            _cache.popitem(last=False)
+
+
+def invalidate(user_id):
+    with _cache_lock:
+        _cache.pop((tenants.current(), user_id), None)
+    if g.get('current_user') is not None and g.current_user.id == user_id:
+        g.pop('current_user')
+
+
+# --- Request-scoped loader ---
+
+def current_user():
+    # The logged-in User with doctor_profile/patient_profile already loaded,
+    # fetched at most once per request. None if not logged in or the row no
+    # longer exists.
+    if 'current_user' in g:
+        return g.current_user
+
+    user_id = session.get('user_id')
+    user = None
+    if user_id is not None:
+        snapshot = _cache_get(user_id)
+        if snapshot is not None:
+            user = _restore(snapshot)
+        else:
+            user = User.query \
+                .options(joinedload(User.doctor_profile), joinedload(User.patient_profile)) \
+                .filter_by(id=user_id) \
+                .first()
+            if user is not None:
+                _cache_put(user_id, _snapshot(user))
+
+    g.current_user = user
+    return user
+
+
+def is_blocked(user):
+    if user.is_active is False:
+        return True
+    profile = user.doctor_profile or user.patient_profile
+    return bool(profile and profile.is_blacklisted)
@@ -0,0 +1,274 @@
+import heapq
+import json
+import logging
+import re
+import sys
+import threading
+import time
+from collections import deque
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+
+from model import db
+import replicas
+
+
+logger = logging.getLogger('hms.requests')
+
+# Request duration histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+SLOW_QUERY_LOG_SIZE = 50
+
+
+def _compact(statement, limit=300):
+    text = re.sub(r'\s+', ' ', statement).strip()
+    return text if len(text) <= limit else text[:limit] + '...'
+
+
+# --- Per-request query tracking ---
+# before/after_cursor_execute time every statement on its connection. While
+# a request is active the totals land on g.sql: statement count, DB time and
+# the slowest SQL_TOP_STATEMENTS statements. Statements run outside a
+# request (CLI commands, the migrations) are not tracked.
+
+class RequestSQL:
+    def __init__(self, top):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.seconds = 0.0
+        self.top = top
+        self.slowest = []  # min-heap of (seconds, order, statement)
+
+    def record(self, statement, seconds):
+        self.queries += 1
+        self.seconds += seconds
+        entry = (seconds, self.queries, statement)
+        if len(self.slowest) < self.top:
+            heapq.heappush(self.slowest, entry)
+        elif self.top and entry > self.slowest[0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def slowest_statements(self):
+        return [{'ms': round(seconds * 1000, 2), 'statement': _compact(statement)}
+                for seconds, _, statement in sorted(self.slowest, reverse=True)]
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('query_started')
+    if not started:
+        return
+    seconds = time.perf_counter() - started.pop()
+    if not has_request_context():
+        return
+    sql = g.get('sql')
+    if sql is not None:
+        sql.record(statement, seconds)
+    if seconds * 1000 >= current_app.config['SQL_SLOW_QUERY_MS']:
+        _record_slow_query(cursor, statement, parameters, seconds, executemany)
+
+
+def _handle_error(context):
+    # A failed statement never reaches after_cursor_execute
+    started = context.connection.info.get('query_started') if context.connection else None
+    if started:
+        started.pop()
+
+
+# --- Slow queries ---
+# A statement slower than SQL_SLOW_QUERY_MS is logged with its plan and
+# kept in a bounded in-process list for /admin/slow-queries. The plan is
+# read through a plain DB-API cursor on the same connection, so the EXPLAIN
+# itself never reaches these hooks.
+
+_slow_queries = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+_slow_lock = threading.Lock()
+
+
+def _explain(cursor, statement, parameters):
+    if not re.match(r'\s*(SELECT|WITH)\b', statement, re.IGNORECASE):
+        return None
+    sqlite = db.engine.dialect.name == 'sqlite'
+    explain_cursor = cursor.connection.cursor()
+    try:
+        explain_cursor.execute(('EXPLAIN QUERY PLAN ' if sqlite else 'EXPLAIN ') + statement, parameters)
+        # SQLite: (id, parent, notused, detail); others: one text column
+        return [row[-1] if sqlite else row[0] for row in explain_cursor.fetchall()]
+    except Exception as error:
+        return [f'EXPLAIN failed: {error}']
+    finally:
+        explain_cursor.close()
+
+
+def _record_slow_query(cursor, statement, parameters, seconds, executemany):
+    config = current_app.config
+    plan = None
+    if config['SQL_EXPLAIN_SLOW'] and not executemany:
+        plan = _explain(cursor, statement, parameters)
+    entry = {
+        'at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'ms': round(seconds * 1000, 2),
+        'endpoint': request.endpoint,
+        'path': request.path,
+        'statement': _compact(statement, 2000),
+        'plan': plan,
+    }
+    with _slow_lock:
+        _slow_queries.append(entry)
+    with _metrics_lock:
+        _metrics['slow_queries'] += 1
+    logger.warning(json.dumps(dict(entry, event='slow_query')))
+
+
+def slow_queries():
+    # Newest first
+    with _slow_lock:
+        return list(reversed(_slow_queries))
+
+
+# --- Process-level metrics ---
+# Kept per process; with several gunicorn workers each one reports its own
+# series, which Prometheus sums across scrape targets.
+
+_metrics_lock = threading.Lock()
+_metrics = {'requests': {}, 'slow_queries': 0}
+
+
+def _observe(endpoint, method, status, seconds, sql):
+    with _metrics_lock:
+        series = _metrics['requests'].setdefault((endpoint, method), {
+            'statuses': {}, 'count': 0, 'seconds': 0.0, 'buckets': [0] * len(BUCKETS),
+            'queries': 0, 'db_seconds': 0.0})
+        series['statuses'][status] = series['statuses'].get(status, 0) + 1
+        series['count'] += 1
+        series['seconds'] += seconds
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                series['buckets'][i] += 1
+        series['queries'] += sql.queries
+        series['db_seconds'] += sql.seconds
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def prometheus_text():
+    lines = []
+
+    def family(name, kind, help_text):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+
+    with _metrics_lock:
+        requests = sorted(_metrics['requests'].items(), key=lambda item: (str(item[0][0]), item[0][1]))
+        requests = [(key, {**series, 'statuses': dict(series['statuses']), 'buckets': list(series['buckets'])})
+                    for key, series in requests]
+        slow = _metrics['slow_queries']
+
+    family('hms_http_requests_total', 'counter', 'HTTP requests by endpoint, method and status.')
+    for (endpoint, method), series in requests:
+        for status, count in sorted(series['statuses'].items()):
+            lines.append(f'hms_http_requests_total{_labels(endpoint=endpoint, method=method, status=status)} {count}')
+
+    family('hms_http_request_duration_seconds', 'histogram', 'Request handling time.')
+    for (endpoint, method), series in requests:
+        for bound, count in zip(BUCKETS, series['buckets']):
+            lines.append(f'hms_http_request_duration_seconds_bucket'
+                         f'{_labels(endpoint=endpoint, method=method, le=bound)} {count}')
+        lines.append(f'hms_http_request_duration_seconds_bucket'
+                     f'{_labels(endpoint=endpoint, method=method, le="+Inf")} {series["count"]}')
+        lines.append(f'hms_http_request_duration_seconds_sum{_labels(endpoint=endpoint, method=method)} '
+                     f'{series["seconds"]:.6f}')
+        lines.append(f'hms_http_request_duration_seconds_count{_labels(endpoint=endpoint, method=method)} '
+                     f'{series["count"]}')
+
+    family('hms_db_queries_total', 'counter', 'SQL statements issued while handling requests.')
+    for (endpoint, method), series in requests:
+        lines.append(f'hms_db_queries_total{_labels(endpoint=endpoint, method=method)} {series["queries"]}')
+
+    family('hms_db_duration_seconds_total', 'counter', 'Time spent executing SQL while handling requests.')
+    for (endpoint, method), series in requests:
+        lines.append(f'hms_db_duration_seconds_total{_labels(endpoint=endpoint, method=method)} '
+                     f'{series["db_seconds"]:.6f}')
+
+    family('hms_db_slow_queries_total', 'counter', 'Statements slower than SQL_SLOW_QUERY_MS.')
+    lines.append(f'hms_db_slow_queries_total {slow}')
+
+    replica_status = current_app.extensions['replicas'].status() if 'replicas' in current_app.extensions else []
+    if replica_status:
+        family('hms_db_replica_lag_seconds', 'gauge', 'Replication lag at the last check; -1 when unreadable.')
+        for replica in replica_status:
+            lag = replica['lag_seconds']
+            lines.append(f'hms_db_replica_lag_seconds{_labels(replica=replica["url"])} '
+                         f'{-1 if lag is None else round(lag, 3)}')
+    return '\n'.join(lines) + '\n'
+
+
+# --- Request hooks ---
+
+def _start_request():
+    g.sql = RequestSQL(current_app.config['SQL_TOP_STATEMENTS'])
+
+
+def _finish_request(response):
+    sql = g.pop('sql', None)
+    if sql is None:
+        return response
+    seconds = time.perf_counter() - sql.started
+    endpoint = request.endpoint or 'unmatched'
+    _observe(endpoint, request.method, response.status_code, seconds, sql)
+
+    if current_app.config['SERVER_TIMING']:
+        response.headers.add('Server-Timing',
+                             f'db;dur={sql.seconds * 1000:.2f};desc="{sql.queries} queries"')
+        response.headers.add('Server-Timing', f'app;dur={seconds * 1000:.2f}')
+    if current_app.config['REQUEST_LOG']:
+        logger.info(json.dumps({
+            'event': 'request',
+            'method': request.method,
+            'path': request.path,
+            'endpoint': endpoint,
+            'status': response.status_code,
+            'ms': round(seconds * 1000, 2),
+            'db_ms': round(sql.seconds * 1000, 2),
+            'queries': sql.queries,
+            'slowest': sql.slowest_statements(),
+        }))
+    return response
+
+
+def listen(engine):
+    if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(engine, 'handle_error', _handle_error)
+
+
+def init_app(app):
+    # Call after database.init_app()
+    if not app.config['SQL_INSTRUMENTATION']:
+        return
+    # Call after replicas.init_app() too, so replica reads are counted
+    with app.app_context():
+        engines = [db.engine] + replicas.engines(app)
+    for engine in engines:
+        listen(engine)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
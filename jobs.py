@@ -0,0 +1,372 @@
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+import uuid
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app, g
+from sqlalchemy import String, cast, literal, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import aliased
+
+from model import db, User, Doctor, Patient, Appointment, Job
+from bulk_io import chunked
+import analytics
+import batch
+import bulk_io
+import removal
+import stats
+import tenants
+
+
+logger = logging.getLogger('hms.jobs')
+
+# Kept well below SQLite's bound-parameter limit
+ID_CHUNK = 500
+
+REMINDER_STATUSES = ('Booked', 'Confirmed')
+
+
+class JobError(Exception):
+    pass
+
+
+# --- Handlers ---
+# A handler takes a job's payload dict and may return a JSON-serialisable
+# result, stored on the job. A batch handler takes the payloads of every
+# claimed job of its kind at once, so it can do its reads and writes in a
+# few set-based statements. Jobs run at least once: a worker that dies
+# after a handler's own commit runs it again, so handlers must be safe to
+# repeat.
+
+_handlers = {}
+
+
+def handler(kind, batch=False):
+    def decorator(function):
+        _handlers[kind] = (function, batch)
+        return function
+    return decorator
+
+
+# --- Enqueueing ---
+
+def enqueue(kind, run_at=None, **payload):
+    # Added to the caller's session and committed with the caller's change
+    job = Job(kind=kind, payload=json.dumps(payload), run_at=run_at or datetime.utcnow(),
+              max_attempts=current_app.config['JOB_MAX_ATTEMPTS'])
+    db.session.add(job)
+    return job
+
+
+def _insert_ignoring_duplicates():
+    # INSERT that skips rows whose key is already queued
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        return sqlite.insert(Job.__table__).on_conflict_do_nothing(index_elements=['key'])
+    if dialect == 'postgresql':
+        return postgresql.insert(Job.__table__).on_conflict_do_nothing(index_elements=['key'])
+    raise JobError(f'Keyed enqueueing is not implemented for {dialect}.')
+
+
+def _spool_dir():
+    # One directory per hospital, so each worker only prunes its own uploads
+    return os.path.join(current_app.config['JOB_SPOOL_DIR'], tenants.current() or '')
+
+
+def spool_upload(upload, suffix):
+    # Uploads outlive the request in the spool directory until their job
+    # has run; prune() removes those no queued or running job refers to
+    directory = _spool_dir()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{uuid.uuid4().hex}.{suffix}')
+    upload.save(path)
+    return path
+
+
+# --- Reminders ---
+# One INSERT ... SELECT queues a reminder for every live appointment that
+# starts within REMINDER_LEAD_HOURS. Reminder keys are unique per
+# appointment, so running the scheduler again only adds new ones.
+
+def schedule_reminders(now=None):
+    now = now or datetime.now()
+    lead = timedelta(hours=current_app.config['REMINDER_LEAD_HOURS'])
+    appointment_id = cast(Appointment.id, String)
+    due = select(
+        literal('appointment_reminder'),
+        literal('reminder:') + appointment_id,
+        literal('{"appointment_id": ') + appointment_id + literal('}'),
+        literal('queued'),
+        literal(0),
+        literal(current_app.config['JOB_MAX_ATTEMPTS']),
+        literal(datetime.utcnow()),
+        literal(datetime.utcnow()),
+    ).where(Appointment.start_time >= now, Appointment.start_time < now + lead,
+            Appointment.status.in_(REMINDER_STATUSES))
+    result = db.session.execute(_insert_ignoring_duplicates().from_select(
+        ['kind', 'key', 'payload', 'status', 'attempts', 'max_attempts', 'run_at', 'created_at'], due))
+    db.session.commit()
+    return max(result.rowcount, 0)
+
+
+@handler('appointment_reminder', batch=True)
+def send_reminders(payloads):
+    # There is no mail transport in this app; a reminder is a structured
+    # log line on hms.jobs for whatever delivers them to pick up.
+    # Appointments canceled since they were queued are skipped.
+    PatientUser = aliased(User)
+    DoctorUser = aliased(User)
+    ids = [payload['appointment_id'] for payload in payloads]
+    sent = 0
+    for chunk in chunked(ids, ID_CHUNK):
+        rows = db.session.query(Appointment.id, Appointment.start_time, PatientUser.full_name,
+                                PatientUser.email, DoctorUser.full_name) \
+            .join(Patient, Appointment.patient_id == Patient.id) \
+            .join(PatientUser, Patient.user_id == PatientUser.id) \
+            .join(Doctor, Appointment.doctor_id == Doctor.id) \
+            .join(DoctorUser, Doctor.user_id == DoctorUser.id) \
+            .filter(Appointment.id.in_(chunk), Appointment.status.in_(REMINDER_STATUSES))
+        for id_, start_time, patient_name, email, doctor_name in rows:
+            logger.info(json.dumps({'event': 'appointment_reminder', 'appointment_id': id_,
+                                    'start_time': start_time.isoformat(), 'patient': patient_name,
+                                    'email': email, 'doctor': doctor_name}))
+            sent += 1
+    return sent
+
+
+# --- Offloaded request work ---
+
+@handler('remove_users')
+def _remove_users(payload):
+    return {'removed': removal.remove_users(payload['user_ids'])}
+
+
+@handler('delete_doctors')
+def _delete_doctors(payload):
+    return batch.delete_doctors(payload['doctor_ids']).as_dict()
+
+
+@handler('import_records')
+def _import_records(payload):
+    with open(payload['path'], encoding='utf-8', newline='') as stream:
+        result = bulk_io.import_records(payload['records'], bulk_io.read_records(stream, payload['format']))
+    os.remove(payload['path'])
+    return result.as_dict()
+
+
+# --- Claiming ---
+# A worker claims a batch with one UPDATE ... WHERE id IN (the oldest due
+# queued jobs) ... RETURNING. On PostgreSQL the inner SELECT takes
+# FOR UPDATE SKIP LOCKED, so concurrent workers claim disjoint batches
+# without waiting on each other. SQLite has no row locks; it runs one
+# write at a time, so the single statement is the claim and the next
+# worker's UPDATE sees the jobs already running.
+
+Claimed = namedtuple('Claimed', 'id kind payload attempts max_attempts')
+
+
+def claim(worker_id, limit):
+    now = datetime.utcnow()
+    due = select(Job.id).where(Job.status == 'queued', Job.run_at <= now) \
+        .order_by(Job.run_at, Job.id).limit(limit).with_for_update(skip_locked=True)
+    rows = db.session.execute(
+        update(Job.__table__).where(Job.__table__.c.id.in_(due.scalar_subquery()))
+        .values(status='running', locked_by=worker_id, locked_at=now, attempts=Job.__table__.c.attempts + 1)
+        .returning(Job.__table__.c.id, Job.__table__.c.kind, Job.__table__.c.payload,
+                   Job.__table__.c.attempts, Job.__table__.c.max_attempts)).all()
+    db.session.commit()
+    return sorted((Claimed(id_, kind, json.loads(payload), attempts, max_attempts)
+                   for id_, kind, payload, attempts, max_attempts in rows), key=lambda job: job.id)
+
+
+def recover_stale():
+    # Jobs of a worker that died mid-batch go back to the queue. A live
+    # worker refreshes locked_at every JOB_HEARTBEAT seconds (see
+    # _heartbeat), so only jobs whose worker stopped beating for
+    # JOB_LOCK_TIMEOUT are requeued, however long they take to run.
+    before = datetime.utcnow() - timedelta(seconds=current_app.config['JOB_LOCK_TIMEOUT'])
+    result = db.session.execute(update(Job.__table__)
+                                .where(Job.status == 'running', Job.locked_at < before)
+                                .values(status='queued', locked_by=None, locked_at=None))
+    db.session.commit()
+    return result.rowcount
+
+
+def prune():
+    before = datetime.utcnow() - timedelta(seconds=current_app.config['JOB_RETENTION'])
+    result = db.session.execute(Job.__table__.delete().where(Job.status == 'done', Job.finished_at < before))
+    db.session.commit()
+    prune_spool()
+    return result.rowcount
+
+
+def prune_spool():
+    # Removes uploads whose import job failed for good or was never
+    # committed. Files younger than JOB_LOCK_TIMEOUT are left alone, since
+    # the request that spooled one may not have committed its job yet.
+    directory = _spool_dir()
+    if not os.path.isdir(directory):
+        return 0
+    pending = {json.loads(payload).get('path') for (payload,) in db.session.query(Job.payload)
+               .filter(Job.kind == 'import_records', Job.status.in_(('queued', 'running')))}
+    cutoff = time.time() - current_app.config['JOB_LOCK_TIMEOUT']
+    removed = 0
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.path not in pending and entry.stat().st_mtime < cutoff:
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+# --- Running ---
+
+def _backoff(attempts):
+    config = current_app.config
+    return min(config['JOB_RETRY_DELAY'] * 2 ** (attempts - 1), config['JOB_RETRY_MAX_DELAY'])
+
+
+def _finish(jobs, result):
+    values = dict(status='done', finished_at=datetime.utcnow(), locked_by=None, last_error=None)
+    if result is not None:
+        values['result'] = json.dumps(result)
+    for chunk in chunked([job.id for job in jobs], ID_CHUNK):
+        db.session.execute(update(Job.__table__).where(Job.id.in_(chunk)).values(**values))
+
+
+def _fail(jobs, error):
+    now = datetime.utcnow()
+    for job in jobs:
+        values = dict(locked_by=None, last_error=error[:2000])
+        if job.attempts >= job.max_attempts:
+            values.update(status='failed', finished_at=now)
+        else:
+            values.update(status='queued', run_at=now + timedelta(seconds=_backoff(job.attempts)))
+        db.session.execute(update(Job.__table__).where(Job.id == job.id).values(**values))
+
+
+def _attempt(jobs, call, keep_result=True):
+    # The handler's writes and the job's outcome commit together unless the
+    # handler commits on its own
+    try:
+        result = call()
+    except Exception as error:
+        db.session.rollback()
+        logger.warning(json.dumps({'event': 'job_failed', 'ids': [job.id for job in jobs],
+                                   'kind': jobs[0].kind, 'error': repr(error)}))
+        _fail(jobs, repr(error))
+    else:
+        _finish(jobs, result if keep_result else None)
+    db.session.commit()
+
+
+@contextmanager
+def _heartbeat(worker_id):
+    # While a batch runs, a thread with its own session refreshes locked_at
+    # on the worker's running jobs every JOB_HEARTBEAT seconds
+    app = current_app._get_current_object()
+    tenant = tenants.current()
+    stop = threading.Event()
+
+    def beat():
+        with app.app_context():
+            g.tenant = tenant
+            while not stop.wait(app.config['JOB_HEARTBEAT']):
+                try:
+                    db.session.execute(update(Job.__table__)
+                                       .where(Job.status == 'running', Job.locked_by == worker_id)
+                                       .values(locked_at=datetime.utcnow()))
+                    db.session.commit()
+                except Exception as error:
+                    db.session.rollback()
+                    logger.warning(json.dumps({'event': 'job_heartbeat_failed', 'worker': worker_id,
+                                               'error': repr(error)}))
+            db.session.remove()
+
+    thread = threading.Thread(target=beat, name='job-heartbeat', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def run_claimed(jobs):
+    by_kind = {}
+    for job in jobs:
+        by_kind.setdefault(job.kind, []).append(job)
+    for kind, group in by_kind.items():
+        function, batched = _handlers.get(kind, (None, False))
+        if function is None:
+            _fail([job._replace(attempts=job.max_attempts) for job in group], f'No handler for {kind!r}')
+            db.session.commit()
+        elif batched:
+            _attempt(group, lambda: function([job.payload for job in group]), keep_result=False)
+        else:
+            for job in group:
+                _attempt([job], lambda job=job: function(job.payload))
+
+
+def work(worker_id=None, batch_size=None, once=False, max_jobs=None):
+    # Runs until stopped; with once=True, until no job is due. Every
+    # JOB_HOUSEKEEPING seconds reminders are scheduled, stale and old jobs
+    # tidied, dashboard counter deltas folded and the analytics rollups
+    # refreshed if older than ANALYTICS_MAX_AGE.
+    config = current_app.config
+    worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}'
+    batch_size = batch_size or config['JOB_BATCH_SIZE']
+    processed = 0
+    housekept = None
+    while max_jobs is None or processed < max_jobs:
+        if housekept is None or time.monotonic() - housekept >= config['JOB_HOUSEKEEPING']:
+            housekept = time.monotonic()
+            recover_stale()
+            schedule_reminders()
+            prune()
+            stats.fold()
+            analytics.refresh_if_stale()
+        limit = batch_size if max_jobs is None else min(batch_size, max_jobs - processed)
+        jobs = claim(worker_id, limit)
+        if not jobs:
+            if once:
+                break
+            db.session.remove()
+            time.sleep(config['JOB_POLL_INTERVAL'])
+            continue
+        with _heartbeat(worker_id):
+            run_claimed(jobs)
+        processed += len(jobs)
+    return processed
+
+
+def init_commands(app):
+    @app.cli.command('run-jobs')
+    @click.option('--batch-size', type=int, default=None, help='Defaults to JOB_BATCH_SIZE.')
+    @click.option('--once', is_flag=True, help='Exit once no job is due.')
+    @click.option('--max-jobs', type=int, default=None)
+    def run_jobs_command(batch_size, once, max_jobs):
+        if not logger.handlers:
+            stream = logging.StreamHandler(sys.stderr)
+            stream.setFormatter(logging.Formatter('%(message)s'))
+            logger.addHandler(stream)
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+        started = time.perf_counter()
+        processed = work(batch_size=batch_size, once=once, max_jobs=max_jobs)
+        seconds = time.perf_counter() - started
+        click.echo(f'Ran {processed} job(s) in {seconds:.1f}s.')
+
+    @app.cli.command('schedule-reminders')
+    def schedule_reminders_command():
+        click.echo(f'Queued {schedule_reminders()} reminder(s).')
@@ -0,0 +1,229 @@
+import json
+import queue
+import threading
+import time
+from collections import deque, namedtuple
+from datetime import datetime, timedelta
+
+from flask import Response, current_app, g
+
+from model import db, LiveEvent
+import tenants
+
+
+# --- Publishing ---
+# publish() only adds a LiveEvent to the caller's session; it is committed
+# (or rolled back) with the change it describes, so listeners never hear
+# about changes that did not happen.
+
+def publish(kind, doctor_id=None, **data):
+    db.session.add(LiveEvent(kind=kind, doctor_id=doctor_id, payload=json.dumps(data)))
+
+
+def appointments_changed(rows, status):
+    # rows: anything with id and doctor_id; one event per doctor
+    by_doctor = {}
+    for row in rows:
+        by_doctor.setdefault(row.doctor_id, []).append(row.id)
+    for doctor_id, ids in by_doctor.items():
+        publish('appointment', doctor_id, ids=ids, status=status)
+
+
+def schedule_saved(schedule_id, doctor_id, html):
+    publish('schedule', doctor_id, action='saved', ids=[schedule_id], html=html)
+
+
+def schedules_removed(ids):
+    if ids:
+        publish('schedule', action='removed', ids=list(ids))
+
+
+# --- Fanout ---
+# One poller thread per process reads new events with a single query every
+# LIVE_POLL_INTERVAL seconds, whatever the number of listeners, and hands
+# them to each listener's queue. Going through the table is what makes
+# events from other worker processes reach this one. The poller only runs
+# while someone is listening.
+#
+# Ids are re-read a little behind the newest one seen, because on backends
+# with concurrent writers a lower id can commit after a higher one; ids
+# already delivered are skipped.
+#
+# With several hospitals there is one broker, and so one poller, per
+# hospital with listeners in this process, each reading its own database.
+
+REREAD_WINDOW = 100
+
+# Plain copies, so nothing handed to a listener is tied to a session
+Event = namedtuple('Event', 'id kind doctor_id payload')
+
+
+def _event_rows(query, limit=None):
+    query = query.with_entities(LiveEvent.id, LiveEvent.kind, LiveEvent.doctor_id, LiveEvent.payload) \
+        .order_by(LiveEvent.id).limit(limit)
+    return [Event(*row) for row in query]
+
+
+class Subscription:
+    def __init__(self, doctor_id, size):
+        # doctor_id None receives everything (admins)
+        self.doctor_id = doctor_id
+        self.queue = queue.Queue(maxsize=size)
+        self.overflowed = False
+
+    def wants(self, event):
+        return self.doctor_id is None or (event.kind == 'appointment' and event.doctor_id == self.doctor_id)
+
+    def offer(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # A listener this far behind reloads instead
+            self.overflowed = True
+
+
+class Broker:
+    def __init__(self, tenant=None):
+        self.tenant = tenant
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.thread = None
+        self.last_id = None
+        self.delivered = deque(maxlen=REREAD_WINDOW * 10)
+        self.delivered_ids = set()
+        self.pruned_at = 0
+
+    def subscribe(self, app, doctor_id):
+        subscription = Subscription(doctor_id, app.config['LIVE_QUEUE_SIZE'])
+        with self.lock:
+            self.subscribers.add(subscription)
+            if self.thread is None:
+                if self.last_id is None:
+                    self.last_id = db.session.query(db.func.max(LiveEvent.id)).scalar() or 0
+                self.thread = threading.Thread(target=self._run, args=(app,), name='live-events', daemon=True)
+                self.thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+
+    def _remember(self, event_id):
+        if len(self.delivered) == self.delivered.maxlen:
+            self.delivered_ids.discard(self.delivered[0])
+        self.delivered.append(event_id)
+        self.delivered_ids.add(event_id)
+
+    def _run(self, app):
+        interval = app.config['LIVE_POLL_INTERVAL']
+        while True:
+            time.sleep(interval)
+            with self.lock:
+                if not self.subscribers:
+                    self.thread = None
+                    return
+            with app.app_context():
+                if self.tenant is not None:
+                    g.tenant = self.tenant
+                try:
+                    self.poll()
+                    self.prune()
+                finally:
+                    db.session.remove()
+
+    def poll(self):
+        events = _event_rows(LiveEvent.query.filter(LiveEvent.id > self.last_id - REREAD_WINDOW))
+        fresh = [event for event in events if event.id not in self.delivered_ids]
+        if not fresh:
+            return
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for event in fresh:
+            self._remember(event.id)
+            self.last_id = max(self.last_id, event.id)
+            for subscription in subscribers:
+                if subscription.wants(event):
+                    subscription.offer(event)
+
+    def prune(self):
+        now = time.monotonic()
+        if now - self.pruned_at < 60:
+            return
+        self.pruned_at = now
+        before = datetime.utcnow() - timedelta(seconds=current_app.config['LIVE_EVENT_RETENTION'])
+        LiveEvent.query.filter(LiveEvent.created_at < before).delete(synchronize_session=False)
+        db.session.commit()
+
+
+_brokers = {}
+_brokers_lock = threading.Lock()
+
+
+def broker_for(tenant):
+    with _brokers_lock:
+        broker = _brokers.get(tenant)
+        if broker is None:
+            broker = _brokers[tenant] = Broker(tenant)
+        return broker
+
+
+# --- Streaming ---
+# Each response is bounded to LIVE_STREAM_SECONDS (below the worker
+# timeout of sync workers); the browser's EventSource then reconnects with
+# Last-Event-ID and picks up whatever it missed from the table. Holding
+# many idle listeners needs a gevent worker, which is why LIVE_UPDATES
+# defaults to off under any other worker class; see gunicorn.conf.py. A
+# stream holds no database connection while it waits.
+
+def _format(event):
+    return f'id: {event.id}\nevent: {event.kind}\ndata: {event.payload}\n\n'
+
+
+def _backlog(last_event_id, doctor_id, limit):
+    # Events after Last-Event-ID, or None if the client is too far behind
+    query = LiveEvent.query.filter(LiveEvent.id > last_event_id)
+    if doctor_id is not None:
+        query = query.filter(LiveEvent.kind == 'appointment', LiveEvent.doctor_id == doctor_id)
+    events = _event_rows(query, limit + 1)
+    return events if len(events) <= limit else None
+
+
+def stream_response(doctor_id=None, last_event_id=None):
+    app = current_app._get_current_object()
+    config = app.config
+    broker = broker_for(tenants.current())
+    subscription = broker.subscribe(app, doctor_id)
+    backlog = []
+    if last_event_id and last_event_id.isdigit():
+        backlog = _backlog(int(last_event_id), doctor_id, config['LIVE_QUEUE_SIZE'])
+    heartbeat = config['LIVE_HEARTBEAT']
+    duration = config['LIVE_STREAM_SECONDS']
+
+    def generate():
+        try:
+            yield 'retry: 2000\n\n'
+            if backlog is None:
+                yield 'event: resync\ndata: {}\n\n'
+                return
+            sent = 0
+            for event in backlog:
+                sent = event.id
+                yield _format(event)
+            deadline = time.monotonic() + duration
+            while not subscription.overflowed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                try:
+                    event = subscription.queue.get(timeout=min(heartbeat, remaining))
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                if event.id > sent:
+                    yield _format(event)
+            yield 'event: resync\ndata: {}\n\n'
+        finally:
+            broker.unsubscribe(subscription)
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
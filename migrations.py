@@ -0,0 +1,323 @@
+from datetime import datetime
+
+import click
+from sqlalchemy import func, inspect, text
+from sqlalchemy.schema import CreateTable
+
+from model import db, User, Doctor, Patient, DoctorSchedule, ScheduleException, Appointment, Treatment, \
+    PrescriptionItem, AppointmentDayRollup, HourRollup, ScheduleDayRollup, AnalyticsWatermark, AnalyticsDirtyDay, \
+    ArchivedAppointment, ArchivedTreatment, ArchivedPrescriptionItem, CacheVersion, LiveEvent, Job, ReplicaHeartbeat, \
+    TenantLogin, DashboardStatDelta
+from schedules import WEEKDAYS
+import database
+
+
+# --- Schema versioning ---
+# db.create_all() only creates missing tables; it never touches tables that
+# already exist. Every schema change that existing databases need (new
+# indexes, new columns, backfills) is recorded here as a numbered step and
+# applied exactly once by upgrade().
+
+class SchemaVersion(db.Model):
+    __tablename__ = 'schema_version'
+    version = db.Column(db.Integer, primary_key=True)
+    description = db.Column(db.String(255), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+def _create_indexes(*models):
+    # Indexes on columns a later step adds are left to that step
+    bind = db.session.connection()
+    for model in models:
+        columns = {column['name'] for column in inspect(bind).get_columns(model.__tablename__)}
+        for index in model.__table__.indexes:
+            if all(column.name in columns for column in index.columns):
+                index.create(bind, checkfirst=True)
+
+
+def _add_hot_column_indexes():
+    _create_indexes(User, Doctor, DoctorSchedule, Appointment)
+
+
+def _add_slot_guard_index():
+    _create_indexes(Appointment)
+
+
+def _seed_dashboard_stats():
+    import stats
+    stats.reconcile()
+
+
+def _build_search_index():
+    import search_index
+    search_index.get_backend().create(db.session.connection())
+    search_index.rebuild()
+
+
+def _add_prescription_items():
+    # Existing free-text prescriptions are kept as they are; only treatments
+    # written from now on get line items.
+    PrescriptionItem.__table__.create(db.session.connection(), checkfirst=True)
+    _create_indexes(PrescriptionItem)
+
+
+def _integer_weekdays():
+    # doctor_schedule.day_of_week ('Monday') becomes weekday (0-6) plus
+    # effective_from/effective_to; databases created after this change
+    # already have the new columns.
+    bind = db.session.connection()
+    columns = {column['name'] for column in inspect(bind).get_columns('doctor_schedule')}
+    if 'day_of_week' in columns:
+        bind.execute(text('ALTER TABLE doctor_schedule ADD COLUMN weekday INTEGER NOT NULL DEFAULT 0'))
+        bind.execute(text('ALTER TABLE doctor_schedule ADD COLUMN effective_from DATE'))
+        bind.execute(text('ALTER TABLE doctor_schedule ADD COLUMN effective_to DATE'))
+        bind.execute(text(
+            'UPDATE doctor_schedule SET weekday = CASE lower(day_of_week) '
+            + ' '.join(f"WHEN '{name.lower()}' THEN {weekday}" for weekday, name in enumerate(WEEKDAYS))
+            + ' ELSE 0 END'))
+        bind.execute(text('DROP INDEX IF EXISTS ix_doctor_schedule_doctor_day'))
+        bind.execute(text('ALTER TABLE doctor_schedule DROP COLUMN day_of_week'))
+    ScheduleException.__table__.create(bind, checkfirst=True)
+    _create_indexes(DoctorSchedule, ScheduleException)
+
+
+def _add_analytics_rollups():
+    # Existing appointments keep a NULL updated_at; the first refresh is a
+    # full rebuild and covers them.
+    bind = db.session.connection()
+    columns = {column['name'] for column in inspect(bind).get_columns('appointment')}
+    if 'updated_at' not in columns:
+        bind.execute(text('ALTER TABLE appointment ADD COLUMN updated_at DATETIME'))
+    for model in (AppointmentDayRollup, HourRollup, ScheduleDayRollup, AnalyticsWatermark):
+        model.__table__.create(bind, checkfirst=True)
+    _create_indexes(Appointment)
+
+
+# Tables whose foreign keys gained ON DELETE CASCADE
+CASCADE_MODELS = (Doctor, Patient, DoctorSchedule, ScheduleException, Appointment, Treatment, PrescriptionItem)
+
+
+def _cascading_columns(model):
+    return {fk.parent.name for fk in model.__table__.foreign_keys if fk.ondelete == 'CASCADE'}
+
+
+def _missing_cascades(bind, model):
+    wanted = _cascading_columns(model)
+    have = {column for fk in inspect(bind).get_foreign_keys(model.__tablename__)
+            if (fk.get('options') or {}).get('ondelete', '').upper() == 'CASCADE'
+            for column in fk['constrained_columns']}
+    return bool(wanted - have)
+
+
+def _rebuild_sqlite_tables(models):
+    # SQLite cannot alter a constraint; each table is rebuilt as its docs
+    # describe (create new, copy, drop old, rename) on a dedicated
+    # connection with enforcement off, which can only be switched outside
+    # a transaction.
+    with database.current_engine().connect() as connection:
+        connection.exec_driver_sql('PRAGMA foreign_keys=OFF')
+        connection.commit()
+        try:
+            with connection.begin():
+                for model in models:
+                    name = model.__tablename__
+                    rebuilt = model.__table__.to_metadata(db.metadata, name=f'{name}_rebuild')
+                    try:
+                        connection.execute(CreateTable(rebuilt))
+                    finally:
+                        db.metadata.remove(rebuilt)
+                    existing = {column['name'] for column in inspect(connection).get_columns(name)}
+                    columns = ', '.join(f'"{column.name}"' for column in rebuilt.columns
+                                        if column.name in existing)
+                    connection.exec_driver_sql(
+                        f'INSERT INTO "{name}_rebuild" ({columns}) SELECT {columns} FROM "{name}"')
+                    connection.exec_driver_sql(f'DROP TABLE "{name}"')
+                    connection.exec_driver_sql(f'ALTER TABLE "{name}_rebuild" RENAME TO "{name}"')
+        finally:
+            connection.exec_driver_sql('PRAGMA foreign_keys=ON')
+            connection.commit()
+
+
+def _replace_foreign_keys(bind, model):
+    quote = bind.dialect.identifier_preparer.quote
+    table = model.__tablename__
+    cascading = _cascading_columns(model)
+    for fk in inspect(bind).get_foreign_keys(table):
+        column = fk['constrained_columns'][0]
+        if column in cascading and fk['name']:
+            bind.execute(text(f"ALTER TABLE {quote(table)} DROP CONSTRAINT {quote(fk['name'])}"))
+            bind.execute(text(
+                f"ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(fk['name'])} "
+                f"FOREIGN KEY ({quote(column)}) REFERENCES {quote(fk['referred_table'])} "
+                f"({quote(fk['referred_columns'][0])}) ON DELETE CASCADE"))
+
+
+def _cascade_deletes():
+    bind = db.session.connection()
+    stale = [model for model in CASCADE_MODELS if _missing_cascades(bind, model)]
+    if stale and bind.dialect.name == 'sqlite':
+        db.session.commit()
+        _rebuild_sqlite_tables(stale)
+    else:
+        for model in stale:
+            _replace_foreign_keys(bind, model)
+    AnalyticsDirtyDay.__table__.create(db.session.connection(), checkfirst=True)
+    # Rebuilt tables lost their indexes; Treatment also gains one
+    _create_indexes(*CASCADE_MODELS)
+
+
+def _add_archive_tables():
+    bind = db.session.connection()
+    for model in (ArchivedAppointment, ArchivedTreatment, ArchivedPrescriptionItem):
+        model.__table__.create(bind, checkfirst=True)
+    _create_indexes(ArchivedAppointment, ArchivedTreatment, ArchivedPrescriptionItem)
+
+
+def _add_cache_versions():
+    import fragments
+    CacheVersion.__table__.create(db.session.connection(), checkfirst=True)
+    fragments.seed_versions()
+
+
+def _add_live_events():
+    LiveEvent.__table__.create(db.session.connection(), checkfirst=True)
+    _create_indexes(LiveEvent)
+
+
+def _add_jobs():
+    Job.__table__.create(db.session.connection(), checkfirst=True)
+    _create_indexes(Job)
+
+
+def _add_replica_heartbeat():
+    ReplicaHeartbeat.__table__.create(db.session.connection(), checkfirst=True)
+    if not db.session.get(ReplicaHeartbeat, 1):
+        db.session.add(ReplicaHeartbeat(id=1, beat_at=0))
+
+
+def _add_tenant_logins():
+    # Only the directory database uses it; created everywhere so that
+    # every database has the same schema as create_all() gives a new one
+    TenantLogin.__table__.create(db.session.connection(), checkfirst=True)
+
+
+# Live tables whose rows move to the archive keeping their ids
+ARCHIVED_MODELS = ((Appointment, ArchivedAppointment), (Treatment, ArchivedTreatment),
+                   (PrescriptionItem, ArchivedPrescriptionItem))
+
+
+def _never_reuse_archived_ids():
+    # Without AUTOINCREMENT, SQLite hands out the highest id again once that
+    # row is deleted, which archiving does. Other backends' sequences never
+    # go back.
+    bind = db.session.connection()
+    if bind.dialect.name != 'sqlite':
+        return
+    live = [model for model, _ in ARCHIVED_MODELS]
+    stale = [model for model in live if 'AUTOINCREMENT' not in (bind.execute(
+        text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {'name': model.__tablename__}).scalar() or '').upper()]
+    if stale:
+        db.session.commit()
+        _rebuild_sqlite_tables(stale)
+        # Rebuilt tables lost their indexes
+        _create_indexes(*stale)
+    # Ids already archived were handed out too
+    bind = db.session.connection()
+    for model, archived in ARCHIVED_MODELS:
+        name = model.__tablename__
+        used = max(bind.execute(text('SELECT seq FROM sqlite_sequence WHERE name = :name'),
+                                {'name': name}).scalar() or 0,
+                   db.session.query(func.max(model.id)).scalar() or 0,
+                   db.session.query(func.max(archived.id)).scalar() or 0)
+        bind.execute(text('DELETE FROM sqlite_sequence WHERE name = :name'), {'name': name})
+        bind.execute(text('INSERT INTO sqlite_sequence (name, seq) VALUES (:name, :seq)'),
+                     {'name': name, 'seq': used})
+
+
+def _add_dashboard_stat_deltas():
+    import fragments
+    DashboardStatDelta.__table__.create(db.session.connection(), checkfirst=True)
+    fragments.seed_versions()
+
+
+MIGRATIONS = [
+    (1, 'Composite indexes on appointment, schedule and user hot columns', _add_hot_column_indexes),
+    (2, 'Unique live appointment per doctor and slot start', _add_slot_guard_index),
+    (3, 'Seed maintained dashboard counters', _seed_dashboard_stats),
+    (4, 'Doctor and patient search index', _build_search_index),
+    (5, 'Prescription line items with a per-drug index', _add_prescription_items),
+    (6, 'Integer schedule weekdays, validity dates and schedule exceptions', _integer_weekdays),
+    (7, 'Appointment updated_at high-water mark and analytics rollup tables', _add_analytics_rollups),
+    (8, 'ON DELETE CASCADE foreign keys and analytics dirty days', _cascade_deletes),
+    (9, 'Archive tables for old appointments, treatments and prescription items', _add_archive_tables),
+    (10, 'Per-table cache versions for fragment caching and ETags', _add_cache_versions),
+    (11, 'Live event feed for server-sent updates', _add_live_events),
+    (12, 'Background job queue', _add_jobs),
+    (13, 'Replication heartbeat for read replica lag checks', _add_replica_heartbeat),
+    (14, 'Hospital login directory', _add_tenant_logins),
+    (15, 'Never reuse the ids of archived appointments, treatments and prescription items',
+     _never_reuse_archived_ids),
+    (16, 'Append-only dashboard counter deltas', _add_dashboard_stat_deltas),
+]
+
+
+def current_version():
+    if not inspect(database.current_engine()).has_table(SchemaVersion.__tablename__):
+        return 0
+    return db.session.query(db.func.max(SchemaVersion.version)).scalar() or 0
+
+
+def upgrade():
+    # Brand-new databases get every table and index from create_all(); the
+    # steps below are still run so the version table reflects the schema.
+    db.metadata.create_all(database.current_engine())
+    applied = []
+    version = current_version()
+    for step_version, description, step in MIGRATIONS:
+        if step_version <= version:
+            continue
+        step()
+        db.session.add(SchemaVersion(version=step_version, description=description))
+        db.session.commit()
+        applied.append(step_version)
+    return applied
+
+
+def seed_admin():
+    import passwords
+    if User.query.filter_by(role='admin').first():
+        return False
+    db.session.add(User(
+        full_name='System Admin',
+        username='admin',
+        password_hash=passwords.hash_password('admin123'),
+        email='admin@hospital.com',
+        role='admin'
+    ))
+    db.session.commit()
+    return True
+
+
+def init_db():
+    # Run once per deployment (`flask init-db`), not by every worker at boot
+    applied = upgrade()
+    return applied, seed_admin()
+
+
+def init_commands(app):
+    @app.cli.command('init-db')
+    def init_db_command():
+        applied, seeded = init_db()
+        click.echo(f"Schema at version {current_version()}"
+                   f" ({len(applied)} migration(s) applied).")
+        if seeded:
+            click.echo('Created the default admin account (admin / admin123); change its password.')
+
+    @app.cli.command('db-upgrade')
+    def db_upgrade_command():
+        applied = upgrade()
+        if applied:
+            click.echo(f"Applied migrations: {', '.join(map(str, applied))}")
+        else:
+            click.echo(f"Schema is up to date (version {current_version()}).")
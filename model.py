@@ -1,10 +1,13 @@
 
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, backref
 
+from replicas import RoutingSession
 
-db = SQLAlchemy()  
+
+# Reads of marked views can go to a read replica; see replicas.py
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -16,8 +19,18 @@ class User(db.Model):
     role = db.Column(db.String(20), default='patient', nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
-    doctor_profile = relationship('Doctor', backref='user', uselist=False)
-    patient_profile = relationship('Patient', backref='user', uselist=False)
+    # Profiles and everything under them are removed by the database's
+    # ON DELETE CASCADE foreign keys (see removal.py); passive_deletes keeps
+    # the ORM from loading them first.
+    doctor_profile = relationship('Doctor', backref='user', uselist=False,
+                                  cascade='all, delete-orphan', passive_deletes=True)
+    patient_profile = relationship('Patient', backref='user', uselist=False,
+                                   cascade='all, delete-orphan', passive_deletes=True)
+
+    __table_args__ = (
+        # Dashboard counts: User.query.filter_by(role='patient').count()
+        db.Index('ix_user_role', 'role'),
+    )
 
 class Department(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -30,60 +43,355 @@ class Department(db.Model):
 
 class Doctor(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), unique=True, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), unique=True, nullable=False)
     specialization_id = db.Column(db.Integer, db.ForeignKey('department.id'), nullable=False)
     contact_number = db.Column(db.String(20))
     licence_number = db.Column(db.String(50), unique=True)
     is_blacklisted = db.Column(db.Boolean, default=False)
     
     # Relationships: One Doctor has many Appointments and Schedules
-    appointments = relationship('Appointment', backref='doctor')
-    schedules = relationship('DoctorSchedule', backref='doctor')
+    appointments = relationship('Appointment', backref='doctor',
+                                cascade='all, delete-orphan', passive_deletes=True)
+    schedules = relationship('DoctorSchedule', backref='doctor',
+                             cascade='all, delete-orphan', passive_deletes=True)
+
+    __table_args__ = (
+        db.Index('ix_doctor_specialization_id', 'specialization_id'),
+    )
 
 class DoctorSchedule(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False)
-    day_of_week = db.Column(db.String(10), nullable=False) # e.g., 'Monday'
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id', ondelete='CASCADE'), nullable=False)
+    weekday = db.Column(db.Integer, nullable=False) # 0 = Monday ... 6 = Sunday
     start_time = db.Column(db.Time, nullable=False) 
     end_time = db.Column(db.Time, nullable=False)
+    # Optional validity range (inclusive); NULL means open-ended
+    effective_from = db.Column(db.Date)
+    effective_to = db.Column(db.Date)
+
+    __table_args__ = (
+        # Per-doctor schedule lookups, overlap checks and the dashboard's
+        # (doctor, weekday) ordering
+        db.Index('ix_doctor_schedule_doctor_weekday', 'doctor_id', 'weekday'),
+    )
+
+
+class ScheduleException(db.Model):
+    # Whole days (inclusive range) on which a doctor's schedule does not
+    # apply: leave, or with doctor_id NULL a hospital-wide holiday.
+    id = db.Column(db.Integer, primary_key=True)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id', ondelete='CASCADE'))
+    start_date = db.Column(db.Date, nullable=False)
+    end_date = db.Column(db.Date, nullable=False)
+    reason = db.Column(db.String(100))
+
+    doctor = relationship('Doctor', backref=backref('schedule_exceptions', cascade='all, delete-orphan',
+                                                    passive_deletes=True))
+
+    __table_args__ = (
+        db.Index('ix_schedule_exception_doctor_end', 'doctor_id', 'end_date'),
+    )
 
     
 class Patient(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     
     # Foreign Key to the User table (One-to-One)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), unique=True, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), unique=True, nullable=False)
     date_of_birth = db.Column(db.Date)
     contact_number = db.Column(db.String(20))
     medical_history_summary = db.Column(db.Text)
     is_blacklisted = db.Column(db.Boolean, default=False)
     
     # Relationship: One Patient has many Appointments
-    appointments = relationship('Appointment', backref='patient')
+    appointments = relationship('Appointment', backref='patient',
+                                cascade='all, delete-orphan', passive_deletes=True)
 
 
 class Appointment(db.Model):
+    # ArchivedAppointment sets this; templates use it to hide live actions
+    archived = False
+
     id = db.Column(db.Integer, primary_key=True)
-    patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False)
-    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False)
+    patient_id = db.Column(db.Integer, db.ForeignKey('patient.id', ondelete='CASCADE'), nullable=False)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id', ondelete='CASCADE'), nullable=False)
     start_time = db.Column(db.DateTime, nullable=False)
     end_time = db.Column(db.DateTime, nullable=False)
     status = db.Column(db.String(20), default='Booked', nullable=False)
+    # Set on every insert and update; the analytics refresh uses it as its
+    # high-water mark (see analytics.py)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationship: One Appointment has one Treatment record
-    treatment_record = relationship('Treatment', backref='appointment', uselist=False)
+    treatment_record = relationship('Treatment', backref='appointment', uselist=False,
+                                    cascade='all, delete-orphan', passive_deletes=True)
+
+    __table_args__ = (
+        # Dashboard keyset pagination: ORDER BY start_time DESC, id DESC
+        db.Index('ix_appointment_start_time_id', 'start_time', 'id'),
+        # Per-doctor / per-patient agendas and histories ordered by time
+        db.Index('ix_appointment_doctor_start', 'doctor_id', 'start_time'),
+        db.Index('ix_appointment_patient_start', 'patient_id', 'start_time'),
+        # Status filters and per-status counts
+        db.Index('ix_appointment_status_start', 'status', 'start_time'),
+        # Analytics refresh: WHERE updated_at > high-water mark
+        db.Index('ix_appointment_updated_at', 'updated_at'),
+        # Double-booking guard: one live appointment per doctor per slot start.
+        # Canceled rows are excluded so a released slot can be booked again.
+        db.Index('uq_appointment_doctor_slot', 'doctor_id', 'start_time', unique=True,
+                 sqlite_where=db.text("status != 'Canceled'"),
+                 postgresql_where=db.text("status != 'Canceled'")),
+        # Archived rows keep their ids, so SQLite must never reuse the id of
+        # a row moved to the archive (see archive.py)
+        {'sqlite_autoincrement': True},
+    )
 
 class Treatment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     
     # Foreign Key to the Appointment table (One-to-One)
-    appointment_id = db.Column(db.Integer, db.ForeignKey('appointment.id'), unique=True, nullable=False)
+    appointment_id = db.Column(db.Integer, db.ForeignKey('appointment.id', ondelete='CASCADE'), unique=True, nullable=False)
     diagnosis = db.Column(db.Text, nullable=False)
-    prescription = db.Column(db.Text, nullable=False) # Stored as text/JSON string if complex
+    prescription = db.Column(db.Text, nullable=False) # Readable summary; line items live in PrescriptionItem
     notes = db.Column(db.Text)
     
     # Optional FK: Record who created the treatment (The Doctor)
-    created_by_doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False)
-    doctor_creator = relationship('Doctor', backref='created_treatments', foreign_keys=[created_by_doctor_id])
+    created_by_doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id', ondelete='CASCADE'), nullable=False)
+    doctor_creator = relationship('Doctor', backref=backref('created_treatments', passive_deletes=True),
+                                  foreign_keys=[created_by_doctor_id])
 
-    
+    # Relationship: One Treatment has many prescription line items
+    items = relationship('PrescriptionItem', backref='treatment', order_by='PrescriptionItem.id',
+                         cascade='all, delete-orphan', passive_deletes=True)
+
+    __table_args__ = (
+        # Lets the doctor ON DELETE CASCADE find authored treatments
+        db.Index('ix_treatment_created_by_doctor_id', 'created_by_doctor_id'),
+        {'sqlite_autoincrement': True},
+    )
+
+
+class PrescriptionItem(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    treatment_id = db.Column(db.Integer, db.ForeignKey('treatment.id', ondelete='CASCADE'), nullable=False)
+    drug = db.Column(db.String(100), nullable=False)
+    dose = db.Column(db.String(50), nullable=False)
+    frequency = db.Column(db.String(50), nullable=False)
+    duration_days = db.Column(db.Integer)
+    # Copy of the appointment's start_time so per-drug reports filter on
+    # this table alone
+    prescribed_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        # Pharmacy reports: WHERE drug = ? AND prescribed_at BETWEEN ? AND ?
+        db.Index('ix_prescription_item_drug_prescribed', 'drug', 'prescribed_at'),
+        db.Index('ix_prescription_item_treatment_id', 'treatment_id'),
+        {'sqlite_autoincrement': True},
+    )
+
+
+class DashboardStat(db.Model):
+    # Maintained counters for the admin dashboard cards (see stats.py).
+    # Keys: 'doctors', 'patients', 'appointments', 'appointments:<status>'
+    key = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Integer, default=0, nullable=False)
+    reconciled_at = db.Column(db.DateTime)
+
+
+class DashboardStatDelta(db.Model):
+    # Pending counter changes. Writers append a row instead of updating the
+    # counter, so concurrent bookings never wait on one hot row; the job
+    # worker folds them into DashboardStat (stats.fold()).
+    __tablename__ = 'dashboard_stat_delta'
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(50), nullable=False)
+    delta = db.Column(db.Integer, nullable=False)
+
+
+# --- Analytics rollups ---
+# Daily aggregates maintained by analytics.refresh(); reports read these
+# instead of the appointment table.
+
+class AppointmentDayRollup(db.Model):
+    __tablename__ = 'analytics_appointment_day'
+    day = db.Column(db.Date, primary_key=True)
+    doctor_id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String(20), primary_key=True)
+    appointments = db.Column(db.Integer, nullable=False)
+    minutes = db.Column(db.Integer, nullable=False)
+
+
+class HourRollup(db.Model):
+    # Live (not canceled) appointments per department and starting hour
+    __tablename__ = 'analytics_hour_day'
+    day = db.Column(db.Date, primary_key=True)
+    department_id = db.Column(db.Integer, primary_key=True)
+    hour = db.Column(db.Integer, primary_key=True)
+    appointments = db.Column(db.Integer, nullable=False)
+
+
+class ScheduleDayRollup(db.Model):
+    # Bookable minutes per doctor and day, from the expanded schedule
+    __tablename__ = 'analytics_schedule_day'
+    day = db.Column(db.Date, primary_key=True)
+    doctor_id = db.Column(db.Integer, primary_key=True)
+    scheduled_minutes = db.Column(db.Integer, nullable=False)
+
+
+class AnalyticsWatermark(db.Model):
+    # 'appointments': newest Appointment.updated_at already rolled up
+    # 'schedules': last day whose scheduled minutes are rolled up
+    __tablename__ = 'analytics_watermark'
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.DateTime, nullable=False)
+    refreshed_at = db.Column(db.DateTime)
+
+
+class AnalyticsDirtyDay(db.Model):
+    # Days whose appointment rollups must be recomputed because rows were
+    # deleted; deletes leave no updated_at behind for the high-water mark
+    __tablename__ = 'analytics_dirty_day'
+    day = db.Column(db.Date, primary_key=True)
+
+
+# --- Archive ---
+# Completed and canceled appointments past ARCHIVE_AFTER_DAYS are moved here
+# with their treatments by archive.py. Rows keep their ids (the live tables
+# are AUTOINCREMENT on SQLite, so an id is never handed out twice), and the
+# relationship names match the live models so the same templates render
+# either kind.
+
+class ArchivedAppointment(db.Model):
+    __tablename__ = 'archived_appointment'
+    archived = True
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    patient_id = db.Column(db.Integer, db.ForeignKey('patient.id', ondelete='CASCADE'), nullable=False)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id', ondelete='CASCADE'), nullable=False)
+    start_time = db.Column(db.DateTime, nullable=False)
+    end_time = db.Column(db.DateTime, nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    updated_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    doctor = relationship('Doctor')
+    patient = relationship('Patient')
+    treatment_record = relationship('ArchivedTreatment', backref='appointment', uselist=False,
+                                    cascade='all, delete-orphan', passive_deletes=True)
+
+    __table_args__ = (
+        db.Index('ix_archived_appointment_start_time_id', 'start_time', 'id'),
+        db.Index('ix_archived_appointment_doctor_start', 'doctor_id', 'start_time'),
+        db.Index('ix_archived_appointment_patient_start', 'patient_id', 'start_time'),
+    )
+
+
+class ArchivedTreatment(db.Model):
+    __tablename__ = 'archived_treatment'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    appointment_id = db.Column(db.Integer, db.ForeignKey('archived_appointment.id', ondelete='CASCADE'),
+                               unique=True, nullable=False)
+    diagnosis = db.Column(db.Text, nullable=False)
+    prescription = db.Column(db.Text, nullable=False)
+    notes = db.Column(db.Text)
+    created_by_doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id', ondelete='CASCADE'), nullable=False)
+
+    doctor_creator = relationship('Doctor', foreign_keys=[created_by_doctor_id])
+    items = relationship('ArchivedPrescriptionItem', backref='treatment', order_by='ArchivedPrescriptionItem.id',
+                         cascade='all, delete-orphan', passive_deletes=True)
+
+    __table_args__ = (
+        db.Index('ix_archived_treatment_created_by_doctor_id', 'created_by_doctor_id'),
+    )
+
+
+class ArchivedPrescriptionItem(db.Model):
+    __tablename__ = 'archived_prescription_item'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    treatment_id = db.Column(db.Integer, db.ForeignKey('archived_treatment.id', ondelete='CASCADE'), nullable=False)
+    drug = db.Column(db.String(100), nullable=False)
+    dose = db.Column(db.String(50), nullable=False)
+    frequency = db.Column(db.String(50), nullable=False)
+    duration_days = db.Column(db.Integer)
+    prescribed_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_archived_prescription_item_drug_prescribed', 'drug', 'prescribed_at'),
+        db.Index('ix_archived_prescription_item_treatment_id', 'treatment_id'),
+    )
+
+
+class CacheVersion(db.Model):
+    # One row per table, bumped right after any commit that wrote to it;
+    # cached fragments and ETags are keyed on these (see fragments.py)
+    __tablename__ = 'cache_version'
+    table = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, default=0, nullable=False)
+
+
+class LiveEvent(db.Model):
+    # Change feed behind /events (see live.py). Written in the same
+    # transaction as the change it describes; pruned after
+    # LIVE_EVENT_RETENTION seconds. doctor_id is not a foreign key so
+    # events outlive the rows they mention.
+    __tablename__ = 'live_event'
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(30), nullable=False)
+    doctor_id = db.Column(db.Integer)
+    payload = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_live_event_created_at', 'created_at'),
+    )
+
+
+class Job(db.Model):
+    # Background work run by `flask run-jobs` (see jobs.py). key, when set,
+    # makes enqueueing idempotent: a second job with the same key is dropped.
+    __tablename__ = 'job'
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    key = db.Column(db.String(120), unique=True)
+    payload = db.Column(db.Text, nullable=False, default='{}')
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = db.Column(db.String(100))
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    result = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        # Claiming: the oldest due queued jobs
+        db.Index('ix_job_status_run_at', 'status', 'run_at', 'id'),
+    )
+
+
+class ReplicaHeartbeat(db.Model):
+    # A single row; replicas.py compares its beat_at (epoch seconds) on the
+    # primary and on each replica to measure replication lag
+    __tablename__ = 'replica_heartbeat'
+    id = db.Column(db.Integer, primary_key=True)
+    beat_at = db.Column(db.Float, nullable=False, default=0)
+
+
+class TenantLogin(db.Model):
+    # Used in the directory database of multi-hospital deployments only
+    # (see tenants.py): which hospital a username logs in to. The same
+    # username may exist in several hospitals; those users sign in at their
+    # hospital's own address.
+    __tablename__ = 'tenant_login'
+    tenant = db.Column(db.String(63), primary_key=True)
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    username = db.Column(db.String(150), nullable=False)
+    email = db.Column(db.String(150), nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_tenant_login_username', 'username'),
+    )
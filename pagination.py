@@ -0,0 +1,102 @@
+import base64
+import json
+from datetime import date, datetime, time
+
+from sqlalchemy import and_, or_
+
+
+# --- Cursor encoding ---
+# A cursor is the sort key of the last row on a page, serialised to an opaque
+# url-safe string so it can travel in a query string.
+
+def _dump_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    if isinstance(value, date):
+        return {'d': value.isoformat()}
+    if isinstance(value, time):
+        return {'t': value.isoformat()}
+    return value
+
+
+_LOADERS = {'dt': datetime.fromisoformat, 'd': date.fromisoformat, 't': time.fromisoformat}
+
+
+def _load_value(value):
+    # Raises ValueError/TypeError for anything encode_cursor would not emit
+    if isinstance(value, dict):
+        if len(value) != 1 or next(iter(value)) not in _LOADERS:
+            raise ValueError('unknown cursor value')
+        kind, text = next(iter(value.items()))
+        return _LOADERS[kind](text)
+    if isinstance(value, (list, float)):
+        raise ValueError('unknown cursor value')
+    return value
+
+
+def encode_cursor(values):
+    payload = json.dumps([_dump_value(v) for v in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    # Cursors come from the query string, so anything malformed or tampered
+    # with reads as "no cursor" (the first page) rather than an error
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(values, list):
+            return None
+        return [_load_value(v) for v in values]
+    except (ValueError, TypeError):
+        return None
+
+
+def _fits(columns, values):
+    # Each value must have its column's Python type, or binding it fails
+    if values is None or len(values) != len(columns):
+        return False
+    for column, value in zip(columns, values):
+        try:
+            expected = column.type.python_type
+        except NotImplementedError:
+            continue
+        if value is None or not isinstance(value, expected) or (isinstance(value, bool) and expected is not bool):
+            return False
+    return True
+
+
+# --- Keyset filtering ---
+
+def keyset_filter(columns, values, descending=False):
+    # Expands (a, b, c) > (x, y, z) into
+    # a > x OR (a = x AND b > y) OR (a = x AND b = y AND c > z)
+    # which every backend can serve from a composite index. The redundant
+    # a >= x in front gives the planner a range to seek to; without it an
+    # OR over joined tables can walk the index from the start.
+    clauses = []
+    for i, column in enumerate(columns):
+        equal_prefix = [columns[j] == values[j] for j in range(i)]
+        step = column < values[i] if descending else column > values[i]
+        clauses.append(and_(*equal_prefix, step))
+    bound = columns[0] <= values[0] if descending else columns[0] >= values[0]
+    return and_(bound, or_(*clauses))
+
+
+def keyset_page(query, columns, cursor, limit, key_fn, descending=False):
+    # Returns (rows, next_cursor). One extra row is fetched to know whether a
+    # further page exists without issuing a COUNT.
+    values = decode_cursor(cursor)
+    if _fits(columns, values):
+        query = query.filter(keyset_filter(columns, values, descending))
+
+    ordering = [c.desc() if descending else c.asc() for c in columns]
+    rows = query.order_by(*ordering).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(key_fn(rows[-1]))
+    return rows, next_cursor
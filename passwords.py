@@ -0,0 +1,220 @@
+import secrets
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from flask import current_app, g
+from sqlalchemy import update
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from model import db, User
+
+
+# --- Hashing ---
+# PASSWORD_HASH_METHOD is any werkzeug method string, e.g. 'scrypt',
+# 'scrypt:16384:8:1' or 'pbkdf2:sha256:600000'. Hashes made with different
+# parameters keep verifying and are upgraded on the user's next login.
+
+_verify_pool = None
+_rehash_pool = None
+_pool_lock = threading.Lock()
+_method_prefixes = {}
+_dummy_hashes = {}
+
+
+def hash_method():
+    return current_app.config.get('PASSWORD_HASH_METHOD', 'scrypt')
+
+
+def hash_password(password):
+    return generate_password_hash(password, method=hash_method(),
+                                  salt_length=current_app.config.get('PASSWORD_SALT_LENGTH', 16))
+
+
+def _method_prefix(method):
+    # werkzeug fills in default cost parameters ('scrypt' becomes
+    # 'scrypt:32768:8:1'); hash a throwaway value once to learn the full form.
+    if method not in _method_prefixes:
+        _method_prefixes[method] = generate_password_hash('', method=method).split('$', 1)[0]
+    return _method_prefixes[method]
+
+
+def needs_rehash(password_hash):
+    return password_hash.split('$', 1)[0] != _method_prefix(hash_method())
+
+
+def _get_verify_pool(workers):
+    global _verify_pool
+    with _pool_lock:
+        if _verify_pool is None:
+            _verify_pool = ProcessPoolExecutor(max_workers=workers)
+        return _verify_pool
+
+
+def verify_password(password_hash, password):
+    if not password_hash or password is None:
+        return False
+    workers = current_app.config.get('PASSWORD_VERIFY_WORKERS', 0)
+    if not workers:
+        return check_password_hash(password_hash, password)
+    # Hash checks are pure CPU; running them in worker processes keeps the
+    # request worker free to serve other requests (under threaded or gevent
+    # workers) while the check runs.
+    return _get_verify_pool(workers).submit(check_password_hash, password_hash, password).result()
+
+
+def _dummy_hash():
+    # Verified in place of a real hash when the username does not exist, so
+    # an unknown username takes as long to reject as a wrong password
+    method = hash_method()
+    if method not in _dummy_hashes:
+        _dummy_hashes[method] = hash_password(secrets.token_hex(16))
+    return _dummy_hashes[method]
+
+
+def hash_passwords(passwords, pool=None):
+    # Bulk variant for imports. `pool` is a ProcessPoolExecutor owned by the
+    # caller so that it is reused across batches; without one, hash serially.
+    method = hash_method()
+    salt_length = current_app.config.get('PASSWORD_SALT_LENGTH', 16)
+    if pool is None:
+        return [generate_password_hash(p, method=method, salt_length=salt_length) for p in passwords]
+    return list(pool.map(generate_password_hash, passwords,
+                         [method] * len(passwords), [salt_length] * len(passwords),
+                         chunksize=64))
+
+
+# --- Login throttling ---
+# Failed attempts are counted per username and per client address in a
+# sliding window. Once a username reaches LOGIN_MAX_ATTEMPTS, or an address
+# LOGIN_MAX_ATTEMPTS_PER_ADDR (much higher, since many users can share one
+# address), the login is rejected before any hash is computed. Counts are
+# per process.
+
+class LoginThrottled(Exception):
+    pass
+
+
+# key -> deque of (monotonic time, username) failures
+_failures = {}
+_failures_lock = threading.Lock()
+
+
+def _window():
+    return current_app.config.get('LOGIN_THROTTLE_WINDOW', 300)
+
+
+def _recent(key, now):
+    attempts = _failures.get(key)
+    if attempts is None:
+        return 0
+    cutoff = now - _window()
+    while attempts and attempts[0][0] < cutoff:
+        attempts.popleft()
+    if not attempts:
+        del _failures[key]
+        return 0
+    return len(attempts)
+
+
+def _name(username):
+    return (username or '').lower()
+
+
+def _keys(username, remote_addr):
+    return [('user', _name(username)), ('addr', remote_addr)]
+
+
+def _limits():
+    config = current_app.config
+    return {'user': config.get('LOGIN_MAX_ATTEMPTS', 5), 'addr': config.get('LOGIN_MAX_ATTEMPTS_PER_ADDR', 100)}
+
+
+def is_throttled(username, remote_addr):
+    limits = _limits()
+    now = time.monotonic()
+    with _failures_lock:
+        return any(limits[key[0]] and _recent(key, now) >= limits[key[0]]
+                   for key in _keys(username, remote_addr))
+
+
+def record_failure(username, remote_addr):
+    now = time.monotonic()
+    with _failures_lock:
+        for key in _keys(username, remote_addr):
+            _failures.setdefault(key, deque()).append((now, _name(username)))
+        if len(_failures) > 10000:
+            for key in list(_failures):
+                _recent(key, now)
+
+
+def clear_failures(username, remote_addr):
+    # The address keeps the failures of other usernames, so logging in to
+    # one account does not reset the count for guesses at the others
+    name = _name(username)
+    with _failures_lock:
+        _failures.pop(('user', name), None)
+        key = ('addr', remote_addr)
+        if key in _failures:
+            _failures[key] = deque(attempt for attempt in _failures[key] if attempt[1] != name)
+            if not _failures[key]:
+                del _failures[key]
+
+
+# --- Rehashing ---
+# Upgrading an outdated hash costs as much as a login's verify, so it runs
+# on a background thread after the response instead of on the login
+# request. It stays in process rather than on the job queue because it
+# needs the plaintext password, which must never be written to the jobs
+# table. A rehash lost to a restart simply happens on the next login.
+
+def _get_rehash_pool():
+    global _rehash_pool
+    with _pool_lock:
+        if _rehash_pool is None:
+            _rehash_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='rehash')
+        return _rehash_pool
+
+
+def _rehash(app, tenant, user_id, old_hash, password):
+    import identity
+    with app.app_context():
+        g.tenant = tenant
+        try:
+            # Only if the hash is still the one verified: a password change
+            # in the meantime wins
+            db.session.execute(update(User)
+                               .where(User.id == user_id, User.password_hash == old_hash)
+                               .values(password_hash=hash_password(password)))
+            db.session.commit()
+            identity.invalidate(user_id)
+        finally:
+            db.session.remove()
+
+
+def rehash_later(user, password):
+    import tenants
+    return _get_rehash_pool().submit(_rehash, current_app._get_current_object(), tenants.current(),
+                                     user.id, user.password_hash, password)
+
+
+# --- Login ---
+
+def authenticate(username, password, remote_addr):
+    if is_throttled(username, remote_addr):
+        raise LoginThrottled()
+
+    user = User.query.filter_by(username=username).first()
+    if not user:
+        verify_password(_dummy_hash(), password)
+        record_failure(username, remote_addr)
+        return None
+    if not verify_password(user.password_hash, password):
+        record_failure(username, remote_addr)
+        return None
+
+    clear_failures(username, remote_addr)
+    if needs_rehash(user.password_hash):
+        rehash_later(user, password)
+    return user
@@ -0,0 +1,61 @@
+from sqlalchemy import delete, func, or_, select
+
+from model import db, User, Doctor, Patient, Appointment, ArchivedAppointment
+from bulk_io import chunked
+import stats
+import identity
+import agenda
+import analytics
+import search_index
+import tenants
+
+
+# Kept well below SQLite's bound-parameter limit
+ID_CHUNK = 500
+
+
+# --- Removal ---
+# Doctors and patients are removed by deleting their User rows. The
+# ON DELETE CASCADE foreign keys then remove the profile, schedules, leave,
+# appointments, treatments and prescription items inside the database, so
+# nothing is loaded into the session however busy the doctor was. What the
+# cascade cannot see (dashboard counters, analytics days, the search index
+# and the per-process caches) is adjusted with one aggregate query per
+# chunk of users before the delete.
+
+def remove_users(user_ids):
+    # Removes doctors and patients in one transaction and returns the ids
+    # removed; unknown ids and other roles are skipped.
+    removed = []
+    for chunk in chunked(user_ids, ID_CHUNK):
+        ids = [user_id for (user_id,) in db.session.query(User.id).filter(
+            User.id.in_(chunk), User.role.in_(('doctor', 'patient')))]
+        if not ids:
+            continue
+        # Archived appointments count towards the totals too and cascade
+        # with the user just the same
+        by_status = []
+        for model in (Appointment, ArchivedAppointment):
+            doomed = or_(model.doctor_id.in_(select(Doctor.id).where(Doctor.user_id.in_(ids))),
+                         model.patient_id.in_(select(Patient.id).where(Patient.user_id.in_(ids))))
+            by_status += db.session.query(model.status, func.count()).filter(doomed) \
+                .group_by(model.status).all()
+            analytics.invalidate_days(doomed, model=model)
+        for status, count in by_status:
+            stats.bump(stats.status_key(status), -count)
+        stats.bump('appointments', -sum(count for _, count in by_status))
+        stats.bump('doctors', -db.session.query(Doctor).filter(Doctor.user_id.in_(ids)).count())
+        stats.bump('patients', -db.session.query(User).filter(User.id.in_(ids), User.role == 'patient').count())
+
+        db.session.execute(delete(User).where(User.id.in_(ids)), execution_options={'synchronize_session': False})
+        search_index.sync_users(db.session.connection(), ids)
+        tenants.sync_logins(db.session, ids)
+        removed.extend(ids)
+    db.session.commit()
+
+    for user_id in removed:
+        identity.invalidate(user_id)
+    if removed:
+        # Removed patients may appear on any doctor's agenda
+        agenda.invalidate()
+    return removed
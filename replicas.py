@@ -0,0 +1,215 @@
+import itertools
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import click
+from flask import current_app, g, has_app_context, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import NullPool
+from sqlalchemy.sql import Select
+
+
+# --- Routing ---
+# Views marked with @replica_reads send their SELECTs to a read replica
+# (DATABASE_REPLICA_URIS); everything else, and every write, uses the
+# primary. A request falls back to the primary:
+#   - once it has written anything itself,
+#   - for REPLICA_STICKY_SECONDS after the same browser session wrote
+#     (read-your-writes: the change may not have replicated yet),
+#   - when no replica is within REPLICA_MAX_LAG seconds of the primary.
+# One replica is picked per request, so a page never mixes two of them.
+# Requests outside a marked view, CLI commands and background threads
+# always use the primary.
+
+READ_STATEMENT = re.compile(r'\s*(SELECT|WITH)\b', re.IGNORECASE)
+
+_PRIMARY = object()
+
+
+def replica_reads(view):
+    view.replica_reads = True
+    return view
+
+
+def _is_read(clause):
+    if isinstance(clause, Select):
+        return True
+    return clause is not None and hasattr(clause, 'text') and bool(READ_STATEMENT.match(clause.text))
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context() and 'tenants' in current_app.extensions:
+            # Multi-hospital deployments use the current hospital's database
+            # (see tenants.py); replicas are not used there
+            engine = current_app.extensions['tenants'].engine_for_context()
+            if engine is not None:
+                return engine
+        if bind is None and has_request_context():
+            if self._flushing or not _is_read(clause):
+                g.db_wrote = True
+            else:
+                engine = _read_engine()
+                if engine is not None:
+                    return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _read_engine():
+    if g.get('db_wrote'):
+        return None
+    choice = g.get('db_read_engine')
+    if choice is None:
+        choice = g.db_read_engine = _choose_replica() or _PRIMARY
+    return None if choice is _PRIMARY else choice
+
+
+def _choose_replica():
+    replicas = current_app.extensions.get('replicas')
+    if not replicas or not replicas.replicas:
+        return None
+    view = current_app.view_functions.get(request.endpoint)
+    if not getattr(view, 'replica_reads', False):
+        return None
+    if session.get('db_primary_until', 0) > time.time():
+        return None
+    return replicas.pick()
+
+
+def _remember_writes(response):
+    # Read-your-writes for this browser session
+    if g.get('db_wrote'):
+        session['db_primary_until'] = time.time() + current_app.config['REPLICA_STICKY_SECONDS']
+    return response
+
+
+# --- Replication lag ---
+# The primary's replica_heartbeat row holds a timestamp, refreshed at most
+# every REPLICA_LAG_CHECK_INTERVAL seconds by whichever process checks
+# lag. A replica's lag is how far its copy of that timestamp trails the
+# primary's. Lag is re-checked at the same interval; a replica that cannot
+# be read counts as too far behind.
+
+HEARTBEAT_TABLE = 'replica_heartbeat'
+
+
+class Replica:
+    def __init__(self, url, engine):
+        self.url = url
+        self.engine = engine
+        self.lag = None
+        self.error = None
+
+
+class Replicas:
+    def __init__(self, app, replicas):
+        self.app = app
+        self.replicas = replicas
+        self.lock = threading.Lock()
+        self.checked_at = None
+        self.turn = itertools.count()
+
+    def _beat(self, primary):
+        with primary.begin() as connection:
+            beat = connection.execute(text(f'SELECT beat_at FROM {HEARTBEAT_TABLE} WHERE id = 1')).scalar()
+            now = time.time()
+            if beat is None or now - beat >= self.app.config['REPLICA_LAG_CHECK_INTERVAL']:
+                connection.execute(text(f'UPDATE {HEARTBEAT_TABLE} SET beat_at = :now WHERE id = 1'), {'now': now})
+                beat = now
+        return beat
+
+    def check(self):
+        primary = self.app.extensions['sqlalchemy'].engine
+        beat = self._beat(primary)
+        for replica in self.replicas:
+            try:
+                with replica.engine.connect() as connection:
+                    seen = connection.execute(text(f'SELECT beat_at FROM {HEARTBEAT_TABLE} WHERE id = 1')).scalar()
+                replica.lag = max(0.0, beat - (seen or 0))
+                replica.error = None
+            except Exception as error:
+                replica.lag = None
+                replica.error = repr(error)
+
+    def pick(self):
+        interval = self.app.config['REPLICA_LAG_CHECK_INTERVAL']
+        now = time.monotonic()
+        if self.checked_at is None or now - self.checked_at >= interval:
+            with self.lock:
+                if self.checked_at is None or now - self.checked_at >= interval:
+                    self.check()
+                    self.checked_at = now
+        max_lag = self.app.config['REPLICA_MAX_LAG']
+        fresh = [replica for replica in self.replicas if replica.lag is not None and replica.lag <= max_lag]
+        if not fresh:
+            return None
+        return fresh[next(self.turn) % len(fresh)].engine
+
+    def status(self):
+        return [{'url': make_url(replica.url).render_as_string(hide_password=True),
+                 'lag_seconds': replica.lag, 'error': replica.error} for replica in self.replicas]
+
+
+def engines(app):
+    replicas = app.extensions.get('replicas')
+    return [replica.engine for replica in replicas.replicas] if replicas else []
+
+
+def _replica_engine(app, uri):
+    url = make_url(uri)
+    if url.get_backend_name() == 'sqlite':
+        # A fresh connection per checkout, so a replica file replaced by
+        # `flask sync-replica` is picked up at once
+        return create_engine(url, poolclass=NullPool,
+                             connect_args={'timeout': app.config['SQLITE_BUSY_TIMEOUT'] / 1000})
+    return create_engine(url, pool_pre_ping=app.config['DB_POOL_PRE_PING'],
+                         pool_recycle=app.config['DB_POOL_RECYCLE'], pool_size=app.config['DB_POOL_SIZE'],
+                         max_overflow=app.config['DB_MAX_OVERFLOW'], pool_timeout=app.config['DB_POOL_TIMEOUT'])
+
+
+# --- Local SQLite replicas ---
+# For trying replica routing on one machine: copy the primary SQLite file
+# with the online backup API into a temporary file and swap it into place.
+# Readers holding the old file keep a consistent snapshot.
+
+def sync_sqlite_replica(primary_path, replica_path):
+    partial = replica_path + '.partial'
+    source = sqlite3.connect(primary_path)
+    target = sqlite3.connect(partial)
+    try:
+        source.backup(target)
+        # A rollback journal, so readers need no -wal/-shm files beside it
+        target.execute('PRAGMA journal_mode=DELETE')
+    finally:
+        target.close()
+        source.close()
+    os.replace(partial, replica_path)
+
+
+def init_app(app):
+    # Call after database.init_app()
+    uris = [uri.strip() for uri in (app.config['DATABASE_REPLICA_URIS'] or '').split(',') if uri.strip()]
+    if uris:
+        app.extensions['replicas'] = Replicas(app, [Replica(uri, _replica_engine(app, uri)) for uri in uris])
+        app.after_request(_remember_writes)
+
+    @app.cli.command('sync-replica')
+    @click.argument('replica_path')
+    @click.option('--every', type=float, default=None, help='Keep copying every N seconds.')
+    def sync_replica_command(replica_path, every):
+        # The engine's URL, with a relative path resolved the way the app does
+        primary = app.extensions['sqlalchemy'].engine.url
+        if primary.get_backend_name() != 'sqlite' or primary.database in (None, '', ':memory:'):
+            raise click.ClickException('sync-replica copies SQLite file databases only.')
+        while True:
+            sync_sqlite_replica(primary.database, replica_path)
+            click.echo(f'Copied {primary.database} to {replica_path}.')
+            if every is None:
+                return
+            time.sleep(every)
+
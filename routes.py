@@ -1,10 +1,30 @@
-from flask import render_template,request,redirect, url_for,flash, session
-from model import db, User, Doctor, Department, DoctorSchedule,Appointment, Patient
-from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
+from flask import render_template,request,redirect, url_for,flash, session, jsonify, Response, stream_with_context, make_response
+from markupsafe import Markup
+from model import db, User, Doctor, Department, DoctorSchedule,Appointment, Patient, ScheduleException, Job
+from datetime import datetime, timedelta
+import hmac
+import io
+import json
 from functools import wraps
-from sqlalchemy.orm import aliased
-from sqlalchemy import or_ # NEW
+import dashboard
+import booking
+import stats
+import search
+import passwords
+import identity
+import bulk_io
+import agenda
+import treatments
+import schedules
+import analytics
+import batch
+import removal
+import instrumentation
+import fragments
+import live
+import jobs
+import replicas
+import tenants
 
 
 # --- START Decorator ---
@@ -22,11 +42,131 @@ def role_required(allowed_roles):
             if user_role not in allowed_roles:
                 flash('Access denied. Insufficient privileges.')
                 return redirect(url_for('patient_login'))
+
+            # Check the account still exists and has not been blacklisted
+            user = identity.current_user()
+            if not user or identity.is_blocked(user):
+                session.pop('user_id', None)
+                session.pop('role', None)
+                flash('Your account is no longer active. Please contact the hospital.')
+                return redirect(url_for('patient_login'))
             
             return f(*args, **kwargs)
         return decorated_function
     return decorator
 
+# --- Admin dashboard fragments ---
+# The first page of each table is rendered server-side and the rest is
+# pulled through the fragment endpoints as the admin scrolls. Every page is
+# cached under the versions of the tables it is built from (see
+# fragments.py), so after an edit only the tables it touched re-render.
+
+DOCTOR_TABLES = ('user', 'doctor', 'department')
+SCHEDULE_TABLES = ('doctor_schedule', 'doctor', 'user')
+APPOINTMENT_TABLES = ('appointment', 'archived_appointment', 'patient', 'doctor', 'user')
+DASHBOARD_TABLES = DOCTOR_TABLES + SCHEDULE_TABLES + APPOINTMENT_TABLES + \
+    ('schedule_exception', 'dashboard_stat', 'dashboard_stat_delta')
+
+
+def _doctor_rows(cursor=None, limit=None):
+    def render():
+        rows, next_cursor = dashboard.doctor_page(cursor, limit)
+        return render_template('_doctor_rows.html', doctors=rows).strip(), next_cursor
+    return fragments.cached('doctor_rows', DOCTOR_TABLES, (cursor, dashboard.page_size(limit)), render)
+
+
+def _schedule_rows(cursor=None, limit=None):
+    def render():
+        rows, next_cursor = dashboard.schedule_page(cursor, limit)
+        return render_template('_schedule_rows.html', schedules=rows, weekdays=schedules.WEEKDAYS).strip(), next_cursor
+    return fragments.cached('schedule_rows', SCHEDULE_TABLES, (cursor, dashboard.page_size(limit)), render)
+
+
+def _appointment_rows(cursor=None, limit=None):
+    def render():
+        rows, next_cursor = dashboard.appointment_page(cursor, limit)
+        return render_template('_appointment_rows.html', appointments=rows).strip(), next_cursor
+    return fragments.cached('appointment_rows', APPOINTMENT_TABLES, (cursor, dashboard.page_size(limit)), render)
+
+
+def _doctor_option_tags():
+    return fragments.cached('doctor_options', DOCTOR_TABLES, (), lambda: render_template(
+        '_doctor_options.html', doctor_options=dashboard.doctor_options()).strip())
+
+
+def _publish_schedule(schedule):
+    # Live update carrying the schedule's dashboard row
+    db.session.flush()
+    row = db.session.query(DoctorSchedule, Doctor, User) \
+        .join(Doctor, DoctorSchedule.doctor_id == Doctor.id) \
+        .join(User, Doctor.user_id == User.id) \
+        .filter(DoctorSchedule.id == schedule.id).one()
+    html = render_template('_schedule_rows.html', schedules=[row], weekdays=schedules.WEEKDAYS).strip()
+    live.schedule_saved(schedule.id, schedule.doctor_id, html)
+
+
+def _fragment_response(rows, tables):
+    # JSON page for the dashboard's infinite scroll, with an ETag
+    cursor = request.args.get('cursor')
+    limit = dashboard.page_size(request.args.get('limit'))
+    tag = fragments.etag(session['user_id'], tables, request.endpoint, cursor, limit)
+    not_modified = fragments.not_modified(tag)
+    if not_modified:
+        return not_modified
+    html, next_cursor = rows(cursor, limit)
+    return fragments.conditional(jsonify(html=html, next_cursor=next_cursor), tag)
+
+
+def _admin_dashboard_context():
+    doctor_rows, doctors_cursor = _doctor_rows()
+    schedule_rows, schedules_cursor = _schedule_rows()
+    appointment_rows, appointments_cursor = _appointment_rows()
+
+    return dict(
+        doctor_rows=Markup(doctor_rows), doctors_cursor=doctors_cursor,
+        schedule_rows=Markup(schedule_rows), schedules_cursor=schedules_cursor,
+        appointment_rows=Markup(appointment_rows), appointments_cursor=appointments_cursor,
+        doctor_option_tags=Markup(_doctor_option_tags()),
+        weekdays=schedules.WEEKDAYS,
+        schedule_exceptions=schedules.upcoming_exceptions(),
+        **stats.snapshot()
+    )
+
+# --- Batch requests ---
+# Batch endpoints take a form post from the dashboard (flash + redirect)
+# or a JSON body (JSON per-id summary).
+
+def _batch_value(name):
+    data = request.get_json(silent=True)
+    return data.get(name) if data is not None else request.form.get(name)
+
+
+def _batch_ids(name='ids'):
+    data = request.get_json(silent=True)
+    values = (data.get(name) or []) if data is not None else request.form.getlist(name)
+    return batch.parse_ids(values if isinstance(values, list) else [values])
+
+
+def _batch_response(action, result=None, error=None):
+    if request.is_json:
+        return (jsonify(error=error), 400) if error else jsonify(result.as_dict())
+    if error:
+        flash(error, 'error')
+    else:
+        summary = ', '.join(f'{count} {outcome}' for outcome, count in result.counts().items())
+        flash(f"{action}: {summary or 'no ids given'}.", 'success')
+    return redirect(url_for('admin_dashboard'))
+
+
+def _job_response(action, job):
+    # An offloaded batch action: 202 with the job to poll, or a flash
+    if request.is_json:
+        return jsonify(job_id=job.id, status=job.status,
+                       status_url=url_for('job_status', job_id=job.id)), 202
+    flash(f"{action} in the background (job {job.id}).", 'success')
+    return redirect(url_for('admin_dashboard'))
+
+
 def init_routes(app):
     @app.route('/')
     def index():
@@ -40,18 +180,36 @@ def init_routes(app):
     def patient_login():
         return render_template('patient-login.html')
     
+    def _enter_login_tenant(username):
+        # With several hospitals, sign in against the user's own database
+        if not tenants.enabled():
+            return True
+        name = tenants.login_tenant(username)
+        if name is None:
+            return False
+        tenants.enter(name)
+        return True
+
     @app.route('/patient-login',methods=['POST'])
     def patient_login_post():
         username = request.form.get('username')
         password = request.form.get('password')  
         
-        user= User.query.filter_by(username=username).first()
-        if not user or not check_password_hash(user.password_hash,password):
+        if not _enter_login_tenant(username):
+            flash('Invalid username or password.')
+            return redirect(url_for('patient_login'))
+        try:
+            user = passwords.authenticate(username, password, request.remote_addr)
+        except passwords.LoginThrottled:
+            flash('Too many failed login attempts. Please try again later.')
+            return redirect(url_for('patient_login'))
+        if not user:
             flash('Invalid username or password.')
             return redirect(url_for('patient_login'))
         
         session['user_id'] = user.id     
         session['role'] = 'patient'
+        session['tenant'] = tenants.current()
         return redirect(url_for('patient_dashboard'))
     
 
@@ -65,11 +223,19 @@ def init_routes(app):
         username = request.form.get('username')
         password = request.form.get('password')  
         
-        user= User.query.filter_by(username=username).first()
-        if not user or not check_password_hash(user.password_hash,password):
+        if not _enter_login_tenant(username):
+            flash('Invalid username or password.')
+            return redirect(url_for('doctor_admin_login'))
+        try:
+            user = passwords.authenticate(username, password, request.remote_addr)
+        except passwords.LoginThrottled:
+            flash('Too many failed login attempts. Please try again later.')
+            return redirect(url_for('doctor_admin_login'))
+        if not user:
             flash('Invalid username or password.')
             return redirect(url_for('doctor_admin_login'))
         role = user.role.lower()
+        session['tenant'] = tenants.current()
         if role == 'admin':
             session['user_id'] = user.id     
             session['role'] = 'admin'
@@ -86,10 +252,19 @@ def init_routes(app):
     @app.route('/patient-dashboard',methods=['GET','POST'])
     @role_required(['patient'])
     def patient_dashboard():   
-        user_id = session['user_id']
-        user = User.query.get(user_id)
+        user = identity.current_user()
         if user:
-            return render_template('patient.html', patient_name=user.full_name, user=user)
+            patient = user.patient_profile
+            upcoming, history, history_cursor, counts = [], [], None, (0, 0)
+            if patient:
+                upcoming = dashboard.upcoming_appointments(patient.id)
+                history, history_cursor = dashboard.history_page(patient.id)
+                counts = dashboard.history_counts(patient.id)
+            return render_template('patient.html', patient_name=user.full_name, user=user,
+                                   doctor_options=dashboard.doctor_options(),
+                                   upcoming_appointments=upcoming, history=history,
+                                   history_cursor=history_cursor,
+                                   upcoming_count=counts[0], past_count=counts[1])
         else:
             session.pop('user_id', None) 
             session.pop('role', None)
@@ -97,60 +272,219 @@ def init_routes(app):
             return redirect(url_for('patient_login'))
 
 
+    @app.route('/patient-dashboard/history')
+    @role_required(['patient'])
+    def patient_history_fragment():
+        patient = identity.current_user().patient_profile
+        if not patient:
+            return jsonify(html='', next_cursor=None)
+        rows, next_cursor = dashboard.history_page(patient.id, request.args.get('cursor'), request.args.get('limit'))
+        return jsonify(html=render_template('_history_rows.html', history=rows), next_cursor=next_cursor)
+
+
+    # --- Booking ---
+
+    @app.route('/doctors/<int:doctor_id>/slots')
+    @role_required(['patient', 'admin'])
+    def doctor_slots(doctor_id):
+        try:
+            start_date = datetime.strptime(request.args['date'], '%Y-%m-%d').date() \
+                if request.args.get('date') else datetime.now().date()
+            days = int(request.args.get('days', 7))
+        except ValueError:
+            return jsonify(error='Invalid date or days parameter.'), 400
+
+        days = max(1, min(days, app.config['BOOKING_HORIZON_DAYS']))
+        slots = booking.available_slots(doctor_id, start_date, days)
+        return jsonify(doctor_id=doctor_id, slots=[
+            {'start_time': start.isoformat(timespec='minutes'), 'end_time': end.isoformat(timespec='minutes')}
+            for start, end in slots
+        ])
+
+    @app.route('/book-appointment', methods=['POST'])
+    @role_required(['patient'])
+    def book_appointment():
+        doctor_id = request.form.get('doctor_id', type=int)
+        start_time_str = request.form.get('start_time', '')
+
+        try:
+            start_time = datetime.fromisoformat(start_time_str)
+        except ValueError:
+            flash('Invalid appointment time.', 'error')
+            return redirect(url_for('patient_dashboard'))
+
+        if not doctor_id:
+            flash('Please select a doctor.', 'error')
+            return redirect(url_for('patient_dashboard'))
+
+        user = identity.current_user()
+        try:
+            appointment = booking.book_appointment(user, doctor_id, start_time)
+        except booking.BookingError as e:
+            flash(str(e), 'error')
+            return redirect(url_for('patient_dashboard'))
+
+        flash(f"Appointment booked for {appointment.start_time.strftime('%Y-%m-%d %H:%M')}.", 'success')
+        return redirect(url_for('patient_dashboard'))
+
+
     @app.route('/admin-dashboard')
     @role_required(['admin'])
+    @replicas.replica_reads
     def admin_dashboard(): 
-        user_id = session['user_id']
-        user = User.query.get(user_id)
-        all_doctors = db.session.query(User, Doctor, Department) \
-                    .join(Doctor, User.id == Doctor.user_id) \
-                    .join(Department, Doctor.specialization_id == Department.id) \
-                    .all()
-        
-        all_schedules = db.session.query(DoctorSchedule, Doctor, User) \
-                        .join(Doctor, DoctorSchedule.doctor_id == Doctor.id) \
-                        .join(User, Doctor.user_id == User.id) \
-                        .order_by(User.full_name, DoctorSchedule.day_of_week) \
-                        .all()
-        
-        PatientUser = aliased(User)
-        DoctorUser = aliased(User)
-
-        all_appointments = db.session.query(
-        Appointment,
-        PatientUser.full_name.label('patient_name'),
-        DoctorUser.full_name.label('doctor_name')
-        ) \
-        .join(Patient, Appointment.patient_id == Patient.id) \
-        .join(Doctor, Appointment.doctor_id == Doctor.id) \
-        .join(PatientUser, Patient.user_id == PatientUser.id) \
-        .join(DoctorUser, Doctor.user_id == DoctorUser.id) \
-        .order_by(Appointment.start_time.desc()) \
-        .all()
-
-# Pass data to template:
-        total_appointments = Appointment.query.count()
-    # 2. Fetch dashboard counts
-        total_doctors = Doctor.query.count()
-        total_patients = User.query.filter_by(role='patient').count()
-    # Placeholder for appointments count (as you don't have appointment creation logic yet)
-    
-        return render_template('admin.html', 
-                               appointments=all_appointments,
-                           doctors=all_doctors, 
-                           schedules=all_schedules,
-                           total_doctors=total_doctors,
-                           total_patients=total_patients,
-                           total_appointments=total_appointments,admin_name=user.full_name,user=user
-                        )       
-        
-       
-    
+        user = identity.current_user()
+        # A page carrying flashed messages is one-off; it gets no ETag
+        tag = None if session.get('_flashes') else fragments.etag(user.id, DASHBOARD_TABLES, 'admin_dashboard')
+        not_modified = fragments.not_modified(tag)
+        if not_modified:
+            return not_modified
+        return fragments.conditional(make_response(render_template(
+            'admin.html', admin_name=user.full_name, user=user, **_admin_dashboard_context())), tag)
+
+    # --- Dashboard table fragments (keyset paginated, JSON) ---
+
+    @app.route('/admin-dashboard/doctors')
+    @role_required(['admin'])
+    @replicas.replica_reads
+    def admin_doctors_fragment():
+        return _fragment_response(_doctor_rows, DOCTOR_TABLES)
+
+    @app.route('/admin-dashboard/schedules')
+    @role_required(['admin'])
+    @replicas.replica_reads
+    def admin_schedules_fragment():
+        return _fragment_response(_schedule_rows, SCHEDULE_TABLES)
+
+    @app.route('/admin-dashboard/appointments')
+    @role_required(['admin'])
+    @replicas.replica_reads
+    def admin_appointments_fragment():
+        return _fragment_response(_appointment_rows, APPOINTMENT_TABLES)
+
     @app.route('/doctor-dashboard')
     @role_required(['doctor'])
-    def doctor_dashboard():  
-        return render_template('doctor.html')
+    def doctor_dashboard():
+        user = identity.current_user()
+        today = datetime.now().date()
+        days = agenda.agenda(user.doctor_profile.id, today) if user.doctor_profile else {}
+        return render_template('doctor.html', user=user, today=today, agenda=days)
     
+    # --- Treatment records ---
+
+    @app.route('/appointments/<int:appointment_id>/treatment', methods=['GET', 'POST'])
+    @role_required(['doctor'])
+    def appointment_treatment(appointment_id):
+        doctor = identity.current_user().doctor_profile
+        try:
+            appointment = treatments.appointment_for_doctor(doctor, appointment_id)
+        except treatments.TreatmentError as e:
+            flash(str(e), 'error')
+            return redirect(url_for('doctor_dashboard'))
+
+        if request.method == 'POST':
+            try:
+                treatments.save_treatment(doctor, appointment,
+                                          request.form.get('diagnosis'),
+                                          request.form.get('notes'),
+                                          treatments.parse_items(request.form))
+            except treatments.TreatmentError as e:
+                flash(str(e), 'error')
+                return redirect(url_for('appointment_treatment', appointment_id=appointment_id))
+            flash(f"Treatment record saved for {appointment.patient.user.full_name}.", 'success')
+            return redirect(url_for('doctor_dashboard'))
+
+        return render_template('treatment.html', appointment=appointment,
+                               treatment=appointment.treatment_record)
+
+    @app.route('/admin/pharmacy-report')
+    @role_required(['admin'])
+    @replicas.replica_reads
+    def pharmacy_report():
+        drug = request.args.get('drug', '').strip()
+        month = request.args.get('month') or datetime.now().strftime('%Y-%m')
+        try:
+            start, end = treatments.month_range(month)
+        except ValueError:
+            flash('Invalid month. Use YYYY-MM.', 'error')
+            return redirect(url_for('pharmacy_report'))
+
+        rows = treatments.drug_report(drug, start, end) if drug else []
+        return render_template('pharmacy-report.html', drugs=treatments.drug_names(),
+                               drug=drug, month=month, rows=rows)
+
+    @app.route('/admin/analytics')
+    @role_required(['admin'])
+    @replicas.replica_reads
+    def analytics_report():
+        today = datetime.now().date()
+        bucket = request.args.get('bucket', 'day')
+        department_id = request.args.get('department_id', type=int)
+        try:
+            end = datetime.strptime(request.args['end'], '%Y-%m-%d').date() \
+                if request.args.get('end') else today
+            start = datetime.strptime(request.args['start'], '%Y-%m-%d').date() \
+                if request.args.get('start') else end - timedelta(days=29)
+        except ValueError:
+            flash('Invalid dates. Use YYYY-MM-DD.', 'error')
+            return redirect(url_for('analytics_report'))
+        if bucket not in analytics.BUCKETS or end < start:
+            flash('Invalid report period.', 'error')
+            return redirect(url_for('analytics_report'))
+
+        # Rollups are refreshed by the job worker or `flask refresh-analytics`
+        refreshed_at = analytics.refreshed_at()
+        report = analytics.report(start, end, bucket, department_id)
+        if request.args.get('format') == 'json':
+            return jsonify(dict(report, refreshed_at=refreshed_at and refreshed_at.isoformat()))
+        return render_template('analytics.html', report=report, refreshed_at=refreshed_at,
+                               departments=Department.query.order_by(Department.name).all(),
+                               department_id=department_id, buckets=analytics.BUCKETS)
+
+    # --- Instrumentation ---
+
+    def _metrics_response():
+        return Response(instrumentation.prometheus_text(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+    @app.route('/metrics')
+    def metrics():
+        # Scrapers send METRICS_TOKEN as a bearer token; otherwise admins only
+        token = app.config['METRICS_TOKEN']
+        if token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return _metrics_response()
+        return role_required(['admin'])(_metrics_response)()
+
+    @app.route('/admin/hospitals-report')
+    def hospitals_report():
+        # Totals across every hospital, for TENANT_REPORT_TOKEN holders only:
+        # an admin of one hospital has no business seeing the others
+        token = app.config['TENANT_REPORT_TOKEN']
+        if not tenants.enabled() or not token:
+            return jsonify(error='Not found.'), 404
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return jsonify(error='Forbidden.'), 403
+        return jsonify(tenants.hospitals_report())
+
+    @app.route('/admin/slow-queries')
+    @role_required(['admin'])
+    def slow_queries():
+        return jsonify(threshold_ms=app.config['SQL_SLOW_QUERY_MS'], queries=instrumentation.slow_queries())
+
+    # --- Live updates ---
+
+    @app.route('/events')
+    @role_required(['admin', 'doctor'])
+    def live_events():
+        if not app.config['LIVE_UPDATES']:
+            return '', 204
+        user = identity.current_user()
+        # Doctors hear about their own appointments only
+        doctor_id = None
+        if user.role == 'doctor':
+            if not user.doctor_profile:
+                return '', 204
+            doctor_id = user.doctor_profile.id
+        return live.stream_response(doctor_id, request.headers.get('Last-Event-ID'))
+
     @app.route('/register',methods=['POST'])
     def register_post():  
         username = request.form.get('username')
@@ -166,17 +500,27 @@ def init_routes(app):
         if password != confirm_password:
             flash('Passwords do not match.')        
             return redirect(url_for('register'))
+
+        if tenants.enabled():
+            if tenants.requested() is None:
+                flash("Please register at your hospital's address.")
+                return redirect(url_for('register'))
+            tenants.enter(tenants.requested())
+            if tenants.login_taken(username, email):
+                flash('Username already exists. Please choose a different one.')
+                return redirect(url_for('register'))
         user= User.query.filter_by(username=username).first()
 
         if user:
             flash('Username already exists. Please choose a different one.')
             return redirect(url_for('register'))
         
-        password_hash= generate_password_hash(password)
+        password_hash= passwords.hash_password(password)
 
         new_user= User(full_name=full_name,username=username,
                        email=email,password_hash=password_hash)
         db.session.add(new_user)
+        stats.bump('patients')
         db.session.commit()
         return redirect(url_for('patient_login'))
     # routes.py
@@ -188,6 +532,7 @@ def init_routes(app):
       user_role = session.get('role')
       session.pop('user_id', None)
       session.pop('role', None)
+      session.pop('tenant', None)
       
 
       if user_role == 'admin' or user_role == 'doctor':
@@ -204,8 +549,7 @@ def init_routes(app):
     @app.route('/patient-profile', methods=['GET', 'POST'])
     @role_required(['patient'])
     def patient_profile():
-        user_id = session['user_id']
-        user = User.query.get(user_id)
+        user = identity.current_user()
     
         if not user:
             session.pop('user_id', None)
@@ -227,11 +571,11 @@ def init_routes(app):
                 if new_password != confirm_password:
                     flash('New password and confirmation do not match.', 'error')
                     return render_template('patient-profile.html', user=user)            
-                if not current_password or not check_password_hash(user.password_hash, current_password):
+                if not current_password or not passwords.verify_password(user.password_hash, current_password):
                     flash('Incorrect current password. Password was not changed.', 'error')
                     return render_template('patient-profile.html', user=user)
 
-                user.password_hash = generate_password_hash(new_password)
+                user.password_hash = passwords.hash_password(new_password)
                 flash('Profile and password updated successfully!', 'success')
                 return render_template('patient-profile.html', user=user)
         
@@ -240,6 +584,9 @@ def init_routes(app):
                 
 
             db.session.commit()
+            identity.invalidate(user.id)
+            # Patient names are cached in doctors' agendas
+            agenda.invalidate()
         
             return redirect(url_for('patient_profile')) 
 
@@ -248,8 +595,7 @@ def init_routes(app):
     @app.route('/doctor-profile', methods=['GET', 'POST'])
     @role_required(['doctor'])
     def doctor_profile():
-        user_id = session['user_id']
-        user = User.query.get(user_id)
+        user = identity.current_user()
     
         if not user:
             session.pop('user_id', None)
@@ -271,11 +617,11 @@ def init_routes(app):
                 if new_password != confirm_password:
                     flash('New password and confirmation do not match.', 'error')
                     return render_template('patient-profile.html', user=user)            
-                if not current_password or not check_password_hash(user.password_hash, current_password):
+                if not current_password or not passwords.verify_password(user.password_hash, current_password):
                     flash('Incorrect current password. Password was not changed.', 'error')
                     return render_template('patient-profile.html', user=user)
 
-                user.password_hash = generate_password_hash(new_password)
+                user.password_hash = passwords.hash_password(new_password)
                 flash('Profile and password updated successfully!', 'success')
                 return render_template('patient-profile.html', user=user)
         
@@ -284,6 +630,9 @@ def init_routes(app):
                 
 
             db.session.commit()
+            identity.invalidate(user.id)
+            # Patient names are cached in doctors' agendas
+            agenda.invalidate()
         
             return redirect(url_for('patient_profile')) 
 
@@ -324,12 +673,13 @@ def init_routes(app):
             user.email = email or user.email
 
             if password:
-                user.password_hash = generate_password_hash(password)
+                user.password_hash = passwords.hash_password(password)
 
             doctor.specialization_id = department.id
             doctor.contact_number = contact_number or doctor.contact_number
 
             db.session.commit()
+            identity.invalidate(user.id)
             flash(f"Doctor {user.full_name} updated successfully.", "success")
             return redirect(url_for('admin_dashboard'))
 
@@ -342,7 +692,7 @@ def init_routes(app):
             flash("Username or Email already exists.", "error")
             return redirect(url_for('admin_dashboard'))
 
-        password_hash = generate_password_hash(password)
+        password_hash = passwords.hash_password(password)
         new_user = User(
         full_name=full_name,
         username=username,
@@ -359,6 +709,7 @@ def init_routes(app):
         contact_number=contact_number
         )
         db.session.add(newdoctor)
+        stats.bump('doctors')
         db.session.commit()
         flash(f"New Doctor {full_name} added successfully!", "success")
         return redirect(url_for('admin_dashboard'))
@@ -371,16 +722,14 @@ def init_routes(app):
             flash(f"Doctor ID {doctor_id} not found.", "error")
             return redirect(url_for('admin_dashboard'))
 
-        user = User.query.get(doctor.user_id)
-
-    # Delete doctor profile (and optionally the user)
-        db.session.delete(doctor)
-
-    # If each doctor has a dedicated User row, you probably want to delete that too:
-        if user:
-            db.session.delete(user)
+        if app.config['JOB_OFFLOAD']:
+            job = jobs.enqueue('remove_users', user_ids=[doctor.user_id])
+            db.session.commit()
+            flash(f"Doctor {doctor_id} will be deleted in the background (job {job.id}).", "success")
+            return redirect(url_for('admin_dashboard'))
 
-        db.session.commit()
+        # Schedules, appointments and treatments go with it (ON DELETE CASCADE)
+        removal.remove_users([doctor.user_id])
         flash("Doctor deleted successfully.", "success")
         return redirect(url_for('admin_dashboard'))
     
@@ -390,50 +739,55 @@ def init_routes(app):
     def manage_schedule():
         
         if request.method == 'POST':
-            doctor_id = request.form.get('schedule_doctor_id')
-            day_of_week = request.form.get('day_of_week')
+            doctor_id = request.form.get('schedule_doctor_id', type=int)
+            weekday = request.form.get('weekday')
             start_time = request.form.get('start_time')
             end_time = request.form.get('end_time')
-            schedule_id = request.form.get('schedule_id')
+            schedule_id = request.form.get('schedule_id', type=int)
             
-            if not doctor_id or not day_of_week or not start_time or not end_time:
+            if not doctor_id or not weekday or not start_time or not end_time:
                 flash('Missing required schedule fields.', 'error')
                 return redirect(url_for('admin_dashboard'))
 
-            # Convert time strings to time objects
+            # Convert form strings to weekday/time/date values
             try:
-                start_time_obj = datetime.strptime(start_time, '%H:%M').time()
-                end_time_obj = datetime.strptime(end_time, '%H:%M').time()
-            except ValueError:
-                flash('Invalid time format. Use HH:MM.', 'error')
+                window = schedules.Window(
+                    weekday=schedules.parse_weekday(weekday),
+                    start_time=datetime.strptime(start_time, '%H:%M').time(),
+                    end_time=datetime.strptime(end_time, '%H:%M').time(),
+                    effective_from=datetime.strptime(request.form['effective_from'], '%Y-%m-%d').date()
+                    if request.form.get('effective_from') else None,
+                    effective_to=datetime.strptime(request.form['effective_to'], '%Y-%m-%d').date()
+                    if request.form.get('effective_to') else None,
+                )
+            except (ValueError, schedules.ScheduleError):
+                flash('Invalid day, time (HH:MM) or date.', 'error')
                 return redirect(url_for('admin_dashboard'))
 
-            if end_time_obj <= start_time_obj:
-                flash('End time must be after start time.', 'error')
+            # Reject windows that overlap one of the doctor's existing windows
+            try:
+                schedules.validate_window(doctor_id, window, exclude_id=schedule_id)
+            except schedules.ScheduleError as e:
+                flash(str(e), 'error')
                 return redirect(url_for('admin_dashboard'))
 
             if schedule_id:
-                # --- FIX APPLIED HERE ---
                 schedule = DoctorSchedule.query.get(schedule_id)
                 if schedule:
                     # Crucial: Update the doctor_id in case the selected doctor changed
-                    schedule.doctor_id = doctor_id 
-                    schedule.day_of_week = day_of_week
-                    schedule.start_time = start_time_obj
-                    schedule.end_time = end_time_obj
+                    schedule.doctor_id = doctor_id
+                    for field, value in window._asdict().items():
+                        setattr(schedule, field, value)
+                    _publish_schedule(schedule)
                     db.session.commit() 
                     flash('Doctor schedule updated successfully!', 'success')
                 else:
                     flash('Schedule entry not found.', 'error')
             else:
                 # Add new schedule
-                new_schedule = DoctorSchedule(
-                    doctor_id=doctor_id,
-                    day_of_week=day_of_week,
-                    start_time=start_time_obj,
-                    end_time=end_time_obj
-                )
-                db.session.add(new_schedule)
+                schedule = DoctorSchedule(doctor_id=doctor_id, **window._asdict())
+                db.session.add(schedule)
+                _publish_schedule(schedule)
                 db.session.commit()
                 flash('New doctor schedule added successfully!', 'success')
             
@@ -453,10 +807,56 @@ def init_routes(app):
             return redirect(url_for('admin_dashboard'))
 
         db.session.delete(schedule)
+        live.schedules_removed([schedule_id])
         db.session.commit()
         flash("Doctor schedule deleted successfully.", "success")
         return redirect(url_for('admin_dashboard'))
 
+    @app.route('/schedule-exceptions', methods=['POST'])
+    @role_required(['admin'])
+    def add_schedule_exception():
+        doctor_id = request.form.get('doctor_id', type=int)
+        try:
+            start_date = datetime.strptime(request.form.get('start_date', ''), '%Y-%m-%d').date()
+            end_date = datetime.strptime(request.form.get('end_date', ''), '%Y-%m-%d').date()
+        except ValueError:
+            flash('Invalid leave dates.', 'error')
+            return redirect(url_for('admin_dashboard'))
+
+        if end_date < start_date:
+            flash('Leave must end on or after its first day.', 'error')
+            return redirect(url_for('admin_dashboard'))
+
+        db.session.add(ScheduleException(doctor_id=doctor_id, start_date=start_date, end_date=end_date,
+                                         reason=request.form.get('reason', '').strip() or None))
+        db.session.commit()
+        flash('Leave / holiday added. Existing appointments on those days are not changed.', 'success')
+        return redirect(url_for('admin_dashboard'))
+
+    @app.route('/schedule-exceptions/<int:exception_id>/delete', methods=['POST'])
+    @role_required(['admin'])
+    def delete_schedule_exception(exception_id):
+        exception = ScheduleException.query.get(exception_id)
+        if not exception:
+            flash(f"Leave entry {exception_id} not found.", "error")
+            return redirect(url_for('admin_dashboard'))
+
+        db.session.delete(exception)
+        db.session.commit()
+        flash("Leave / holiday removed.", "success")
+        return redirect(url_for('admin_dashboard'))
+
+    @app.route('/admin/capacity')
+    @role_required(['admin'])
+    def capacity_grid():
+        weeks = max(1, min(request.args.get('weeks', 12, type=int), 52))
+        try:
+            start_date = datetime.strptime(request.args['start'], '%Y-%m-%d').date() \
+                if request.args.get('start') else datetime.now().date()
+        except ValueError:
+            return jsonify(error='Invalid start date.'), 400
+        return jsonify(schedules.capacity_grid(start_date, weeks))
+
     @app.route('/update-appointment-status/<int:appointment_id>', methods=['POST'])
     @role_required(['admin'])
     def update_appointment_status(appointment_id):
@@ -473,14 +873,141 @@ def init_routes(app):
             flash(f"Invalid status: {new_status}. Must be one of: {', '.join(valid_statuses)}", "error")
             return redirect(url_for('admin_dashboard'))
             
+        stats.appointment_status_changed(appointment.status, new_status)
         appointment.status = new_status
+        live.appointments_changed([appointment], new_status)
         db.session.commit()
+        agenda.invalidate(appointment.doctor_id)
         flash(f"Appointment {appointment_id} status updated to {new_status}.", "success")
         return redirect(url_for('admin_dashboard'))
+
+    # --- Batch admin actions ---
+    @app.route('/admin/batch/appointment-status', methods=['POST'])
+    @role_required(['admin'])
+    def batch_appointment_status():
+        try:
+            day = _batch_value('date')
+            ids = batch.appointment_ids(
+                ids=_batch_ids(),
+                doctor_id=int(_batch_value('doctor_id') or 0),
+                day=datetime.strptime(day, '%Y-%m-%d').date() if day else None,
+                status=_batch_value('status') or None)
+            result = batch.update_appointment_statuses(ids, _batch_value('new_status'))
+        except ValueError:
+            return _batch_response('Appointment status', error='Invalid doctor id or date.')
+        except batch.BatchError as e:
+            return _batch_response('Appointment status', error=str(e))
+        return _batch_response('Appointment status', result)
+
+    @app.route('/admin/batch/blacklist', methods=['POST'])
+    @role_required(['admin'])
+    def batch_blacklist():
+        action = _batch_value('action')
+        if action not in ('blacklist', 'activate'):
+            return _batch_response('Blacklist', error='Action must be blacklist or activate.')
+        try:
+            result = batch.set_blacklisted(_batch_ids('user_ids'), action == 'blacklist',
+                                           acting_user_id=session.get('user_id'))
+        except batch.BatchError as e:
+            return _batch_response('Blacklist', error=str(e))
+        return _batch_response('Blacklist', result)
+
+    @app.route('/admin/batch/delete-schedules', methods=['POST'])
+    @role_required(['admin'])
+    def batch_delete_schedules():
+        try:
+            result = batch.delete_schedules(_batch_ids())
+        except batch.BatchError as e:
+            return _batch_response('Delete schedules', error=str(e))
+        return _batch_response('Delete schedules', result)
+
+    @app.route('/admin/batch/delete-doctors', methods=['POST'])
+    @role_required(['admin'])
+    def batch_delete_doctors():
+        try:
+            ids = _batch_ids()
+            if app.config['JOB_OFFLOAD'] and ids:
+                job = jobs.enqueue('delete_doctors', doctor_ids=ids)
+                db.session.commit()
+                return _job_response(f'Deleting {len(ids)} doctor(s)', job)
+            result = batch.delete_doctors(ids)
+        except batch.BatchError as e:
+            return _batch_response('Delete doctors', error=str(e))
+        return _batch_response('Delete doctors', result)
+
+    @app.route('/admin/jobs/<int:job_id>')
+    @role_required(['admin'])
+    def job_status(job_id):
+        job = db.session.get(Job, job_id)
+        if job is None:
+            return jsonify(error='Job not found.'), 404
+        return jsonify(id=job.id, kind=job.kind, status=job.status, attempts=job.attempts,
+                       last_error=job.last_error, result=json.loads(job.result) if job.result else None,
+                       created_at=job.created_at.isoformat(),
+                       finished_at=job.finished_at.isoformat() if job.finished_at else None)
+
+    # --- Bulk import/export ---
+    @app.route('/admin/import', methods=['POST'])
+    @role_required(['admin'])
+    def bulk_import():
+        kind = request.form.get('kind')
+        upload = request.files.get('file')
+        if kind not in bulk_io.KINDS or not upload or not upload.filename:
+            flash("Choose what to import and a CSV or JSONL file.", "error")
+            return redirect(url_for('admin_dashboard'))
+
+        fmt = upload.filename.rsplit('.', 1)[-1].lower()
+        if fmt not in bulk_io.FORMATS:
+            flash("Only .csv and .jsonl files can be imported.", "error")
+            return redirect(url_for('admin_dashboard'))
+
+        if app.config['JOB_OFFLOAD']:
+            job = jobs.enqueue('import_records', records=kind, format=fmt, path=jobs.spool_upload(upload, fmt))
+            db.session.commit()
+            flash(f"Importing {kind} in the background (job {job.id}).", "success")
+            return redirect(url_for('admin_dashboard'))
+
+        stream = io.TextIOWrapper(upload.stream, encoding='utf-8', newline='')
+        try:
+            result = bulk_io.import_records(kind, bulk_io.read_records(stream, fmt))
+        except (ValueError, KeyError, bulk_io.BulkIOError) as e:
+            flash(f"Import stopped: {e}. Earlier batches were kept.", "error")
+            return redirect(url_for('admin_dashboard'))
+
+        flash(f"Imported {result.inserted} {kind}; skipped {len(result.skipped)}.", "success")
+        return redirect(url_for('admin_dashboard'))
+
+    @app.route('/admin/export/<kind>')
+    @role_required(['admin'])
+    def bulk_export(kind):
+        fmt = request.args.get('format', 'csv')
+        if kind not in bulk_io.KINDS or fmt not in bulk_io.FORMATS:
+            flash("Unknown export.", "error")
+            return redirect(url_for('admin_dashboard'))
+
+        mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+        return Response(stream_with_context(bulk_io.export_records(kind, fmt)), mimetype=mimetype,
+                        headers={'Content-Disposition': f'attachment; filename={kind}.{fmt}'})
     
 
+    # Search results only, as an HTML fragment the dashboard swaps in place.
+    # The POST route below is kept as the no-JavaScript fallback.
+    @app.route('/search-users/results')
+    @role_required(['admin'])
+    @replicas.replica_reads
+    def search_users_results():
+        query = request.args.get('query', '').strip()
+        if not query:
+            return render_template('_search_results.html',
+                                   search_results_doctors=None, search_results_patients=None)
+
+        return render_template('_search_results.html',
+                               search_results_doctors=search.search_doctors(query),
+                               search_results_patients=search.search_patients(query))
+
     @app.route('/search-users', methods=['POST'])
     @role_required(['admin'])
+    @replicas.replica_reads
     def search_users():
         query = request.form.get('query', '').strip()
         
@@ -488,85 +1015,20 @@ def init_routes(app):
             flash("Please enter a search term.", "warning")
             return redirect(url_for('admin_dashboard'))
 
-        search_term_like = f'%{query}%'
-        search_term_int = None
-        try:
-            # Check if the query is a valid integer for searching by ID
-            search_term_int = int(query)
-        except ValueError:
-            pass
-            
-        # 1. Search for Doctors by Name and Specialization
-        search_results_doctors = db.session.query(User, Doctor, Department) \
-            .join(Doctor, User.id == Doctor.user_id) \
-            .join(Department, Doctor.specialization_id == Department.id) \
-            .filter(
-                or_(
-                    User.full_name.ilike(search_term_like),
-                    Department.name.ilike(search_term_like)
-                )
-            ).all()
-
-        # 2. Search for Patients by Name, ID, or Contact
-        search_results_patients = db.session.query(User, Patient) \
-            .join(Patient, User.id == Patient.user_id) \
-            .filter(
-                User.role == 'patient',
-                or_(
-                    User.full_name.ilike(search_term_like),
-                    Patient.contact_number.ilike(search_term_like),
-                    # Filter by Patient ID only if the query is a convertible integer
-                    (Patient.id == search_term_int) if search_term_int is not None else False 
-                )
-            ).all()
-
-        # --- Re-fetch required dashboard context data ---
-        all_doctors = db.session.query(User, Doctor, Department) \
-                    .join(Doctor, User.id == Doctor.user_id) \
-                    .join(Department, Doctor.specialization_id == Department.id) \
-                    .all()
-        
-        all_schedules = db.session.query(DoctorSchedule, Doctor, User) \
-                        .join(Doctor, DoctorSchedule.doctor_id == Doctor.id) \
-                        .join(User, Doctor.user_id == User.id) \
-                        .order_by(User.full_name, DoctorSchedule.day_of_week) \
-                        .all()
-
-        PatientUser = aliased(User)
-        DoctorUser = aliased(User)
-        
-        all_appointments = db.session.query(
-            Appointment,
-            PatientUser.full_name.label('patient_name'),
-            DoctorUser.full_name.label('doctor_name')
-        ) \
-        .join(Patient, Appointment.patient_id == Patient.id) \
-        .join(Doctor, Appointment.doctor_id == Doctor.id) \
-        .join(PatientUser, Patient.user_id == PatientUser.id) \
-        .join(DoctorUser, Doctor.user_id == DoctorUser.id) \
-        .order_by(Appointment.start_time.desc()) \
-        .all()
-        
+        search_results_doctors = search.search_doctors(query)
+        search_results_patients = search.search_patients(query)
 
-        total_doctors = Doctor.query.count()
-        total_patients = User.query.filter_by(role='patient').count()
-        total_appointments = Appointment.query.count() 
-        user_info = User.query.get(session['user_id'])
+        user_info = identity.current_user()
 
 
         # Render admin.html, passing the search results
         flash(f"Search results for '{query}' shown below.", "success")
         return render_template('admin.html', 
-                           doctors=all_doctors, 
-                           schedules=all_schedules,
-                           appointments=all_appointments,
-                           total_doctors=total_doctors,
-                           total_patients=total_patients,
-                           total_appointments=total_appointments,
                            admin_name=user_info.full_name,
                            user=user_info,
                            search_results_doctors=search_results_doctors,
-                           search_results_patients=search_results_patients
+                           search_results_patients=search_results_patients,
+                           **_admin_dashboard_context()
                         )
 
     # NEW ROUTE: Blacklist or Permanently Remove User (Doctor or Patient)
@@ -626,25 +1088,19 @@ def init_routes(app):
 
 
         elif action == 'remove':
-            # Permanent Removal: Delete associated profiles and then the User record
-            
-            if user_role == 'doctor' and target_user.doctor_profile:
-                # Must delete dependent records first
-                DoctorSchedule.query.filter_by(doctor_id=target_user.doctor_profile.id).delete()
-                # Assuming cascade settings handle Appointment/Treatment records, we delete the profile
-                db.session.delete(target_user.doctor_profile)
-                
-            elif user_role == 'patient' and target_user.patient_profile:
-                # Assuming cascade settings handle Appointment/Treatment records, we delete the profile
-                db.session.delete(target_user.patient_profile)
-                
-            # Finally, delete the User record
-            db.session.delete(target_user)
-            flash(f"{user_role.capitalize()} {target_user.full_name} and associated records have been permanently removed.", "success")
+            # Permanent Removal: the User row is deleted and the database
+            # cascades to the profile, schedules, appointments and treatments
+            if user_role not in ('doctor', 'patient'):
+                flash("Cannot remove users with this role.", "error")
+                return redirect(url_for('admin_dashboard'))
+            full_name = target_user.full_name
+            removal.remove_users([target_id])
+            flash(f"{user_role.capitalize()} {full_name} and associated records have been permanently removed.", "success")
             
         else:
             flash("Invalid action specified.", "error")
         
         db.session.commit()
+        identity.invalidate(target_id)
         return redirect(url_for('admin_dashboard'))
         
\ No newline at end of file
@@ -0,0 +1,211 @@
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func, or_
+
+from model import db, User, Doctor, DoctorSchedule, ScheduleException, Appointment
+
+
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+MINUTES_PER_DAY = 24 * 60
+
+# Statuses that free the slot again
+RELEASED_STATUSES = ('Canceled',)
+
+# A weekly window; DoctorSchedule rows and query rows have the same fields
+Window = namedtuple('Window', 'weekday start_time end_time effective_from effective_to')
+
+
+class ScheduleError(Exception):
+    pass
+
+
+def slot_minutes():
+    return current_app.config.get('APPOINTMENT_SLOT_MINUTES', 30)
+
+
+def parse_weekday(value):
+    # 0-6 (Monday = 0) or a day name / three-letter prefix ('Monday', 'mon')
+    text = str(value).strip()
+    if text.isdigit() and int(text) < 7:
+        return int(text)
+    if len(text) >= 3:
+        for weekday, name in enumerate(WEEKDAYS):
+            if name.lower().startswith(text.lower()):
+                return weekday
+    raise ScheduleError(f'Invalid weekday: {value}')
+
+
+def _minutes(value):
+    return value.hour * 60 + value.minute
+
+
+# --- Overlap validation ---
+
+def windows_overlap(a, b):
+    # Same weekday, intersecting hours and intersecting validity ranges
+    if a.weekday != b.weekday:
+        return False
+    if not (a.start_time < b.end_time and b.start_time < a.end_time):
+        return False
+    return (a.effective_from or date.min) <= (b.effective_to or date.max) \
+        and (b.effective_from or date.min) <= (a.effective_to or date.max)
+
+
+def check_window(window):
+    if window.end_time <= window.start_time:
+        raise ScheduleError('End time must be after start time.')
+    if window.effective_from and window.effective_to and window.effective_to < window.effective_from:
+        raise ScheduleError('The schedule must end on or after its start date.')
+
+
+def validate_window(doctor_id, window, exclude_id=None):
+    # Raises ScheduleError if the window is malformed or overlaps another of
+    # the doctor's windows. Served by ix_doctor_schedule_doctor_weekday.
+    check_window(window)
+    query = DoctorSchedule.query.filter_by(doctor_id=doctor_id, weekday=window.weekday)
+    if exclude_id is not None:
+        query = query.filter(DoctorSchedule.id != exclude_id)
+    for existing in query:
+        if windows_overlap(window, existing):
+            raise ScheduleError(
+                f"Overlaps the existing {WEEKDAYS[existing.weekday]} window "
+                f"{existing.start_time.strftime('%H:%M')}-{existing.end_time.strftime('%H:%M')}.")
+
+
+# --- Batch expansion ---
+# All requested doctors' windows are expanded over the horizon in one pass.
+# Each doctor's slots are kept as a sorted array('l') of minute offsets from
+# the horizon's first midnight; every window contributes whole weeks'
+# worth of range() runs, so the per-slot work happens in C.
+
+class SlotGrid:
+    def __init__(self, start_date, days, minutes, slots):
+        self.start_date = start_date
+        self.origin = datetime.combine(start_date, datetime.min.time())
+        self.days = days
+        self.minutes = minutes
+        self.slots = slots
+
+    def intervals(self, doctor_id):
+        step = timedelta(minutes=self.minutes)
+        return [(self.origin + timedelta(minutes=offset), self.origin + timedelta(minutes=offset) + step)
+                for offset in self.slots.get(doctor_id, ())]
+
+    def has_slot(self, doctor_id, start_time):
+        offsets = self.slots.get(doctor_id)
+        if not offsets:
+            return False
+        delta = start_time - self.origin
+        if delta.seconds % 60 or delta.microseconds:
+            return False
+        offset = delta.days * MINUTES_PER_DAY + delta.seconds // 60
+        i = bisect_left(offsets, offset)
+        return i < len(offsets) and offsets[i] == offset
+
+    def daily_counts(self, doctor_id):
+        offsets = self.slots.get(doctor_id, ())
+        bounds = [bisect_left(offsets, day * MINUTES_PER_DAY) for day in range(self.days + 1)]
+        return [bounds[day + 1] - bounds[day] for day in range(self.days)]
+
+
+def expand(schedules, exceptions, start_date, days, minutes):
+    # schedules: rows with doctor_id plus the Window fields
+    # exceptions: rows with doctor_id (None = everyone), start_date, end_date
+    blocked = {}
+    for exception in exceptions:
+        first = max((exception.start_date - start_date).days, 0)
+        last = min((exception.end_date - start_date).days, days - 1)
+        blocked.setdefault(exception.doctor_id, set()).update(range(first, last + 1))
+    holidays = blocked.get(None, set())
+
+    slots = {}
+    for schedule in schedules:
+        window_start = _minutes(schedule.start_time)
+        # Slots that would run past the end of the window are dropped
+        span = (_minutes(schedule.end_time) - window_start) // minutes * minutes
+        if span <= 0:
+            continue
+        first = max(0, (schedule.effective_from - start_date).days) if schedule.effective_from else 0
+        last = min(days - 1, (schedule.effective_to - start_date).days) if schedule.effective_to else days - 1
+        leave = blocked.get(schedule.doctor_id, ())
+        offsets = slots.setdefault(schedule.doctor_id, array('l'))
+        # First date in range falling on the window's weekday
+        day = first + (schedule.weekday - (start_date.weekday() + first)) % 7
+        while day <= last:
+            if day not in holidays and day not in leave:
+                base = day * MINUTES_PER_DAY + window_start
+                offsets.extend(range(base, base + span, minutes))
+            day += 7
+
+    # Windows of one doctor never overlap, so sorting is all that is needed
+    return SlotGrid(start_date, days, minutes,
+                    {doctor_id: array('l', sorted(offsets)) for doctor_id, offsets in slots.items()})
+
+
+def load_grid(start_date, days, doctor_ids=None, minutes=None):
+    # Two queries for any number of doctors: the windows valid in the
+    # horizon and the exceptions intersecting it.
+    end_date = start_date + timedelta(days=days - 1)
+    schedules = db.session.query(
+        DoctorSchedule.doctor_id, DoctorSchedule.weekday, DoctorSchedule.start_time,
+        DoctorSchedule.end_time, DoctorSchedule.effective_from, DoctorSchedule.effective_to
+    ).filter(
+        or_(DoctorSchedule.effective_from.is_(None), DoctorSchedule.effective_from <= end_date),
+        or_(DoctorSchedule.effective_to.is_(None), DoctorSchedule.effective_to >= start_date)
+    )
+    exceptions = db.session.query(
+        ScheduleException.doctor_id, ScheduleException.start_date, ScheduleException.end_date
+    ).filter(ScheduleException.end_date >= start_date, ScheduleException.start_date <= end_date)
+    if doctor_ids is not None:
+        schedules = schedules.filter(DoctorSchedule.doctor_id.in_(doctor_ids))
+        exceptions = exceptions.filter(or_(ScheduleException.doctor_id.is_(None),
+                                           ScheduleException.doctor_id.in_(doctor_ids)))
+    return expand(schedules.all(), exceptions.all(), start_date, days, minutes or slot_minutes())
+
+
+# --- Capacity grid ---
+
+def capacity_grid(start_date, weeks):
+    # Per doctor and day: bookable slots and live appointments
+    days = weeks * 7
+    grid = load_grid(start_date, days)
+    origin = grid.origin
+    booked = {}
+    day_column = func.date(Appointment.start_time)
+    for doctor_id, day, count in db.session.query(Appointment.doctor_id, day_column, func.count()) \
+            .filter(Appointment.start_time >= origin,
+                    Appointment.start_time < origin + timedelta(days=days),
+                    Appointment.status.notin_(RELEASED_STATUSES)) \
+            .group_by(Appointment.doctor_id, day_column):
+        # SQLite returns the date as text
+        day = date.fromisoformat(day) if isinstance(day, str) else day
+        booked.setdefault(doctor_id, [0] * days)[(day - start_date).days] = count
+
+    return {
+        'start_date': start_date.isoformat(),
+        'days': days,
+        'slot_minutes': grid.minutes,
+        'doctors': [
+            {'doctor_id': doctor_id,
+             'slots': grid.daily_counts(doctor_id),
+             'booked': booked.get(doctor_id, [0] * days)}
+            for doctor_id in sorted(set(grid.slots) | set(booked))
+        ],
+    }
+
+
+# --- Leave and holidays ---
+
+def upcoming_exceptions(limit=50):
+    return db.session.query(ScheduleException, User.full_name) \
+        .outerjoin(Doctor, Doctor.id == ScheduleException.doctor_id) \
+        .outerjoin(User, User.id == Doctor.user_id) \
+        .filter(ScheduleException.end_date >= date.today()) \
+        .order_by(ScheduleException.start_date, ScheduleException.id) \
+        .limit(limit) \
+        .all()
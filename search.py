@@ -0,0 +1,107 @@
+from flask import current_app
+from sqlalchemy import case, false, or_
+
+from model import db, User, Doctor, Department, Patient
+import search_index
+
+
+def result_limit():
+    return current_app.config.get('SEARCH_RESULT_LIMIT', 25)
+
+
+def _parse_id(term):
+    try:
+        return int(term)
+    except ValueError:
+        return None
+
+
+def _in_index_order(rows, user_ids):
+    # The first occurrence wins, so ids put in front stay in front
+    position = {}
+    for i, user_id in enumerate(user_ids):
+        position.setdefault(user_id, i)
+    return sorted(rows, key=lambda row: position[row[0].id])
+
+
+# --- Ranked, bounded directory search ---
+# Terms the search index can answer (see search_index.py) are looked up
+# there: prefix and substring matches first, then fuzzy trigram matches.
+# Shorter terms, or backends without an index, use ILIKE filtering with
+# exact matches first, then prefix, then substring matches. Ties are broken
+# alphabetically and only the top `limit` rows are ever fetched.
+
+def search_doctors(term, limit=None):
+    limit = limit or result_limit()
+    user_ids = search_index.search_user_ids(term, 'doctor', limit)
+    if user_ids is not None:
+        rows = db.session.query(User, Doctor, Department) \
+            .join(Doctor, User.id == Doctor.user_id) \
+            .join(Department, Doctor.specialization_id == Department.id) \
+            .filter(User.id.in_(user_ids)) \
+            .all()
+        return _in_index_order(rows, user_ids)
+
+    lowered = term.lower()
+    name = db.func.lower(User.full_name)
+    department = db.func.lower(Department.name)
+    rank = case(
+        (name == lowered, 0),
+        (User.full_name.istartswith(term, autoescape=True), 1),
+        (department == lowered, 1),
+        (Department.name.istartswith(term, autoescape=True), 2),
+        else_=3
+    )
+
+    return db.session.query(User, Doctor, Department) \
+        .join(Doctor, User.id == Doctor.user_id) \
+        .join(Department, Doctor.specialization_id == Department.id) \
+        .filter(
+            or_(
+                User.full_name.icontains(term, autoescape=True),
+                Department.name.icontains(term, autoescape=True)
+            )
+        ) \
+        .order_by(rank, User.full_name) \
+        .limit(limit) \
+        .all()
+
+
+def search_patients(term, limit=None):
+    limit = limit or result_limit()
+    patient_id = _parse_id(term)
+    user_ids = search_index.search_user_ids(term, 'patient', limit)
+    if user_ids is not None:
+        rows = db.session.query(User, Patient) \
+            .join(Patient, User.id == Patient.user_id) \
+            .filter(or_(User.id.in_(user_ids),
+                        (Patient.id == patient_id) if patient_id is not None else false())) \
+            .all()
+        # An exact patient ID match always comes first
+        user_ids = [row[0].id for row in rows if row[1].id == patient_id] + user_ids
+        return _in_index_order(rows, user_ids)[:limit]
+
+    lowered = term.lower()
+    name = db.func.lower(User.full_name)
+    rank = case(
+        ((Patient.id == patient_id) if patient_id is not None else false(), 0),
+        (name == lowered, 0),
+        (User.full_name.istartswith(term, autoescape=True), 1),
+        (Patient.contact_number.istartswith(term, autoescape=True), 1),
+        else_=2
+    )
+
+    return db.session.query(User, Patient) \
+        .join(Patient, User.id == Patient.user_id) \
+        .filter(
+            User.role == 'patient',
+            or_(
+                User.full_name.icontains(term, autoescape=True),
+                Patient.contact_number.icontains(term, autoescape=True),
+                # Filter by Patient ID only if the query is a convertible integer
+                (Patient.id == patient_id) if patient_id is not None else false()
+            )
+        ) \
+        .order_by(rank, User.full_name) \
+        .limit(limit) \
+        .all()
@@ -0,0 +1,288 @@
+import click
+from flask import current_app, has_app_context
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+from model import db, User, Doctor, Patient, Department
+
+
+# --- Search index ---
+# A denormalised copy of the searchable fields of every doctor and patient
+# (name, department, contact number), keyed by user id. The concrete storage
+# depends on the database backend:
+#
+#   fts5     SQLite FTS5 table with the trigram tokenizer
+#   trigram  PostgreSQL pg_trgm GIN indexes on the source columns
+#   like     no index; falls back to the ILIKE queries in search.py
+#
+# SEARCH_BACKEND selects one explicitly; 'auto' picks by dialect.
+
+# Minimum share of the query's trigrams a candidate must contain to count as
+# a fuzzy match (substring matches are always kept).
+MIN_SIMILARITY = 0.5
+
+# Trigrams occurring in more documents than this are left out of fuzzy
+# queries (see Fts5Backend._selective_trigrams)
+FUZZY_MAX_DOCS = 1000
+
+# Fields searched for each kind of user
+SEARCH_FIELDS = {
+    'doctor': ('full_name', 'department'),
+    'patient': ('full_name', 'contact'),
+}
+
+
+def trigrams(value):
+    value = value.lower()
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+def similarity(term, value):
+    wanted = trigrams(term)
+    if not wanted:
+        return 0.0
+    return len(wanted & trigrams(value or '')) / len(wanted)
+
+
+class LikeBackend:
+    name = 'like'
+    min_term_length = None
+
+    def create(self, connection):
+        pass
+
+    def rebuild(self, connection):
+        pass
+
+    def sync(self, connection, user_ids):
+        pass
+
+    def query(self, term, kind, limit):
+        return None
+
+
+class Fts5Backend(LikeBackend):
+    name = 'fts5'
+    table = 'user_search'
+    vocab_table = 'user_search_vocab'
+    # The trigram tokenizer cannot match anything shorter than one trigram
+    min_term_length = 3
+
+    def create(self, connection):
+        connection.execute(text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} "
+            "USING fts5(full_name, department, contact, kind UNINDEXED, tokenize='trigram')"
+        ))
+        # Per-trigram document counts, used to pick selective trigrams for
+        # fuzzy matching
+        connection.execute(text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.vocab_table} "
+            f"USING fts5vocab({self.table}, 'row')"
+        ))
+
+    def _source_select(self, where=''):
+        # rowid is the user id, so re-indexing a user is a rowid delete/insert
+        return (
+            f"INSERT INTO {self.table} (rowid, full_name, department, contact, kind) "
+            "SELECT u.id, u.full_name, coalesce(dep.name, ''), "
+            "coalesce(p.contact_number, d.contact_number, ''), u.role "
+            "FROM user u "
+            "LEFT JOIN doctor d ON d.user_id = u.id "
+            "LEFT JOIN department dep ON dep.id = d.specialization_id "
+            "LEFT JOIN patient p ON p.user_id = u.id "
+            f"WHERE u.role IN ('doctor', 'patient') {where}"
+        )
+
+    def rebuild(self, connection):
+        connection.execute(text(f"DROP TABLE IF EXISTS {self.vocab_table}"))
+        connection.execute(text(f"DROP TABLE IF EXISTS {self.table}"))
+        self.create(connection)
+        connection.execute(text(self._source_select()))
+
+    def sync(self, connection, user_ids):
+        ids = ','.join(str(int(user_id)) for user_id in user_ids)
+        connection.execute(text(f"DELETE FROM {self.table} WHERE rowid IN ({ids})"))
+        connection.execute(text(self._source_select(f"AND u.id IN ({ids})")))
+
+    def _candidates(self, match, kind, fields, limit, ranked=False):
+        order = f"ORDER BY bm25({self.table})" if ranked else ''
+        return db.session.execute(text(
+            f"SELECT rowid, {', '.join(fields)} FROM {self.table} "
+            f"WHERE {self.table} MATCH :match AND kind = :kind {order} LIMIT :limit"
+        ), {'match': match, 'kind': kind, 'limit': limit}).all()
+
+    def _selective_trigrams(self, grams):
+        # Trigrams shared by a large part of the table ('ent', 'ohn', ...)
+        # add little to a fuzzy match but make the OR query touch every row
+        # containing them, so only the rarest ones are used.
+        counts = dict(db.session.execute(text(
+            f"SELECT term, doc FROM {self.vocab_table} WHERE term IN ({', '.join(':g%d' % i for i in range(len(grams)))})"
+        ), {'g%d' % i: gram for i, gram in enumerate(grams)}).all())
+        present = sorted((counts[gram], gram) for gram in grams if gram in counts)
+        selective = [gram for count, gram in present if count <= FUZZY_MAX_DOCS]
+        return selective or [gram for _, gram in present[:1]]
+
+    def query(self, term, kind, limit):
+        grams = sorted(trigrams(term))
+        if not grams:
+            return None
+        fields = SEARCH_FIELDS[kind]
+        columns = '{%s}' % ' '.join(fields)
+
+        # 1. Substring matches: a quoted phrase in the trigram tokenizer
+        # matches the term anywhere in the field. No ORDER BY, so SQLite
+        # stops after enough rows however common the term is.
+        phrase = '%s: "%s"' % (columns, term.replace('"', '""'))
+        candidates = self._candidates(phrase, kind, fields, limit * 5)
+
+        # 2. Fuzzy matches (typos) only when substring matches run short
+        if len(candidates) < limit:
+            selective = self._selective_trigrams(grams)
+            if selective:
+                fuzzy = '%s: (%s)' % (columns, ' OR '.join('"%s"' % gram.replace('"', '""')
+                                                             for gram in selective))
+                seen = {row[0] for row in candidates}
+                candidates += [row for row in self._candidates(fuzzy, kind, fields, limit * 5, ranked=True)
+                               if row[0] not in seen]
+        return rank_candidates(term, candidates, limit)
+
+
+class TrigramBackend(LikeBackend):
+    # PostgreSQL: pg_trgm GIN indexes make the existing ILIKE '%term%'
+    # filters in search.py index-backed, and similarity() ranks fuzzy hits.
+    name = 'trigram'
+    min_term_length = 3
+
+    def create(self, connection):
+        connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        connection.execute(text(
+            'CREATE INDEX IF NOT EXISTS ix_user_full_name_trgm ON "user" '
+            'USING gin (full_name gin_trgm_ops)'))
+        connection.execute(text(
+            'CREATE INDEX IF NOT EXISTS ix_department_name_trgm ON department '
+            'USING gin (name gin_trgm_ops)'))
+        connection.execute(text(
+            'CREATE INDEX IF NOT EXISTS ix_patient_contact_trgm ON patient '
+            'USING gin (contact_number gin_trgm_ops)'))
+
+    def rebuild(self, connection):
+        connection.execute(text('REINDEX INDEX ix_user_full_name_trgm'))
+        connection.execute(text('REINDEX INDEX ix_department_name_trgm'))
+        connection.execute(text('REINDEX INDEX ix_patient_contact_trgm'))
+
+    def query(self, term, kind, limit):
+        if kind == 'doctor':
+            rows = db.session.query(User.id, User.full_name, Department.name) \
+                .join(Doctor, Doctor.user_id == User.id) \
+                .join(Department, Department.id == Doctor.specialization_id) \
+                .filter(User.full_name.op('%')(term) | Department.name.op('%')(term)
+                        | User.full_name.icontains(term, autoescape=True)) \
+                .order_by(db.func.similarity(User.full_name, term).desc()) \
+                .limit(limit * 5).all()
+        else:
+            rows = db.session.query(User.id, User.full_name, Patient.contact_number) \
+                .join(Patient, Patient.user_id == User.id) \
+                .filter(User.full_name.op('%')(term)
+                        | User.full_name.icontains(term, autoescape=True)
+                        | Patient.contact_number.icontains(term, autoescape=True)) \
+                .order_by(db.func.similarity(User.full_name, term).desc()) \
+                .limit(limit * 5).all()
+        return rank_candidates(term, rows, limit)
+
+
+BACKENDS = {backend.name: backend for backend in (Fts5Backend, TrigramBackend, LikeBackend)}
+
+
+def rank_candidates(term, candidates, limit):
+    # candidates: (user_id, field, field, ...) in the backend's own order.
+    # Final order: field or word prefix match, substring match, then fuzzy matches by
+    # trigram similarity; weak fuzzy matches are dropped.
+    lowered = term.lower()
+    ranked = []
+    for position, (user_id, *values) in enumerate(candidates):
+        values = [(value or '').lower() for value in values]
+        if any(word.startswith(lowered) for value in values for word in [value, *value.split()]):
+            tier = 0
+        elif any(lowered in value for value in values):
+            tier = 1
+        else:
+            score = max(similarity(lowered, value) for value in values)
+            if score < MIN_SIMILARITY:
+                continue
+            tier = 2 - score
+        ranked.append((tier, position, user_id))
+    ranked.sort()
+    return [user_id for _, _, user_id in ranked[:limit]]
+
+
+def get_backend(app=None):
+    app = app or current_app
+    backend = app.extensions.get('search_index')
+    if backend is None:
+        name = app.config.get('SEARCH_BACKEND', 'auto')
+        if name == 'auto':
+            dialect = db.engine.dialect.name
+            name = {'sqlite': 'fts5', 'postgresql': 'trigram'}.get(dialect, 'like')
+        backend = app.extensions['search_index'] = BACKENDS[name]()
+    return backend
+
+
+def search_user_ids(term, kind, limit):
+    # Ranked user ids, or None when the index cannot answer this term and
+    # the caller should fall back to plain ILIKE filtering.
+    backend = get_backend()
+    if backend.min_term_length is None or len(term) < backend.min_term_length:
+        return None
+    return backend.query(term, kind, limit)
+
+
+def rebuild():
+    connection = db.session.connection()
+    get_backend().rebuild(connection)
+    db.session.commit()
+
+
+# --- Keeping the index in sync ---
+# After every flush, re-index the users whose User, Doctor or Patient rows
+# were written (and every doctor of a renamed department) on the flushing
+# transaction's own connection, so the index commits or rolls back with
+# the change.
+
+def _touched_user_ids(session):
+    user_ids = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User):
+            user_ids.add(obj.id)
+        elif isinstance(obj, (Doctor, Patient)):
+            user_ids.add(obj.user_id)
+        elif isinstance(obj, Department) and obj.id is not None:
+            user_ids.update(user_id for (user_id,) in session.connection().execute(
+                db.select(Doctor.user_id).where(Doctor.specialization_id == obj.id)))
+    user_ids.discard(None)
+    return user_ids
+
+
+def sync_users(connection, user_ids):
+    # Re-index the given users explicitly; needed after bulk Core inserts,
+    # which never reach the flush hook below.
+    backend = get_backend()
+    if backend.name == 'fts5' and user_ids:
+        backend.sync(connection, user_ids)
+
+
+def _after_flush(session, flush_context):
+    if not has_app_context() or not current_app.config.get('SEARCH_INDEX_SYNC', True):
+        return
+    if get_backend().name != 'fts5':
+        return
+    sync_users(session.connection(), _touched_user_ids(session))
+
+
+def init_app(app):
+    if not event.contains(Session, 'after_flush', _after_flush):
+        event.listen(Session, 'after_flush', _after_flush)
+
+    @app.cli.command('rebuild-search-index')
+    def rebuild_search_index_command():
+        rebuild()
+        click.echo(f'Search index rebuilt ({get_backend().name} backend).')
@@ -0,0 +1,145 @@
+from datetime import datetime
+
+import click
+
+from model import db, User, Doctor, Appointment, ArchivedAppointment, DashboardStat, DashboardStatDelta
+
+
+APPOINTMENT_STATUSES = ['Booked', 'Confirmed', 'Canceled', 'Completed']
+
+
+def status_key(status):
+    return f'appointments:{status}'
+
+
+# --- Transactional counter updates ---
+# bump() only appends a delta row on the caller's session; the change becomes
+# visible when the caller commits, together with the row it accounts for.
+# Appending never contends with other writers the way an UPDATE of the same
+# counter row would; fold() later adds the deltas into the counters.
+
+def bump(key, delta=1):
+    if delta:
+        db.session.add(DashboardStatDelta(key=key, delta=delta))
+
+
+def appointment_added(status='Booked'):
+    bump('appointments')
+    bump(status_key(status))
+
+
+def appointment_status_changed(old_status, new_status):
+    if old_status == new_status:
+        return
+    bump(status_key(old_status), -1)
+    bump(status_key(new_status))
+
+
+# --- Reading ---
+# Counters are seeded by migration step 3 and `flask reconcile-stats`; reads
+# never write. Deltas not folded yet are added in, so the cards are exact
+# however far behind the worker is.
+
+def current_values():
+    values = dict(db.session.query(DashboardStat.key, DashboardStat.value).all())
+    pending = db.session.query(DashboardStatDelta.key, db.func.sum(DashboardStatDelta.delta)) \
+        .group_by(DashboardStatDelta.key).all()
+    for key, delta in pending:
+        values[key] = values.get(key, 0) + delta
+    return values
+
+
+def snapshot():
+    values = current_values()
+    return {
+        'total_doctors': values.get('doctors', 0),
+        'total_patients': values.get('patients', 0),
+        'total_appointments': values.get('appointments', 0),
+        'appointments_by_status': {status: values.get(status_key(status), 0)
+                                   for status in APPOINTMENT_STATUSES},
+    }
+
+
+# --- Folding ---
+# Run by the job worker's housekeeping. Deltas up to the highest id seen are
+# summed into their counters and deleted in one transaction; deltas committed
+# meanwhile have higher ids and wait for the next fold.
+
+def fold():
+    last = db.session.query(db.func.max(DashboardStatDelta.id)).scalar()
+    if last is None:
+        return 0
+    pending = db.session.query(DashboardStatDelta.key, db.func.sum(DashboardStatDelta.delta),
+                               db.func.count(DashboardStatDelta.id)) \
+        .filter(DashboardStatDelta.id <= last) \
+        .group_by(DashboardStatDelta.key).all()
+    existing = {stat.key: stat for stat in DashboardStat.query.all()}
+    for key, delta, _ in pending:
+        if key in existing:
+            existing[key].value += delta
+        else:
+            db.session.add(DashboardStat(key=key, value=delta))
+    db.session.query(DashboardStatDelta).filter(DashboardStatDelta.id <= last) \
+        .delete(synchronize_session=False)
+    db.session.commit()
+    return sum(count for _, _, count in pending)
+
+
+# --- Reconciliation ---
+# Recomputes every counter from the source tables and repairs any drift
+# (e.g. rows written outside the app). Meant to run periodically via
+# `flask reconcile-stats`.
+
+def actual_counts():
+    # Counts name only id and status, so migration step 3 can run this
+    # before later steps add the other columns
+    count = lambda model: db.session.query(db.func.count(model.id))
+    counts = {
+        'doctors': count(Doctor).scalar(),
+        'patients': count(User).filter(User.role == 'patient').scalar(),
+        # Archived appointments still count; see archive.py
+        'appointments': count(Appointment).scalar() + count(ArchivedAppointment).scalar(),
+    }
+    for status in APPOINTMENT_STATUSES:
+        counts[status_key(status)] = 0
+    for model in (Appointment, ArchivedAppointment):
+        by_status = db.session.query(model.status, db.func.count(model.id)) \
+            .group_by(model.status).all()
+        for status, count in by_status:
+            counts[status_key(status)] = counts.get(status_key(status), 0) + count
+    return counts
+
+
+def reconcile():
+    # Pending deltas are replaced by the recomputed counts
+    last = db.session.query(db.func.max(DashboardStatDelta.id)).scalar()
+    stored = current_values()
+    counts = actual_counts()
+    now = datetime.utcnow()
+    existing = {stat.key: stat for stat in DashboardStat.query.all()}
+    drift = {}
+    for key, value in counts.items():
+        if key in stored and stored[key] != value:
+            drift[key] = value - stored[key]
+        stat = existing.get(key)
+        if stat is None:
+            stat = DashboardStat(key=key, value=value)
+            db.session.add(stat)
+        stat.value = value
+        stat.reconciled_at = now
+    if last is not None:
+        db.session.query(DashboardStatDelta).filter(DashboardStatDelta.id <= last) \
+            .delete(synchronize_session=False)
+    db.session.commit()
+    return counts, drift
+
+
+def init_commands(app):
+    @app.cli.command('reconcile-stats')
+    def reconcile_stats_command():
+        _, drift = reconcile()
+        if drift:
+            for key, delta in drift.items():
+                click.echo(f'{key}: corrected by {delta:+d}')
+        else:
+            click.echo('Dashboard counters are in sync.')
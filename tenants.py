@@ -0,0 +1,339 @@
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import click
+from flask import abort, current_app, g, has_app_context, request, session
+from sqlalchemy import delete, event, insert, select
+from sqlalchemy.orm import Session
+
+from model import db, User, TenantLogin
+import bulk_io
+import database
+
+
+# Kept well below SQLite's bound-parameter limit
+ID_CHUNK = 500
+
+TENANT_NAME = re.compile(r'^[a-z0-9][a-z0-9-]{0,62}$')
+
+
+class TenantError(Exception):
+    pass
+
+
+# --- Hospitals ---
+# With TENANTS set, each hospital's data lives in its own database,
+# TENANT_DATABASE_URI with {tenant} filled in, behind its own pooled engine
+# so one hospital's traffic never queues on another's connections or
+# evicts its pages. SQLALCHEMY_DATABASE_URI becomes the directory
+# database, which holds only tenant_login. Without TENANTS nothing changes:
+# everything uses SQLALCHEMY_DATABASE_URI.
+#
+# The hospital a piece of code works for is g.tenant: set per request from
+# the TENANT_DOMAIN subdomain, the TENANT_HEADER header or the signed-in
+# session, by use() for CLI commands and threads, and from HMS_TENANT
+# (DEFAULT_TENANT) when nothing else sets it. The session's get_bind (see
+# replicas.RoutingSession) sends every statement to that hospital's engine.
+
+class Tenants:
+    def __init__(self, app, names):
+        self.app = app
+        self.names = names
+        self.engines = {}
+        self.lock = threading.Lock()
+
+    def engine(self, name):
+        engine = self.engines.get(name)
+        if engine is None:
+            with self.lock:
+                engine = self.engines.get(name)
+                if engine is None:
+                    engine = self.engines[name] = self._make_engine(name)
+        return engine
+
+    def _make_engine(self, name):
+        import fragments
+        import instrumentation
+        engine = database.make_engine(self.app, self.app.config['TENANT_DATABASE_URI'].format(tenant=name))
+        fragments.listen(engine)
+        if self.app.config['SQL_INSTRUMENTATION']:
+            instrumentation.listen(engine)
+        return engine
+
+    def engine_for_context(self):
+        name = current()
+        return self.engine(name) if name else None
+
+
+def enabled():
+    return has_app_context() and 'tenants' in current_app.extensions
+
+
+def names():
+    return list(current_app.extensions['tenants'].names) if enabled() else []
+
+
+def current():
+    # The hospital this code works for; None in single-hospital deployments
+    # and for directory work
+    if not enabled():
+        return None
+    if 'tenant' in g:
+        return g.tenant
+    return current_app.config['DEFAULT_TENANT'] or None
+
+
+def _check(name):
+    if name not in current_app.extensions['tenants'].names:
+        raise TenantError(f'Unknown hospital: {name}')
+    return name
+
+
+def enter(name):
+    # Switches the rest of this app context to another hospital. The session
+    # is dropped first, since rows of two databases must never share its
+    # identity map.
+    if name is not None:
+        _check(name)
+    if current() != name:
+        db.session.remove()
+    g.tenant = name
+
+
+@contextmanager
+def use(name):
+    previous = current()
+    enter(name)
+    try:
+        yield
+    finally:
+        enter(previous)
+
+
+# --- Per-request resolution ---
+
+def _requested_tenant():
+    config = current_app.config
+    domain = config['TENANT_DOMAIN']
+    host = request.host.split(':')[0]
+    if domain and host.endswith('.' + domain):
+        return host[:-len(domain) - 1]
+    return request.headers.get(config['TENANT_HEADER'])
+
+
+def _resolve_tenant():
+    name = _requested_tenant()
+    if name is not None and name not in current_app.extensions['tenants'].names:
+        abort(404)
+    signed_in = session.get('tenant')
+    if name is None:
+        name = signed_in
+    elif 'user_id' in session and signed_in != name:
+        # A session from another hospital means nothing here
+        for key in ('user_id', 'role', 'tenant'):
+            session.pop(key, None)
+    g.tenant = name
+
+
+# --- Login directory ---
+# tenant_login in the directory database maps usernames to hospitals, so a
+# user can sign in without naming their hospital first. It is kept up to
+# date from the same places as the search index: a flush hook for ORM
+# changes and explicit calls after bulk Core writes. Directory writes commit
+# on their own connection; `flask sync-logins` rebuilds the directory from
+# every hospital if it ever drifts.
+
+def requested():
+    # The hospital this request's address names, ignoring the session
+    return _requested_tenant() or current_app.config['DEFAULT_TENANT'] or None
+
+
+def login_tenant(username):
+    # The hospital to authenticate username against, or None when it is
+    # unknown or ambiguous (the user must sign in at their hospital's
+    # address)
+    name = requested()
+    if name is not None or not username:
+        return name
+    with db.engine.connect() as directory:
+        found = directory.execute(select(TenantLogin.tenant).where(TenantLogin.username == username)
+                                  .limit(2)).scalars().all()
+    return found[0] if len(found) == 1 else None
+
+
+def login_taken(username, email):
+    # Whether a login exists in any hospital; new patients are kept unique
+    with db.engine.connect() as directory:
+        return directory.execute(select(TenantLogin.user_id).where(
+            (TenantLogin.username == username) | (TenantLogin.email == email)).limit(1)).first() is not None
+
+
+# Directory rows follow the hospital's commits: user ids written in a
+# transaction are collected on the session and their rows rewritten once it
+# has committed, so a rollback never leaves logins behind in the directory.
+# A process that dies in between leaves them to `flask sync-logins`.
+
+def sync_logins(session, user_ids):
+    name = current()
+    if name is None or not user_ids:
+        return
+    session.info.setdefault('login_user_ids', {}).setdefault(name, set()).update(user_ids)
+
+
+def _write_logins(name, user_ids):
+    # Re-reads the given users of one hospital and replaces their directory
+    # rows
+    with current_app.extensions['tenants'].engine(name).connect() as hospital:
+        for chunk in bulk_io.chunked(sorted(user_ids), ID_CHUNK):
+            rows = hospital.execute(select(User.id, User.username, User.email).where(User.id.in_(chunk))).all()
+            with db.engine.begin() as directory:
+                directory.execute(delete(TenantLogin).where(TenantLogin.tenant == name,
+                                                            TenantLogin.user_id.in_(chunk)))
+                if rows:
+                    directory.execute(insert(TenantLogin), [
+                        dict(tenant=name, user_id=id_, username=username, email=email)
+                        for id_, username, email in rows])
+
+
+def _after_flush(session, flush_context):
+    if current() is None:
+        return
+    user_ids = {obj.id for obj in list(session.new) + list(session.dirty) + list(session.deleted)
+                if isinstance(obj, User)}
+    user_ids.discard(None)
+    sync_logins(session, user_ids)
+
+
+def _after_commit(session):
+    pending = session.info.pop('login_user_ids', None)
+    for name, user_ids in (pending or {}).items():
+        _write_logins(name, user_ids)
+
+
+def _after_rollback(session):
+    session.info.pop('login_user_ids', None)
+
+
+def rebuild_logins():
+    def logins():
+        return db.session.query(User.id, User.username, User.email).all()
+
+    results, errors = fan_out(logins)
+    with db.engine.begin() as directory:
+        for name, rows in results.items():
+            directory.execute(delete(TenantLogin).where(TenantLogin.tenant == name))
+            for chunk in bulk_io.chunked(rows, ID_CHUNK):
+                directory.execute(insert(TenantLogin), [
+                    dict(tenant=name, user_id=id_, username=username, email=email)
+                    for id_, username, email in chunk])
+    return {name: len(rows) for name, rows in results.items()}, errors
+
+
+# --- Fan-out ---
+# Cross-hospital work runs function once per hospital on a thread pool of
+# TENANT_FANOUT_WORKERS. Each thread has its own app context and session,
+# bound to one hospital. A hospital that fails is reported in errors
+# rather than failing the others.
+
+def fan_out(function, tenant_names=None):
+    app = current_app._get_current_object()
+    tenant_names = tenant_names or names()
+
+    def run(name):
+        with app.app_context():
+            g.tenant = name
+            try:
+                return name, function(), None
+            except Exception as error:
+                return name, None, repr(error)
+            finally:
+                db.session.remove()
+
+    if not tenant_names:
+        return {}, {}
+    workers = max(1, min(app.config['TENANT_FANOUT_WORKERS'], len(tenant_names)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tenant-fanout') as pool:
+        outcomes = list(pool.map(run, tenant_names))
+    results = {name: value for name, value, error in outcomes if error is None}
+    errors = {name: error for name, _, error in outcomes if error is not None}
+    return results, errors
+
+
+def _merge(values):
+    # Sums numbers key by key, recursing into nested dicts
+    total = {}
+    for value in values:
+        for key, item in value.items():
+            if isinstance(item, dict):
+                total[key] = _merge([total.get(key, {}), item])
+            else:
+                total[key] = total.get(key, 0) + item
+    return total
+
+
+def hospitals_report():
+    import stats
+    results, errors = fan_out(stats.snapshot)
+    return {'hospitals': results, 'totals': _merge(results.values()), 'errors': errors}
+
+
+# --- Setup ---
+
+def init_app(app):
+    # Call after database.init_app() and before anything that queries in
+    # before_request
+    tenant_names = [name.strip() for name in (app.config['TENANTS'] or '').split(',') if name.strip()]
+    bad = [name for name in tenant_names if not TENANT_NAME.match(name)]
+    if bad:
+        raise TenantError(f"Invalid hospital names: {', '.join(bad)}")
+    if tenant_names:
+        if '{tenant}' not in (app.config['TENANT_DATABASE_URI'] or ''):
+            raise TenantError('TENANT_DATABASE_URI must contain {tenant}.')
+        app.extensions['tenants'] = Tenants(app, tenant_names)
+        app.before_request(_resolve_tenant)
+        for hook, listener in (('after_flush', _after_flush), ('after_commit', _after_commit),
+                               ('after_rollback', _after_rollback)):
+            if not event.contains(Session, hook, listener):
+                event.listen(Session, hook, listener)
+
+    @app.cli.command('init-tenants')
+    def init_tenants_command():
+        import migrations
+        if not enabled():
+            raise click.ClickException('TENANTS is not set.')
+        TenantLogin.__table__.create(db.engine, checkfirst=True)
+        for name in names():
+            with use(name):
+                applied, seeded = migrations.init_db()
+            click.echo(f'{name}: {len(applied)} migration(s) applied'
+                       f"{', default admin created' if seeded else ''}.")
+        counts, errors = rebuild_logins()
+        click.echo(f'Directory: {sum(counts.values())} login(s).')
+        for name, error in errors.items():
+            click.echo(f'{name}: {error}', err=True)
+
+    @app.cli.command('sync-logins')
+    def sync_logins_command():
+        if not enabled():
+            raise click.ClickException('TENANTS is not set.')
+        counts, errors = rebuild_logins()
+        for name, count in counts.items():
+            click.echo(f'{name}: {count} login(s)')
+        for name, error in errors.items():
+            click.echo(f'{name}: {error}', err=True)
+
+    @app.cli.command('hospitals-report')
+    def hospitals_report_command():
+        if not enabled():
+            raise click.ClickException('TENANTS is not set.')
+        report = hospitals_report()
+        for name, snapshot in report['hospitals'].items():
+            click.echo(f"{name}: {snapshot['total_doctors']} doctors, {snapshot['total_patients']} patients, "
+                       f"{snapshot['total_appointments']} appointments")
+        totals = report['totals']
+        click.echo(f"all: {totals.get('total_doctors', 0)} doctors, {totals.get('total_patients', 0)} patients, "
+                   f"{totals.get('total_appointments', 0)} appointments")
+        for name, error in report['errors'].items():
+            click.echo(f'{name}: {error}', err=True)
@@ -0,0 +1,79 @@
+-- Schema created by the original app (db.create_all() before any migration
+-- step existed); upgrades must start from here.
+CREATE TABLE user (
+	id INTEGER NOT NULL, 
+	full_name VARCHAR(150) NOT NULL, 
+	username VARCHAR(150) NOT NULL, 
+	password_hash VARCHAR(150) NOT NULL, 
+	email VARCHAR(150) NOT NULL, 
+	is_active BOOLEAN, 
+	role VARCHAR(20) NOT NULL, 
+	created_at DATETIME, 
+	PRIMARY KEY (id), 
+	UNIQUE (full_name), 
+	UNIQUE (username), 
+	UNIQUE (email)
+);
+CREATE TABLE department (
+	id INTEGER NOT NULL, 
+	name VARCHAR(50) NOT NULL, 
+	description VARCHAR(255), 
+	PRIMARY KEY (id), 
+	UNIQUE (name)
+);
+CREATE TABLE doctor (
+	id INTEGER NOT NULL, 
+	user_id INTEGER NOT NULL, 
+	specialization_id INTEGER NOT NULL, 
+	contact_number VARCHAR(20), 
+	licence_number VARCHAR(50), 
+	is_blacklisted BOOLEAN, 
+	PRIMARY KEY (id), 
+	UNIQUE (user_id), 
+	FOREIGN KEY(user_id) REFERENCES user (id), 
+	FOREIGN KEY(specialization_id) REFERENCES department (id), 
+	UNIQUE (licence_number)
+);
+CREATE TABLE patient (
+	id INTEGER NOT NULL, 
+	user_id INTEGER NOT NULL, 
+	date_of_birth DATE, 
+	contact_number VARCHAR(20), 
+	medical_history_summary TEXT, 
+	is_blacklisted BOOLEAN, 
+	PRIMARY KEY (id), 
+	UNIQUE (user_id), 
+	FOREIGN KEY(user_id) REFERENCES user (id)
+);
+CREATE TABLE doctor_schedule (
+	id INTEGER NOT NULL, 
+	doctor_id INTEGER NOT NULL, 
+	day_of_week VARCHAR(10) NOT NULL, 
+	start_time TIME NOT NULL, 
+	end_time TIME NOT NULL, 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(doctor_id) REFERENCES doctor (id)
+);
+CREATE TABLE appointment (
+	id INTEGER NOT NULL, 
+	patient_id INTEGER NOT NULL, 
+	doctor_id INTEGER NOT NULL, 
+	start_time DATETIME NOT NULL, 
+	end_time DATETIME NOT NULL, 
+	status VARCHAR(20) NOT NULL, 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(patient_id) REFERENCES patient (id), 
+	FOREIGN KEY(doctor_id) REFERENCES doctor (id)
+);
+CREATE TABLE treatment (
+	id INTEGER NOT NULL, 
+	appointment_id INTEGER NOT NULL, 
+	diagnosis TEXT NOT NULL, 
+	prescription TEXT NOT NULL, 
+	notes TEXT, 
+	created_by_doctor_id INTEGER NOT NULL, 
+	PRIMARY KEY (id), 
+	UNIQUE (appointment_id), 
+	FOREIGN KEY(appointment_id) REFERENCES appointment (id), 
+	FOREIGN KEY(created_by_doctor_id) REFERENCES doctor (id)
+);
@@ -0,0 +1,99 @@
+import os
+import sys
+from datetime import datetime, time, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def pytest_addoption(parser):
+    parser.addoption('--run-slow', action='store_true', help='Also run the tests marked slow (large data sets).')
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'slow: builds a large data set; skipped unless --run-slow is given')
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption('--run-slow'):
+        return
+    skip = pytest.mark.skip(reason='needs --run-slow')
+    for item in items:
+        if 'slow' in item.keywords:
+            item.add_marker(skip)
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    # A fresh SQLite file per test, migrated to head like `flask init-db`
+    monkeypatch.setenv('SQLALCHEMY_DATABASE_URI', f"sqlite:///{tmp_path / 'hms.db'}")
+    monkeypatch.setenv('SECRET_KEY', 'test')
+    monkeypatch.setenv('REQUEST_LOG', 'false')
+    from app import create_app
+    import migrations
+    app = create_app()
+    with app.app_context():
+        migrations.init_db()
+        yield app
+
+
+@pytest.fixture
+def hospital(app):
+    # Builds doctors with weekly schedules, patients, and appointments spread
+    # over doctors and patients, all in the past, then `upcoming` future
+    # ones. The first `treated` appointments are Completed with a treatment
+    # and prescription lines. Returns the created ids.
+    from model import db, User, Doctor, Patient, Department, DoctorSchedule, Appointment, Treatment, \
+        PrescriptionItem
+    import stats
+
+    def build(doctors=3, patients=5, appointments=30, treated=0, items_per_treatment=2, upcoming=0):
+        department = Department(name='General')
+        db.session.add(department)
+        db.session.flush()
+        doctor_ids, patient_ids, appointment_ids = [], [], []
+        for i in range(doctors):
+            user = User(full_name=f'Doctor {i}', username=f'doctor{i}', email=f'doctor{i}@example.com',
+                        password_hash='x', role='doctor')
+            db.session.add(user)
+            db.session.flush()
+            doctor = Doctor(user_id=user.id, specialization_id=department.id, contact_number='555')
+            db.session.add(doctor)
+            db.session.flush()
+            doctor_ids.append(doctor.id)
+            for weekday in range(5):
+                db.session.add(DoctorSchedule(doctor_id=doctor.id, weekday=weekday,
+                                              start_time=time(9), end_time=time(12)))
+        for i in range(patients):
+            user = User(full_name=f'Patient {i}', username=f'patient{i}', email=f'patient{i}@example.com',
+                        password_hash='x', role='patient')
+            db.session.add(user)
+            db.session.flush()
+            patient = Patient(user_id=user.id, contact_number=f'07{i:03d}')
+            db.session.add(patient)
+            db.session.flush()
+            patient_ids.append(patient.id)
+        today = datetime.now().replace(hour=9, minute=0, second=0, microsecond=0)
+        for i in range(appointments + upcoming):
+            day = i // 6 - appointments // 6 - 1 if i < appointments else (i - appointments) // 6 + 1
+            begins = today + timedelta(days=day, minutes=30 * (i % 6))
+            appointment = Appointment(patient_id=patient_ids[i % patients], doctor_id=doctor_ids[i % doctors],
+                                      start_time=begins, end_time=begins + timedelta(minutes=30),
+                                      status='Completed' if i < treated else 'Booked')
+            db.session.add(appointment)
+            db.session.flush()
+            appointment_ids.append(appointment.id)
+            if i < treated:
+                treatment = Treatment(appointment_id=appointment.id, diagnosis='Checked', prescription='See items',
+                                      created_by_doctor_id=appointment.doctor_id)
+                db.session.add(treatment)
+                db.session.flush()
+                for n in range(items_per_treatment):
+                    db.session.add(PrescriptionItem(treatment_id=treatment.id, drug=f'Drug {n}', dose='1 tab',
+                                                    frequency='daily', duration_days=5, prescribed_at=begins))
+        db.session.commit()
+        stats.reconcile()
+        return {'doctors': doctor_ids, 'patients': patient_ids, 'appointments': appointment_ids}
+
+    return build
@@ -0,0 +1,68 @@
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from model import db, User, Appointment
+import agenda
+import booking
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    agenda.invalidate()
+    yield
+    agenda.invalidate()
+
+
+def _count_queries(app, function):
+    seen = []
+    listener = lambda *args: seen.append(1)
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        result = function()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    return result, len(seen)
+
+
+def test_the_agenda_covers_the_coming_week_grouped_by_day(app, hospital):
+    created = hospital(doctors=1, patients=4, appointments=12, upcoming=60)
+    today = date.today()
+
+    days = agenda.agenda(created['doctors'][0], today)
+
+    assert list(days) == [today + timedelta(days=n) for n in range(1, 8)]
+    assert all(len(appointments) == 6 for appointments in days.values())
+    first = days[today + timedelta(days=1)][0]
+    assert first['patient_name'] == 'Patient 0' and first['status'] == 'Booked'
+
+
+def test_the_agenda_is_served_from_the_cache_until_a_booking(app, hospital):
+    created = hospital(doctors=1, patients=2, appointments=0, upcoming=6)
+    doctor_id = created['doctors'][0]
+    today = date.today()
+
+    before, queries = _count_queries(app, lambda: agenda.agenda(doctor_id, today))
+    assert queries == 1
+    assert _count_queries(app, lambda: agenda.agenda(doctor_id, today)) == (before, 0)
+
+    start, _ = booking.available_slots(doctor_id, today, 7)[0]
+    booking.book_appointment(User.query.filter_by(username='patient1').one(), doctor_id, start)
+
+    after = agenda.agenda(doctor_id, today)
+    assert sum(map(len, after.values())) == sum(map(len, before.values())) + 1
+    assert start in [appointment['start_time'] for appointment in after[start.date()]]
+
+
+def test_the_cache_can_be_turned_off(app, hospital):
+    created = hospital(doctors=1, patients=2, appointments=0, upcoming=6)
+    doctor_id = created['doctors'][0]
+    app.config['AGENDA_CACHE_TTL'] = 0
+    agenda.agenda(doctor_id)
+
+    # A write that skips invalidate() is still seen
+    Appointment.query.filter_by(doctor_id=doctor_id).delete()
+    db.session.commit()
+
+    assert agenda.agenda(doctor_id) == {}
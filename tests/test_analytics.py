@@ -0,0 +1,18 @@
+from model import AnalyticsWatermark, AppointmentDayRollup
+import jobs
+
+
+def test_report_page_only_reads_and_the_worker_refreshes(app, hospital):
+    hospital(doctors=2, patients=3, appointments=12)
+    client = app.test_client()
+    client.post('/doctor-admin-login', data={'username': 'admin', 'password': 'admin123'})
+
+    assert client.get('/admin/analytics?format=json').get_json()['refreshed_at'] is None
+    assert AnalyticsWatermark.query.count() == 0
+    assert AppointmentDayRollup.query.count() == 0
+
+    jobs.work(once=True)
+
+    report = client.get('/admin/analytics?format=json').get_json()
+    assert report['refreshed_at'] is not None
+    assert AppointmentDayRollup.query.count() > 0
@@ -0,0 +1,30 @@
+from datetime import datetime, timedelta
+
+from model import db, Appointment, Treatment, PrescriptionItem, ArchivedAppointment
+import archive
+
+
+def test_ids_of_archived_rows_are_never_handed_out_again(app, hospital):
+    created = hospital(doctors=1, patients=1, appointments=6, treated=6)
+    # Archiving everything deletes the highest ids from the live tables
+    assert archive.archive(before=datetime.now()) == 6
+    top = db.session.query(db.func.max(ArchivedAppointment.id)).scalar()
+
+    begins = datetime.now() + timedelta(days=3)
+    appointment = Appointment(patient_id=created['patients'][0], doctor_id=created['doctors'][0],
+                              start_time=begins, end_time=begins + timedelta(minutes=30), status='Completed')
+    db.session.add(appointment)
+    db.session.flush()
+    treatment = Treatment(appointment_id=appointment.id, diagnosis='Checked', prescription='-',
+                          created_by_doctor_id=created['doctors'][0])
+    db.session.add(treatment)
+    db.session.flush()
+    item = PrescriptionItem(treatment_id=treatment.id, drug='Drug', dose='1', frequency='daily',
+                            prescribed_at=begins)
+    db.session.add(item)
+    db.session.commit()
+
+    assert appointment.id > top
+    assert treatment.id > 6
+    assert item.id > 12
+    assert len({row.id for row in db.session.execute(archive.appointment_rows().select())}) == 7
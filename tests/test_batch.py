@@ -0,0 +1,82 @@
+import pytest
+
+from model import db, User, Doctor, Patient, DoctorSchedule, Appointment
+import batch
+import stats
+
+
+def _no_drift():
+    counts, drift = stats.reconcile()
+    return drift == {}
+
+
+def test_ids_are_parsed_from_lists_and_repeated_fields():
+    assert batch.parse_ids(['1, 2', '3', '2']) == [1, 2, 3]
+    with pytest.raises(batch.BatchError):
+        batch.parse_ids(['1,x'])
+
+
+def test_status_updates_report_every_id_and_keep_the_counters(app, hospital):
+    created = hospital(doctors=2, patients=3, appointments=0, upcoming=6)
+    ids = created['appointments']
+    batch.update_appointment_statuses(ids[:2], 'Canceled')
+    # A new booking takes the first canceled slot
+    first = db.session.get(Appointment, ids[0])
+    db.session.add(Appointment(patient_id=first.patient_id, doctor_id=first.doctor_id, start_time=first.start_time,
+                               end_time=first.end_time, status='Booked'))
+    db.session.commit()
+    stats.reconcile()
+
+    result = batch.update_appointment_statuses(ids[:4] + [999], 'Confirmed')
+
+    assert result.as_dict()['results'] == {str(ids[0]): 'slot taken', str(ids[1]): 'updated',
+                                           str(ids[2]): 'updated', str(ids[3]): 'updated', '999': 'not found'}
+    assert batch.update_appointment_statuses(ids[1:3], 'Confirmed').counts() == {'unchanged': 2}
+    assert _no_drift()
+
+
+def test_an_invalid_status_is_rejected(app, hospital):
+    created = hospital(doctors=1, patients=1, appointments=0, upcoming=1)
+    with pytest.raises(batch.BatchError):
+        batch.update_appointment_statuses(created['appointments'], 'Lost')
+
+
+def test_a_filter_selects_one_doctors_appointments_for_a_day(app, hospital):
+    created = hospital(doctors=1, patients=2, appointments=0, upcoming=12)
+    day = db.session.get(Appointment, created['appointments'][6]).start_time.date()
+
+    ids = batch.appointment_ids(doctor_id=created['doctors'][0], day=day, status='Booked')
+
+    assert ids == created['appointments'][6:]
+    with pytest.raises(batch.BatchError):
+        batch.appointment_ids()
+
+
+def test_blacklisting_skips_the_acting_admin_and_unknown_users(app, hospital):
+    hospital(doctors=1, patients=2, appointments=0)
+    admin = User.query.filter_by(role='admin').one()
+    doctor = User.query.filter_by(username='doctor0').one()
+    patients = [User.query.filter_by(username=f'patient{i}').one() for i in range(2)]
+    Patient.query.filter_by(user_id=patients[1].id).one().is_blacklisted = True
+    db.session.commit()
+
+    result = batch.set_blacklisted([admin.id, doctor.id, patients[0].id, patients[1].id, 999], True,
+                                   acting_user_id=admin.id)
+
+    assert result.outcomes == {admin.id: 'own account', doctor.id: 'updated', patients[0].id: 'updated',
+                               patients[1].id: 'unchanged', 999: 'not found'}
+    assert Doctor.query.one().is_blacklisted
+    assert Patient.query.filter_by(is_blacklisted=True).count() == 2
+
+
+def test_deletes_remove_rows_and_keep_the_counters(app, hospital):
+    created = hospital(doctors=3, patients=3, appointments=12, upcoming=6)
+    schedule_ids = [schedule.id for schedule in DoctorSchedule.query.filter_by(doctor_id=created['doctors'][2])]
+
+    assert batch.delete_schedules(schedule_ids + [999]).counts() == {'deleted': 5, 'not found': 1}
+    assert batch.delete_doctors(created['doctors'][:2] + [999]).counts() == {'deleted': 2, 'not found': 1}
+
+    assert [doctor.id for doctor in Doctor.query] == created['doctors'][2:]
+    assert Appointment.query.filter(Appointment.doctor_id.in_(created['doctors'][:2])).count() == 0
+    assert DoctorSchedule.query.count() == 0
+    assert _no_drift()
@@ -0,0 +1,52 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from model import db, User, Doctor, Patient, Appointment  # noqa: E402
+import stats  # noqa: E402
+import route_benchmark  # noqa: E402
+import synthetic  # noqa: E402
+
+
+@pytest.fixture
+def sample(app):
+    app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+    return synthetic.generate(4, 30, 300, seed=1)
+
+
+def test_synthetic_data_is_consistent(app, sample):
+    assert (Doctor.query.count(), Patient.query.count(), Appointment.query.count()) == (4, 30, 300)
+    assert db.session.query(Appointment.doctor_id, Appointment.start_time).distinct().count() == 300
+    assert stats.reconcile()[1] == {}
+    assert sorted(sample['doctor_ids']) == sorted(doctor.id for doctor in Doctor.query)
+    assert User.query.filter_by(username=sample['patient_usernames'][-1]).count() == 1
+
+
+def test_every_route_runs_against_the_synthetic_data(app, sample):
+    driver = route_benchmark.ClientDriver(app, sample)
+
+    for route in route_benchmark.ROUTES:
+        results, wall = route_benchmark.run_route(driver, route, requests=4, concurrency=2, warmup=1)
+        summary = route_benchmark.summarize(results, wall)
+        expected = {'302': 4} if route.role is None else {'200': 4}
+        assert summary['statuses'] == expected, route.name
+        assert summary['errors'] == 0 and summary['queries_max'] > 0, route.name
+
+
+def _report(p95_ms, queries_max):
+    return {'scales': [{'label': '1:1:1', 'routes': {'search': {'p95_ms': p95_ms, 'queries_max': queries_max}}}]}
+
+
+@pytest.mark.parametrize('before_ms, p95_ms, queries_max, regressed', [
+    (10, 12, 3, False),  # within the threshold
+    (2, 2.8, 3, False),  # above it, but within the noise allowance
+    (10, 20, 3, True),
+    (10, 10, 4, True),
+])
+def test_runs_are_compared_with_a_baseline(before_ms, p95_ms, queries_max, regressed):
+    regressions = route_benchmark.compare(_report(p95_ms, queries_max), _report(before_ms, 3),
+                                          threshold=0.25, noise_ms=1.0)
+    assert bool(regressions) is regressed
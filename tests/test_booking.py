@@ -0,0 +1,83 @@
+import threading
+from datetime import date
+
+from flask import session
+
+from model import db, User, Patient, Appointment
+import booking
+import identity
+import stats
+
+
+def _signed_in(app, user_id):
+    # A fresh app context per request, so g starts empty like a real request
+    context = app.app_context()
+    context.push()
+    request_context = app.test_request_context()
+    request_context.push()
+    session['user_id'] = user_id
+    return lambda: (request_context.pop(), context.pop())
+
+
+def test_first_booking_refreshes_the_cached_identity(app, hospital):
+    app.config['IDENTITY_CACHE_TTL'] = 60
+    created = hospital(doctors=1, patients=1, appointments=0)
+    user = User(full_name='New Patient', username='newpatient', email='new@example.com',
+                password_hash='x', role='patient')
+    db.session.add(user)
+    db.session.commit()
+    user_id = user.id
+
+    done = _signed_in(app, user_id)
+    try:
+        assert identity.current_user().patient_profile is None
+        doctor_id = created['doctors'][0]
+        start, _ = booking.available_slots(doctor_id, date.today(), 7)[0]
+        booking.book_appointment(identity.current_user(), doctor_id, start)
+    finally:
+        done()
+
+    done = _signed_in(app, user_id)
+    try:
+        assert identity.current_user().patient_profile is not None
+    finally:
+        done()
+
+
+def test_two_bookings_racing_for_one_slot_book_it_once(app, hospital, monkeypatch):
+    created = hospital(doctors=1, patients=2, appointments=0)
+    doctor_id = created['doctors'][0]
+    start, _ = booking.available_slots(doctor_id, date.today(), 7)[0]
+    patient_users = [db.session.get(Patient, patient_id).user_id for patient_id in created['patients']]
+
+    # Both bookings pass the availability check before either inserts, so
+    # only the unique slot index can stop the second one
+    barrier = threading.Barrier(2, timeout=10)
+    check = booking.busy_intervals
+
+    def busy_intervals_then_wait(*args):
+        intervals = check(*args)
+        barrier.wait()
+        return intervals
+
+    monkeypatch.setattr(booking, 'busy_intervals', busy_intervals_then_wait)
+
+    outcomes = []
+
+    def book(user_id):
+        with app.app_context():
+            try:
+                booking.book_appointment(db.session.get(User, user_id), doctor_id, start)
+                outcomes.append('booked')
+            except booking.BookingError:
+                outcomes.append('taken')
+
+    threads = [threading.Thread(target=book, args=(user_id,)) for user_id in patient_users]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(outcomes) == ['booked', 'taken']
+    assert Appointment.query.filter_by(doctor_id=doctor_id, start_time=start).count() == 1
+    assert stats.reconcile()[1] == {}
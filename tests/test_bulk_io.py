@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+
+from model import Appointment
+import bulk_io
+import stats
+
+
+def test_appointment_import_rejects_unknown_statuses(app, hospital):
+    hospital(doctors=1, patients=1, appointments=0)
+    start = datetime(2030, 1, 7, 9)
+    records = [{'doctor_username': 'doctor0', 'patient_username': 'patient0',
+                'start_time': (start + timedelta(hours=i)).isoformat(),
+                'end_time': (start + timedelta(hours=i, minutes=30)).isoformat(),
+                'status': status}
+               for i, status in enumerate(['Booked', 'Pending', 'Completed', 'booked'])]
+
+    result = bulk_io.import_records('appointments', records)
+
+    assert result.inserted == 2
+    assert [reason for _, reason in result.skipped] == ["unknown status 'Pending'", "unknown status 'booked'"]
+    assert sorted(status for (status,) in Appointment.query.with_entities(Appointment.status)) == \
+        ['Booked', 'Completed']
+    assert stats.reconcile()[1] == {}
+
+
+def test_account_imports_share_one_hash_pool(app):
+    records = lambda prefix: [{'username': f'{prefix}{i}', 'email': f'{prefix}{i}@example.com',
+                               'full_name': f'{prefix} {i}', 'password': 'secret'} for i in range(3)]
+    bulk_io.import_records('patients', records('first'), hash_workers=2)
+    pool = bulk_io._hash_pool
+    bulk_io.import_records('patients', records('second'), hash_workers=2)
+
+    assert pool is not None and bulk_io._hash_pool is pool
+
+
+def test_malformed_rows_are_skipped_without_aborting_the_import(app, hospital):
+    hospital(doctors=1, patients=1, appointments=0)
+    good = {'doctor_username': 'doctor0', 'patient_username': 'patient0',
+            'start_time': '2030-01-07T09:00:00', 'end_time': '2030-01-07T09:30:00'}
+    records = [
+        {**good, 'start_time': 'next tuesday'},
+        {key: value for key, value in good.items() if key != 'end_time'},
+        {**good, 'end_time': 5},
+        {**good, 'end_time': '2030-01-07T08:30:00'},
+        {**good, 'end_time': good['start_time']},
+        good,
+    ]
+
+    result = bulk_io.import_records('appointments', records)
+
+    assert result.inserted == 1
+    reasons = [reason for _, reason in result.skipped]
+    assert reasons[0].startswith('invalid value') and reasons[2].startswith('invalid value')
+    assert reasons[1] == 'missing end_time'
+    assert reasons[3:] == ['end_time must be after start_time'] * 2
+    assert Appointment.query.count() == 1
+
+
+def test_malformed_schedule_rows_are_skipped(app, hospital):
+    hospital(doctors=1, patients=1, appointments=0)
+    records = [{'doctor_username': 'doctor0', 'weekday': 'sat', 'start_time': 'nine', 'end_time': '12:00'},
+               {'doctor_username': 'doctor0', 'weekday': 'sat', 'start_time': '09:00'},
+               {'doctor_username': 'doctor0', 'weekday': 'sat', 'start_time': '09:00', 'end_time': '12:00'}]
+
+    result = bulk_io.import_records('schedules', records)
+
+    assert result.inserted == 1
+    assert [reason for _, reason in result.skipped][1] == 'missing end_time'
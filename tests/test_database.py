@@ -0,0 +1,50 @@
+import os
+
+import pytest
+from sqlalchemy import inspect
+
+from model import db, User
+
+
+@pytest.fixture
+def fresh_app(tmp_path, monkeypatch):
+    # An app over a database `flask init-db` has not run against yet
+    path = tmp_path / 'hms.db'
+    monkeypatch.setenv('SQLALCHEMY_DATABASE_URI', f'sqlite:///{path}')
+    monkeypatch.setenv('SECRET_KEY', 'test')
+    monkeypatch.setenv('REQUEST_LOG', 'false')
+    monkeypatch.setenv('DB_POOL_SIZE', '7')
+    from app import create_app
+    return create_app(), path
+
+
+def test_creating_the_app_touches_no_database(fresh_app):
+    app, path = fresh_app
+    assert not os.path.exists(path)
+    with app.app_context():
+        assert inspect(db.engine).get_table_names() == []
+
+
+def test_init_db_creates_the_schema_and_admin_once(fresh_app):
+    app, _ = fresh_app
+    runner = app.test_cli_runner()
+
+    first = runner.invoke(args=['init-db'])
+    second = runner.invoke(args=['init-db'])
+
+    assert first.exit_code == 0 and 'Created the default admin account' in first.output
+    assert second.exit_code == 0 and '(0 migration(s) applied)' in second.output
+    with app.app_context():
+        assert User.query.filter_by(role='admin').count() == 1
+
+
+def test_sqlite_connections_get_the_configured_pool_and_pragmas(fresh_app):
+    app, _ = fresh_app
+    with app.app_context():
+        assert db.engine.pool.size() == 7
+        with db.engine.connect() as connection:
+            pragma = lambda name: connection.exec_driver_sql(f'PRAGMA {name}').scalar()
+            assert pragma('journal_mode') == 'wal'
+            assert pragma('synchronous') == 1  # NORMAL
+            assert pragma('busy_timeout') == 5000
+            assert pragma('foreign_keys') == 1
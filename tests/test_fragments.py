@@ -0,0 +1,41 @@
+from sqlalchemy import event
+
+from model import db, CacheVersion, Department
+import fragments
+
+
+def _version(table):
+    db.session.expire_all()
+    return db.session.get(CacheVersion, table).version
+
+
+def test_versions_are_bumped_after_the_commit_outside_the_writers_transaction(app):
+    fragments.seed_versions()
+    before = _version('department')
+    bumps = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('UPDATE CACHE_VERSION'):
+            bumps.append(conn)
+
+    db.session.add(Department(name='Oncology'))
+    writer = db.session.connection()
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        db.session.commit()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+    assert len(bumps) == 1 and bumps[0] is not writer
+    assert _version('department') == before + 1
+
+
+def test_rolled_back_writes_bump_nothing(app):
+    fragments.seed_versions()
+    before = _version('department')
+    db.session.add(Department(name='Oncology'))
+    db.session.flush()
+    db.session.rollback()
+    db.session.commit()
+
+    assert _version('department') == before
@@ -0,0 +1,83 @@
+import re
+
+import pytest
+
+from model import User
+import instrumentation
+
+
+@pytest.fixture(autouse=True)
+def empty_metrics():
+    instrumentation._slow_queries.clear()
+    instrumentation._metrics.update(requests={}, slow_queries=0)
+    yield
+    instrumentation._slow_queries.clear()
+    instrumentation._metrics.update(requests={}, slow_queries=0)
+
+
+@pytest.fixture
+def admin(app):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session.update(user_id=User.query.filter_by(role='admin').one().id, role='admin')
+    return client
+
+
+def _metric(text, name, **labels):
+    wanted = ','.join(f'{key}="{value}"' for key, value in labels.items())
+    match = re.search(rf'^{name}{{{re.escape(wanted)}}} (\S+)$', text, re.MULTILINE)
+    return float(match.group(1)) if match else None
+
+
+def test_each_request_reports_its_queries(app, hospital, admin):
+    hospital(doctors=2, patients=3, appointments=6)
+
+    responses = [admin.get('/admin-dashboard') for _ in range(2)]
+
+    timing = responses[0].headers.getlist('Server-Timing')
+    assert timing[0].startswith('db;dur=') and timing[1].startswith('app;dur=')
+    queries = [int(re.search(r'"(\d+) queries"', response.headers['Server-Timing']).group(1))
+               for response in responses]
+    assert queries[0] > 0
+    text = instrumentation.prometheus_text()
+    assert _metric(text, 'hms_http_requests_total', endpoint='admin_dashboard', method='GET', status=200) == 2
+    assert _metric(text, 'hms_http_request_duration_seconds_count', endpoint='admin_dashboard', method='GET') == 2
+    assert _metric(text, 'hms_db_queries_total', endpoint='admin_dashboard', method='GET') == sum(queries)
+
+
+def test_slow_selects_are_kept_with_their_plan(app, hospital, admin):
+    hospital(doctors=1, patients=2, appointments=2)
+    app.config['SQL_SLOW_QUERY_MS'] = 0
+
+    admin.get('/search-users/results?query=patient')
+    slow = admin.get('/admin/slow-queries').get_json()
+
+    assert slow['threshold_ms'] == 0
+    selects = [entry for entry in slow['queries'] if entry['statement'].startswith('SELECT')]
+    assert selects and all(entry['plan'] for entry in selects)
+    assert {entry['endpoint'] for entry in slow['queries']} >= {'search_users_results'}
+    assert f"hms_db_slow_queries_total {len(instrumentation.slow_queries())}" in instrumentation.prometheus_text()
+
+
+def test_statements_outside_requests_are_not_tracked(app, hospital):
+    app.config['SQL_SLOW_QUERY_MS'] = 0
+    hospital(doctors=1, patients=1, appointments=1)
+
+    assert instrumentation.slow_queries() == []
+    assert 'hms_http_requests_total{' not in instrumentation.prometheus_text()
+
+
+def test_metrics_need_the_token_or_an_admin(app, admin):
+    app.config['METRICS_TOKEN'] = 'scrape'
+    anonymous = app.test_client()
+
+    assert anonymous.get('/metrics').status_code != 200
+    assert anonymous.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code != 200
+    scraped = anonymous.get('/metrics', headers={'Authorization': 'Bearer scrape'})
+    assert scraped.status_code == 200 and scraped.content_type.startswith('text/plain; version=0.0.4')
+    assert '# TYPE hms_http_request_duration_seconds histogram' in scraped.get_data(as_text=True)
+    assert admin.get('/metrics').status_code == 200
+
+
+def test_label_values_are_escaped():
+    assert instrumentation._labels(endpoint='a"b\\c\nd') == '{endpoint="a\\"b\\\\c\\nd"}'
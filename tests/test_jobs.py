@@ -0,0 +1,136 @@
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from model import db, Job
+import jobs
+
+
+@pytest.fixture
+def handlers():
+    # Registers throwaway handlers for one test
+    added = []
+
+    def register(kind, function, batch=False):
+        jobs.handler(kind, batch=batch)(function)
+        added.append(kind)
+
+    yield register
+    for kind in added:
+        jobs._handlers.pop(kind, None)
+
+
+def _status(job_id):
+    db.session.expire_all()
+    return db.session.get(Job, job_id)
+
+
+def test_claim_takes_the_oldest_due_jobs_up_to_the_limit(app):
+    now = datetime.utcnow()
+    queued = [jobs.enqueue('noop', run_at=now + timedelta(minutes=minutes), n=minutes)
+              for minutes in (-1, -3, -2, 10)]
+    db.session.commit()
+    by_age = [queued[1].id, queued[2].id, queued[0].id]
+
+    first = jobs.claim('worker-a', 2)
+    second = jobs.claim('worker-b', 5)
+
+    assert [job.id for job in first] == sorted(by_age[:2])
+    assert [job.id for job in second] == [by_age[2]]
+    assert jobs.claim('worker-c', 5) == []
+    claimed = _status(by_age[0])
+    assert (claimed.status, claimed.locked_by, claimed.attempts) == ('running', 'worker-a', 1)
+    assert _status(queued[3].id).status == 'queued'
+
+
+def test_failures_back_off_exponentially_then_give_up(app, handlers):
+    app.config.update(JOB_RETRY_DELAY=10, JOB_RETRY_MAX_DELAY=25, JOB_MAX_ATTEMPTS=3)
+    handlers('always_fails', lambda payload: 1 / 0)
+    job = jobs.enqueue('always_fails')
+    db.session.commit()
+    job_id = job.id
+
+    delays = []
+    for _ in range(3):
+        db.session.execute(db.update(Job).where(Job.id == job_id).values(run_at=datetime.utcnow()))
+        db.session.commit()
+        before = datetime.utcnow()
+        jobs.run_claimed(jobs.claim('worker', 10))
+        job = _status(job_id)
+        if job.status == 'queued':
+            delays.append(round((job.run_at - before).total_seconds()))
+
+    assert delays == [10, 20]
+    assert job.status == 'failed' and job.attempts == 3 and 'ZeroDivisionError' in job.last_error
+
+
+def test_batch_handlers_get_every_claimed_payload_at_once(app, handlers):
+    calls = []
+    handlers('batched', lambda payloads: calls.append(sorted(p['n'] for p in payloads)) or len(payloads),
+             batch=True)
+    for n in range(5):
+        jobs.enqueue('batched', n=n)
+    db.session.commit()
+
+    assert jobs.work(once=True) == 5
+
+    assert calls == [[0, 1, 2, 3, 4]]
+    assert {job.status for job in Job.query.filter_by(kind='batched')} == {'done'}
+
+
+def test_running_jobs_of_a_live_worker_are_not_requeued(app, handlers):
+    app.config.update(JOB_HEARTBEAT=0.05, JOB_LOCK_TIMEOUT=0.3)
+    recovered = []
+
+    def slow(payload):
+        time.sleep(0.8)
+        # Another worker's housekeeping, on its own session
+        with app.app_context():
+            recovered.append(jobs.recover_stale())
+
+    handlers('slow', slow)
+    job = jobs.enqueue('slow')
+    db.session.commit()
+    job_id = job.id
+
+    jobs.work(once=True)
+
+    assert recovered == [0]
+    assert _status(job_id).status == 'done'
+
+
+def test_jobs_of_a_dead_worker_are_requeued(app):
+    app.config['JOB_LOCK_TIMEOUT'] = 60
+    job = jobs.enqueue('noop')
+    db.session.commit()
+    job_id = job.id
+    jobs.claim('dead-worker', 1)
+    db.session.execute(db.update(Job).where(Job.id == job_id)
+                       .values(locked_at=datetime.utcnow() - timedelta(seconds=61)))
+    db.session.commit()
+
+    assert jobs.recover_stale() == 1
+    assert _status(job_id).status == 'queued'
+
+
+def test_prune_removes_spool_files_no_pending_job_needs(app, tmp_path):
+    app.config.update(JOB_SPOOL_DIR=str(tmp_path / 'spool'), JOB_LOCK_TIMEOUT=60)
+    directory = jobs._spool_dir()
+    os.makedirs(directory)
+    paths = {name: os.path.join(directory, f'{name}.csv') for name in ('failed', 'queued', 'orphan', 'fresh')}
+    for name, path in paths.items():
+        with open(path, 'w') as f:
+            f.write('username\n')
+        if name != 'fresh':
+            os.utime(path, (time.time() - 120, time.time() - 120))
+    for name, status in (('failed', 'failed'), ('queued', 'queued')):
+        db.session.add(Job(kind='import_records', status=status, run_at=datetime.utcnow(), max_attempts=1,
+                           payload=json.dumps({'records': 'patients', 'format': 'csv', 'path': paths[name]})))
+    db.session.commit()
+
+    jobs.prune()
+
+    assert sorted(name for name, path in paths.items() if os.path.exists(path)) == ['fresh', 'queued']
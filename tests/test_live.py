@@ -0,0 +1,83 @@
+import threading
+import time
+import urllib.request
+
+import pytest
+from flask import Flask
+from werkzeug.serving import make_server
+
+from model import db, User
+import config
+
+
+@pytest.mark.parametrize('worker_class, expected', [(None, False), ('sync', False), ('gthread', False),
+                                                    ('gevent', True), ('eventlet', True)])
+def test_live_updates_default_to_on_only_under_async_workers(monkeypatch, worker_class, expected):
+    monkeypatch.delenv('LIVE_UPDATES', raising=False)
+    if worker_class is None:
+        monkeypatch.delenv('GUNICORN_WORKER_CLASS', raising=False)
+    else:
+        monkeypatch.setenv('GUNICORN_WORKER_CLASS', worker_class)
+    app = Flask(__name__)
+    config.apply_config(app)
+    assert app.config['LIVE_UPDATES'] is expected
+
+
+def test_live_updates_can_be_forced_on(monkeypatch):
+    monkeypatch.setenv('GUNICORN_WORKER_CLASS', 'sync')
+    monkeypatch.setenv('LIVE_UPDATES', 'true')
+    app = Flask(__name__)
+    config.apply_config(app)
+    assert app.config['LIVE_UPDATES'] is True
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    # A threaded server like gunicorn's gthread or the dev server
+    monkeypatch.setenv('SQLALCHEMY_DATABASE_URI', f"sqlite:///{tmp_path / 'hms.db'}")
+    monkeypatch.setenv('SECRET_KEY', 'test')
+    monkeypatch.setenv('REQUEST_LOG', 'false')
+    monkeypatch.setenv('LIVE_UPDATES', 'true')
+    monkeypatch.setenv('LIVE_STREAM_SECONDS', '10')
+    monkeypatch.setenv('LIVE_POLL_INTERVAL', '30')
+    from app import create_app
+    import migrations
+    app = create_app()
+    with app.app_context():
+        migrations.init_db()
+        admin_id = User.query.filter_by(role='admin').one().id
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session.update(user_id=admin_id, role='admin')
+    cookie = f"session={client.get_cookie('session').value}"
+
+    http = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=http.serve_forever, daemon=True)
+    thread.start()
+
+    def get(path, timeout=5):
+        request = urllib.request.Request(f'http://127.0.0.1:{http.server_port}{path}', headers={'Cookie': cookie})
+        return urllib.request.urlopen(request, timeout=timeout)
+
+    yield app, get
+    http.shutdown()
+
+
+def test_an_open_event_stream_does_not_block_other_requests(server):
+    app, get = server
+    stream = get('/events')
+    try:
+        assert stream.headers['Content-Type'].startswith('text/event-stream')
+        assert stream.readline() == b'retry: 2000\n'
+        # The waiting stream holds no pooled connection
+        with app.app_context():
+            assert db.engine.pool.checkedout() == 0
+
+        started = time.monotonic()
+        with get('/admin-dashboard') as page:
+            assert page.status == 200
+        with get('/search-users/results?query=admin') as results:
+            assert results.status == 200
+        assert time.monotonic() - started < 2
+    finally:
+        stream.close()
@@ -0,0 +1,60 @@
+import os
+import sqlite3
+
+from sqlalchemy import inspect, text
+
+from model import db, DashboardStat, DoctorSchedule
+import diagnostics
+import migrations
+import stats
+
+
+BASELINE_SCHEMA = os.path.join(os.path.dirname(__file__), 'baseline_schema.sql')
+
+
+def _baseline_database(path):
+    connection = sqlite3.connect(path)
+    with open(BASELINE_SCHEMA) as schema:
+        connection.executescript(schema.read())
+    connection.executescript("""
+        INSERT INTO user VALUES (1, 'System Admin', 'admin', 'x', 'admin@hospital.com', 1, 'admin', NULL);
+        INSERT INTO user VALUES (2, 'Dr Ada', 'ada', 'x', 'ada@example.com', 1, 'doctor', NULL);
+        INSERT INTO user VALUES (3, 'Pat Lee', 'pat', 'x', 'pat@example.com', 1, 'patient', NULL);
+        INSERT INTO department VALUES (1, 'Cardiology', NULL);
+        INSERT INTO doctor VALUES (1, 2, 1, '555', 'L-1', 0);
+        INSERT INTO patient VALUES (1, 3, NULL, '0700', NULL, 0);
+        INSERT INTO doctor_schedule VALUES (1, 1, 'Tuesday', '09:00:00.000000', '12:00:00.000000');
+        INSERT INTO appointment VALUES (1, 1, 1, '2024-03-05 09:00:00.000000', '2024-03-05 09:30:00.000000', 'Completed');
+        INSERT INTO appointment VALUES (2, 1, 1, '2024-03-12 09:00:00.000000', '2024-03-12 09:30:00.000000', 'Booked');
+        INSERT INTO treatment VALUES (1, 1, 'Flu', 'Rest', NULL, 1);
+    """)
+    connection.commit()
+    connection.close()
+
+
+def test_baseline_database_upgrades_to_head(tmp_path, monkeypatch):
+    path = tmp_path / 'baseline.db'
+    _baseline_database(str(path))
+    monkeypatch.setenv('SQLALCHEMY_DATABASE_URI', f'sqlite:///{path}')
+    monkeypatch.setenv('SECRET_KEY', 'test')
+    monkeypatch.setenv('REQUEST_LOG', 'false')
+    from app import create_app
+    app = create_app()
+
+    with app.app_context():
+        applied, seeded = migrations.init_db()
+
+        assert applied == [version for version, _, _ in migrations.MIGRATIONS]
+        assert not seeded
+        assert migrations.current_version() == migrations.MIGRATIONS[-1][0]
+        assert 'day_of_week' not in {column['name'] for column in inspect(db.engine).get_columns('doctor_schedule')}
+        assert DoctorSchedule.query.one().weekday == 1
+        counters = dict(db.session.query(DashboardStat.key, DashboardStat.value))
+        assert counters['doctors'] == 1 and counters['patients'] == 1 and counters['appointments'] == 2
+        assert stats.reconcile()[1] == {}
+        assert diagnostics.table_scans() == []
+        for table in ('appointment', 'treatment', 'prescription_item'):
+            ddl = db.session.execute(text("SELECT sql FROM sqlite_master WHERE name = :name"),
+                                     {'name': table}).scalar()
+            assert 'AUTOINCREMENT' in ddl
+        assert db.session.execute(text("SELECT seq FROM sqlite_sequence WHERE name = 'appointment'")).scalar() == 2
@@ -0,0 +1,66 @@
+import base64
+import json
+from datetime import datetime
+
+import pytest
+
+from model import db, Appointment
+from pagination import decode_cursor, encode_cursor
+import dashboard
+
+
+def _raw_cursor(payload):
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+
+
+@pytest.mark.parametrize('payload', [
+    [{'dt': 1}, 1],
+    [{'dt': 'x'}, 1],
+    [{'d': '2024-01-01', 't': '09:00'}, 1],
+    [{'other': 'x'}, 1],
+    [[1], 1],
+    {'dt': '2024-01-01T09:00:00'},
+])
+def test_tampered_cursors_decode_to_nothing(payload):
+    assert decode_cursor(_raw_cursor(payload)) is None
+
+
+def test_garbage_cursors_decode_to_nothing():
+    assert decode_cursor('not base64 at all!') is None
+    assert decode_cursor(base64.urlsafe_b64encode(b'\xff\xfe').decode()) is None
+
+
+def test_cursor_round_trips():
+    values = [datetime(2024, 1, 1, 9, 30), 7]
+    assert decode_cursor(encode_cursor(values)) == values
+
+
+def test_malformed_cursors_serve_the_first_page(app, hospital):
+    hospital(doctors=2, patients=3, appointments=12)
+    first, _ = dashboard.appointment_page(limit=5)
+    for cursor in [_raw_cursor([{'dt': 1}, 1]), _raw_cursor(['x', 1]), _raw_cursor([None, 1]),
+                   _raw_cursor([1]), 'garbage']:
+        rows, _ = dashboard.appointment_page(cursor, limit=5)
+        assert [row[0].id for row in rows] == [row[0].id for row in first]
+    rows, _ = dashboard.doctor_page(_raw_cursor(['1']), limit=1)
+    assert [row[1].id for row in rows] == [row[1].id for row in dashboard.doctor_page(limit=1)[0]]
+
+
+def test_pages_walk_through_tied_sort_keys_without_gaps_or_repeats(app, hospital):
+    # One appointment per doctor, so equal start times stay unique per doctor
+    created = hospital(doctors=13, patients=3, appointments=13)
+    # Three distinct start times, so every page boundary falls inside a tie
+    moments = [datetime(2024, 1, 1, 9), datetime(2024, 1, 2, 9), datetime(2024, 1, 3, 9)]
+    for i, appointment in enumerate(Appointment.query.order_by(Appointment.id)):
+        appointment.start_time = moments[i % 3]
+    db.session.commit()
+
+    seen, cursor = [], None
+    while True:
+        rows, cursor = dashboard.appointment_page(cursor, limit=4)
+        seen.extend((row[0].start_time, row[0].id) for row in rows)
+        if cursor is None:
+            break
+
+    assert sorted(id for _, id in seen) == sorted(created['appointments'])
+    assert seen == sorted(seen, reverse=True)
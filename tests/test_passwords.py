@@ -0,0 +1,108 @@
+import pytest
+from werkzeug.security import generate_password_hash
+
+from model import db, User
+import passwords
+
+
+@pytest.fixture(autouse=True)
+def no_failures():
+    passwords._failures.clear()
+    yield
+    passwords._failures.clear()
+
+
+@pytest.fixture
+def account(app):
+    app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+    user = User(full_name='Pat', username='pat', email='pat@example.com', role='patient',
+                password_hash=passwords.hash_password('right'))
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def _fail(username, remote_addr, times=1):
+    for _ in range(times):
+        assert passwords.authenticate(username, 'wrong', remote_addr) is None
+
+
+def test_a_username_is_throttled_after_its_own_limit(app, account):
+    app.config['LOGIN_MAX_ATTEMPTS'] = 3
+    _fail('pat', '10.0.0.1', 3)
+
+    with pytest.raises(passwords.LoginThrottled):
+        passwords.authenticate('pat', 'right', '10.0.0.2')
+    # Other accounts behind the same address are unaffected
+    assert not passwords.is_throttled('someone', '10.0.0.1')
+
+
+def test_an_address_has_its_own_higher_limit(app, account):
+    app.config['LOGIN_MAX_ATTEMPTS'] = 3
+    app.config['LOGIN_MAX_ATTEMPTS_PER_ADDR'] = 6
+    for i in range(5):
+        _fail(f'guess{i}', '10.0.0.1')
+    assert not passwords.is_throttled('pat', '10.0.0.1')
+
+    _fail('guess5', '10.0.0.1')
+
+    with pytest.raises(passwords.LoginThrottled):
+        passwords.authenticate('pat', 'right', '10.0.0.1')
+    assert passwords.authenticate('pat', 'right', '10.0.0.2') is not None
+
+
+def test_a_successful_login_clears_only_that_users_failures(app, account):
+    app.config['LOGIN_MAX_ATTEMPTS'] = 3
+    app.config['LOGIN_MAX_ATTEMPTS_PER_ADDR'] = 5
+    _fail('pat', '10.0.0.1', 2)
+    _fail('guess', '10.0.0.1', 2)
+
+    assert passwords.authenticate('pat', 'right', '10.0.0.1') is not None
+
+    # The address still holds the two failures for 'guess'
+    _fail('x1', '10.0.0.1')
+    _fail('x2', '10.0.0.1')
+    assert not passwords.is_throttled('other', '10.0.0.1')
+    _fail('x3', '10.0.0.1')
+    assert passwords.is_throttled('other', '10.0.0.1')
+
+
+def test_unknown_usernames_still_verify_a_hash(app, account, monkeypatch):
+    checked = []
+    check = passwords.check_password_hash
+    monkeypatch.setattr(passwords, 'check_password_hash',
+                        lambda password_hash, password: checked.append(password_hash) or check(password_hash, password))
+
+    assert passwords.authenticate('nobody', 'right', '10.0.0.1') is None
+    assert passwords.authenticate('pat', 'wrong', '10.0.0.1') is None
+
+    assert len(checked) == 2
+    assert checked[0].split('$', 1)[0] == checked[1].split('$', 1)[0]
+
+
+def test_outdated_hashes_are_upgraded_off_the_login_request(app, account):
+    old_hash = generate_password_hash('right', method='pbkdf2:sha256:2000')
+    account.password_hash = old_hash
+    db.session.commit()
+    user_id = account.id
+
+    user = passwords.authenticate('pat', 'right', '10.0.0.1')
+    assert user is not None and user.password_hash == old_hash
+    # The rehash pool has one thread, so this waits for the rehash
+    passwords._get_rehash_pool().submit(lambda: None).result()
+
+    db.session.expire_all()
+    upgraded = db.session.get(User, user_id).password_hash
+    assert upgraded.startswith('pbkdf2:sha256:1000$')
+    assert passwords.authenticate('pat', 'right', '10.0.0.1').id == user_id
+
+
+def test_a_rehash_never_overwrites_a_newer_password(app, account):
+    verified = generate_password_hash('right', method='pbkdf2:sha256:2000')
+    # The password changed after the login verified `verified`
+    changed = account.password_hash
+
+    passwords._rehash(app, None, account.id, verified, 'right')
+
+    db.session.expire_all()
+    assert db.session.get(User, account.id).password_hash == changed
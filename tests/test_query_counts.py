@@ -0,0 +1,26 @@
+from datetime import datetime, timedelta
+
+import archive
+import diagnostics
+
+
+def _assert_within_budget():
+    counts = diagnostics.history_query_counts()
+    assert counts
+    for appointments, statements in counts.values():
+        assert statements <= diagnostics.HISTORY_QUERY_BUDGET
+
+
+def test_history_stays_within_the_query_budget(app, hospital):
+    # One patient with a long, treated history and upcoming visits, one
+    # with a single visit: the count must not grow with the history
+    hospital(doctors=2, patients=1, appointments=60, treated=40, upcoming=5)
+    (appointments, _), = diagnostics.history_query_counts().values()
+    assert appointments == 65
+    _assert_within_budget()
+
+
+def test_history_reaching_the_archive_stays_within_the_query_budget(app, hospital):
+    hospital(doctors=2, patients=2, appointments=60, treated=60, upcoming=4)
+    assert archive.archive(before=datetime.now() - timedelta(days=5)) > 0
+    _assert_within_budget()
@@ -0,0 +1,15 @@
+import diagnostics
+
+
+def test_dashboard_queries_are_index_backed_on_a_fresh_database(app):
+    assert diagnostics.table_scans() == []
+
+
+def test_dashboard_queries_are_index_backed_with_data(app, hospital):
+    hospital(doctors=4, patients=10, appointments=60, treated=10)
+    assert diagnostics.table_scans() == []
+
+
+def test_paged_dashboard_queries_are_checked(app):
+    names = {name for name, _ in diagnostics._dashboard_queries()}
+    assert {'doctor page', 'schedule first page', 'schedule page', 'appointment page'} <= names
@@ -0,0 +1,101 @@
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from model import db, User, Doctor, Patient, DoctorSchedule, ScheduleException, Appointment, Treatment, \
+    PrescriptionItem, ArchivedAppointment, ArchivedTreatment, ArchivedPrescriptionItem
+import archive
+import removal
+import stats
+
+
+def _counts():
+    return {model.__tablename__: model.query.count()
+            for model in (User, Doctor, Patient, DoctorSchedule, ScheduleException, Appointment, Treatment,
+                          PrescriptionItem, ArchivedAppointment, ArchivedTreatment, ArchivedPrescriptionItem)}
+
+
+def _stored_counters():
+    return stats.current_values()
+
+
+# Removal is set-based, so its cost must not grow with the doctor's
+# history: the same bounds hold for 1000 appointments and for 25000
+REMOVAL_STATEMENT_BUDGET = 25
+REMOVAL_PEAK_BYTES = 2 * 1024 * 1024
+
+
+@pytest.mark.parametrize('appointments, treated', [
+    (2000, 600),
+    pytest.param(50000, 15000, marks=pytest.mark.slow),
+])
+def test_removing_a_busy_doctor_cascades_and_keeps_counters_exact(app, hospital, appointments, treated):
+    created = hospital(doctors=2, patients=10, appointments=appointments, treated=treated)
+    busy = db.session.get(Doctor, created['doctors'][0])
+    db.session.add(ScheduleException(doctor_id=busy.id, start_date=date.today(), end_date=date.today()))
+    db.session.commit()
+    # The oldest sixth or so of the history (six appointments a day) lives
+    # in the archive tables
+    assert archive.archive(before=datetime.now() - timedelta(days=int(appointments / 6 * 0.84))) > 0
+    stats.reconcile()
+
+    before = _counts()
+    own = {
+        'appointment': Appointment.query.filter_by(doctor_id=busy.id).count(),
+        'archived_appointment': ArchivedAppointment.query.filter_by(doctor_id=busy.id).count(),
+        'treatment': Treatment.query.filter_by(created_by_doctor_id=busy.id).count(),
+        'archived_treatment': ArchivedTreatment.query.filter_by(created_by_doctor_id=busy.id).count(),
+        'prescription_item': PrescriptionItem.query.join(Treatment)
+        .filter(Treatment.created_by_doctor_id == busy.id).count(),
+        'archived_prescription_item': ArchivedPrescriptionItem.query.join(ArchivedTreatment)
+        .filter(ArchivedTreatment.created_by_doctor_id == busy.id).count(),
+    }
+    assert own['appointment'] + own['archived_appointment'] == appointments // 2
+    assert own['treatment'] and own['archived_treatment']
+    user_id = busy.user_id
+    db.session.expunge_all()
+
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    tracemalloc.start()
+    try:
+        assert removal.remove_users([user_id]) == [user_id]
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    assert len(statements) <= REMOVAL_STATEMENT_BUDGET
+    assert peak <= REMOVAL_PEAK_BYTES
+
+    after = _counts()
+    assert after['user'] == before['user'] - 1
+    assert after['doctor'] == before['doctor'] - 1
+    assert after['patient'] == before['patient']
+    assert after['doctor_schedule'] == before['doctor_schedule'] - 5
+    assert after['schedule_exception'] == before['schedule_exception'] - 1
+    for table, count in own.items():
+        assert after[table] == before[table] - count, table
+    # The counters were adjusted in step with the cascade: no drift
+    actual = stats.actual_counts()
+    stored = _stored_counters()
+    assert {key: stored.get(key, 0) for key in actual} == actual
+
+
+def test_orm_delete_of_a_patient_leaves_the_children_to_the_database(app, hospital):
+    created = hospital(doctors=2, patients=3, appointments=30, treated=10)
+    patient = db.session.get(Patient, created['patients'][0])
+    appointment_ids = [id_ for (id_,) in db.session.query(Appointment.id).filter_by(patient_id=patient.id)]
+    user = patient.user
+    db.session.expunge_all()
+    user = db.session.get(User, user.id)
+
+    db.session.delete(user)
+    db.session.commit()
+
+    assert db.session.get(Patient, patient.id) is None
+    assert Appointment.query.filter(Appointment.id.in_(appointment_ids)).count() == 0
+    assert Treatment.query.filter(Treatment.appointment_id.in_(appointment_ids)).count() == 0
+    assert PrescriptionItem.query.join(Treatment).filter(Treatment.appointment_id.in_(appointment_ids)).count() == 0
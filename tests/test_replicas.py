@@ -0,0 +1,107 @@
+import sqlite3
+import time
+
+import pytest
+
+from model import db, User, Patient
+import replicas
+
+
+@pytest.fixture
+def replica(tmp_path, monkeypatch):
+    # A primary and one read-only SQLite replica copied from it like
+    # `flask sync-replica`; lag is re-checked on every request
+    primary_path, replica_path = str(tmp_path / 'hms.db'), str(tmp_path / 'replica.db')
+    monkeypatch.setenv('SQLALCHEMY_DATABASE_URI', f'sqlite:///{primary_path}')
+    monkeypatch.setenv('DATABASE_REPLICA_URIS', f'sqlite:///file:{replica_path}?mode=ro&uri=true')
+    monkeypatch.setenv('REPLICA_LAG_CHECK_INTERVAL', '0')
+    monkeypatch.setenv('REPLICA_MAX_LAG', '5')
+    monkeypatch.setenv('SECRET_KEY', 'test')
+    monkeypatch.setenv('REQUEST_LOG', 'false')
+    from app import create_app
+    import migrations
+    app = create_app()
+    with app.app_context():
+        migrations.init_db()
+        admin_id = User.query.filter_by(role='admin').one().id
+
+    def sync():
+        # Copies a fresh heartbeat along with the data
+        with app.app_context():
+            app.extensions['replicas'].check()
+        replicas.sync_sqlite_replica(primary_path, replica_path)
+
+    def lag_behind(seconds):
+        # The replica stopped replicating `seconds` ago
+        with sqlite3.connect(replica_path) as connection:
+            connection.execute(f'UPDATE {replicas.HEARTBEAT_TABLE} SET beat_at = ?', (time.time() - seconds,))
+
+    def client():
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session.update(user_id=admin_id, role='admin')
+        return client
+
+    sync()
+    # Requests run with no app context pushed, as they do when served
+    return app, sync, lag_behind, client, replica_path
+
+
+def _add_patient(app, name):
+    with app.app_context():
+        user = User(full_name=name, username=name.lower().replace(' ', ''), email=f'{name}@example.com',
+                    password_hash='x', role='patient')
+        db.session.add(user)
+        db.session.flush()
+        db.session.add(Patient(user_id=user.id, contact_number='0700'))
+        db.session.commit()
+        return user.id
+
+
+def _sees(client, name):
+    return name.encode() in client.get(f'/search-users/results?query={name}').data
+
+
+def test_marked_views_read_from_a_fresh_replica(replica):
+    app, sync, lag_behind, client, _ = replica
+    _add_patient(app, 'Quill Unsynced')
+
+    assert not _sees(client(), 'Quill Unsynced')
+    sync()
+    assert _sees(client(), 'Quill Unsynced')
+
+
+def test_a_lagging_replica_falls_back_to_the_primary(replica):
+    app, sync, lag_behind, client, _ = replica
+    _add_patient(app, 'Quill Lagging')
+    lag_behind(6)
+
+    assert _sees(client(), 'Quill Lagging')
+    status = app.extensions['replicas'].status()[0]
+    assert status['lag_seconds'] > 5 and status['error'] is None
+
+    lag_behind(3)
+    assert not _sees(client(), 'Quill Lagging')
+
+
+def test_an_unreadable_replica_falls_back_to_the_primary(replica):
+    app, sync, lag_behind, client, replica_path = replica
+    _add_patient(app, 'Quill Missing')
+    with open(replica_path, 'wb') as f:
+        f.write(b'not a database')
+
+    assert _sees(client(), 'Quill Missing')
+    assert app.extensions['replicas'].status()[0]['error']
+
+
+def test_a_session_reads_its_own_writes_from_the_primary(replica):
+    app, sync, lag_behind, client, _ = replica
+    admin = client()
+    user_id = _add_patient(app, 'Quill Sticky')
+
+    # Any write through the app, here a blacklisting
+    response = admin.post('/admin/batch/blacklist', data={'user_ids': str(user_id), 'action': 'blacklist'})
+    assert response.status_code < 400
+
+    assert _sees(admin, 'Quill Sticky')
+    assert not _sees(client(), 'Quill Sticky')
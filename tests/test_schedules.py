@@ -0,0 +1,115 @@
+import random
+from collections import namedtuple
+from datetime import date, datetime, time, timedelta
+
+import pytest
+
+from model import db, DoctorSchedule, ScheduleException
+import schedules
+
+Row = namedtuple('Row', 'doctor_id weekday start_time end_time effective_from effective_to')
+Leave = namedtuple('Leave', 'doctor_id start_date end_date')
+
+MONDAY = date(2026, 1, 5)
+
+
+def _naive_slots(rows, exceptions, start_date, days, minutes):
+    # Walks every day and every slot; what expand() must agree with
+    slots = {}
+    for day in (start_date + timedelta(days=n) for n in range(days)):
+        for row in rows:
+            if row.weekday != day.weekday() \
+                    or (row.effective_from and day < row.effective_from) \
+                    or (row.effective_to and day > row.effective_to) \
+                    or any(e.doctor_id in (None, row.doctor_id) and e.start_date <= day <= e.end_date
+                           for e in exceptions):
+                continue
+            begins = datetime.combine(day, row.start_time)
+            while begins + timedelta(minutes=minutes) <= datetime.combine(day, row.end_time):
+                slots.setdefault(row.doctor_id, []).append((begins, begins + timedelta(minutes=minutes)))
+                begins += timedelta(minutes=minutes)
+    return {doctor_id: sorted(intervals) for doctor_id, intervals in slots.items()}
+
+
+def _random_windows(rng, doctor_id):
+    # Non-overlapping windows: at most a morning and an afternoon per weekday
+    rows = []
+    for weekday in range(7):
+        for first_hour, last_hour in ((7, 12), (13, 19)):
+            if rng.random() < 0.5:
+                continue
+            start = rng.randrange(first_hour * 60, last_hour * 60 - 20, 5)
+            end = rng.randrange(start + 20, last_hour * 60 + 1, 5)
+            effective_from = MONDAY + timedelta(days=rng.randrange(-10, 30)) if rng.random() < 0.3 else None
+            effective_to = MONDAY + timedelta(days=rng.randrange(30, 60)) if rng.random() < 0.3 else None
+            rows.append(Row(doctor_id, weekday, time(start // 60, start % 60), time(end // 60, end % 60),
+                            effective_from, effective_to))
+    return rows
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_expansion_matches_a_day_by_day_walk(app, seed):
+    rng = random.Random(seed)
+    rows = [row for doctor_id in range(1, 6) for row in _random_windows(rng, doctor_id)]
+    exceptions = [Leave(rng.choice([None, 1, 2, 3, 4, 5]),
+                        *sorted(MONDAY + timedelta(days=rng.randrange(-5, 50)) for _ in range(2)))
+                  for _ in range(6)]
+
+    for minutes in (15, 30):
+        grid = schedules.expand(rows, exceptions, MONDAY, 42, minutes)
+        expected = _naive_slots(rows, exceptions, MONDAY, 42, minutes)
+        for doctor_id in range(1, 6):
+            assert grid.intervals(doctor_id) == expected.get(doctor_id, []), (seed, minutes, doctor_id)
+            assert sum(grid.daily_counts(doctor_id)) == len(expected.get(doctor_id, []))
+
+
+def test_leave_and_holidays_block_whole_days(app, hospital):
+    created = hospital(doctors=2, patients=1, appointments=0)
+    on_leave, other = created['doctors']
+    db.session.add_all([
+        ScheduleException(doctor_id=on_leave, start_date=MONDAY, end_date=MONDAY + timedelta(days=1)),
+        ScheduleException(doctor_id=None, start_date=MONDAY + timedelta(days=3),
+                          end_date=MONDAY + timedelta(days=3), reason='Holiday'),
+    ])
+    db.session.commit()
+
+    grid = schedules.load_grid(MONDAY, 7, minutes=30)
+
+    assert grid.daily_counts(on_leave) == [0, 0, 6, 0, 6, 0, 0]
+    assert grid.daily_counts(other) == [6, 6, 6, 0, 6, 0, 0]
+    assert not grid.has_slot(on_leave, datetime.combine(MONDAY, time(9)))
+    assert grid.has_slot(other, datetime.combine(MONDAY, time(9)))
+    assert not grid.has_slot(other, datetime.combine(MONDAY, time(9, 15)))
+    assert not grid.has_slot(other, datetime.combine(MONDAY, time(12)))
+
+
+def test_overlapping_windows_are_rejected(app, hospital):
+    created = hospital(doctors=1, patients=1, appointments=0)
+    doctor_id = created['doctors'][0]
+    # The fixture gives every doctor 09:00-12:00 on weekdays
+    existing = DoctorSchedule.query.filter_by(doctor_id=doctor_id, weekday=0).one()
+    window = lambda weekday, start, end, effective_from=None, effective_to=None: \
+        schedules.Window(weekday, time(*start), time(*end), effective_from, effective_to)
+
+    with pytest.raises(schedules.ScheduleError, match='Overlaps the existing Monday window 09:00-12:00'):
+        schedules.validate_window(doctor_id, window(0, (11, 30), (13, 0)))
+    # Touching, another day, or the window being edited itself
+    schedules.validate_window(doctor_id, window(0, (12, 0), (14, 0)))
+    schedules.validate_window(doctor_id, window(5, (9, 0), (12, 0)))
+    schedules.validate_window(doctor_id, window(0, (8, 0), (12, 0)), exclude_id=existing.id)
+
+    existing.effective_to = MONDAY
+    db.session.commit()
+    schedules.validate_window(doctor_id, window(0, (9, 0), (12, 0), effective_from=MONDAY + timedelta(days=1)))
+    with pytest.raises(schedules.ScheduleError):
+        schedules.validate_window(doctor_id, window(0, (9, 0), (12, 0), effective_to=MONDAY))
+
+
+@pytest.mark.parametrize('start, end, effective_from, effective_to', [
+    ((12, 0), (9, 0), None, None),
+    ((9, 0), (9, 0), None, None),
+    ((9, 0), (12, 0), MONDAY, MONDAY - timedelta(days=1)),
+])
+def test_malformed_windows_are_rejected(start, end, effective_from, effective_to):
+    with pytest.raises(schedules.ScheduleError):
+        schedules.check_window(schedules.Window(0, time(*start), time(*end), effective_from, effective_to))
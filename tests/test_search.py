@@ -0,0 +1,70 @@
+import pytest
+from sqlalchemy import or_
+
+from model import db, User, Doctor, Department, Patient
+import search
+import search_index
+
+
+def test_exact_patient_id_comes_first_even_when_the_index_also_matches_it(app, hospital):
+    created = hospital(doctors=1, patients=20, appointments=0)
+    target = created['patients'][16]
+    # Every contact number contains the target's id, so the index returns
+    # the target among many other matches
+    term = f'{target:03d}'
+    for patient in Patient.query.all():
+        patient.contact_number = f'07{patient.id}{term}'
+    db.session.commit()
+
+    rows = search.search_patients(term)
+
+    assert rows[0][1].id == target
+    assert len({row[1].id for row in rows}) == len(rows)
+
+
+# --- Same rows as the original unbounded LIKE search ---
+
+def _baseline_doctors(term):
+    like = f'%{term}%'
+    return {user.id for user, _, _ in db.session.query(User, Doctor, Department)
+            .join(Doctor, User.id == Doctor.user_id)
+            .join(Department, Doctor.specialization_id == Department.id)
+            .filter(or_(User.full_name.ilike(like), Department.name.ilike(like)))}
+
+
+def _baseline_patients(term):
+    like = f'%{term}%'
+    patient_id = int(term) if term.isdigit() else None
+    return {user.id for user, _ in db.session.query(User, Patient)
+            .join(Patient, User.id == Patient.user_id)
+            .filter(User.role == 'patient',
+                    or_(User.full_name.ilike(like), Patient.contact_number.ilike(like),
+                        (Patient.id == patient_id) if patient_id is not None else False))}
+
+
+@pytest.mark.parametrize('backend', ['fts5', 'like'])
+def test_search_finds_the_rows_the_like_search_found(app, hospital, monkeypatch, backend):
+    if backend == 'like':
+        monkeypatch.setitem(app.extensions, 'search_index', search_index.LikeBackend())
+    hospital(doctors=6, patients=40, appointments=0)
+    names = ['Anna Smith', 'Hannah Smithers', 'Jo Annson', 'Dianne Blacksmith', 'Ann', 'Joanna Smyth']
+    for user, name in zip(User.query.filter_by(role='patient').order_by(User.id), names):
+        user.full_name = name
+    doctor_names = ['Susan Ng', 'Ngozi Annan', 'Tom Smith']
+    for user, name in zip(User.query.filter_by(role='doctor').order_by(User.id), doctor_names):
+        user.full_name = name
+    Doctor.query.order_by(Doctor.id.desc()).first().specialization = Department(name='Cardiology')
+    db.session.commit()
+    limit = 10
+
+    for term in ['ann', 'Ann', 'smith', 'SMITH', 'ng', 'an', 'card', 'general', 'patient 1', 'Patient',
+                 '07', '007', '3', 'zzz']:
+        for found, baseline in ((search.search_doctors(term, limit), _baseline_doctors(term)),
+                                (search.search_patients(term, limit), _baseline_patients(term))):
+            ids = [row[0].id for row in found]
+            assert len(ids) == len(set(ids)), term
+            if len(baseline) <= limit:
+                # Every LIKE match, ahead of any fuzzy (typo) matches
+                assert set(ids[:len(baseline)]) == baseline, term
+            else:
+                assert len(ids) == limit and set(ids) <= baseline, term
@@ -0,0 +1,64 @@
+from datetime import date
+
+from sqlalchemy import event
+
+from model import db, User, DashboardStat, DashboardStatDelta
+import booking
+import jobs
+import stats
+
+
+def _statements(app):
+    seen = []
+    listener = lambda conn, cursor, statement, *args: seen.append(statement.lstrip().upper())
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    return seen, lambda: event.remove(db.engine, 'before_cursor_execute', listener)
+
+
+def test_bookings_append_deltas_instead_of_updating_the_counters(app, hospital):
+    created = hospital(doctors=1, patients=1, appointments=0)
+    doctor_id = created['doctors'][0]
+    user = User.query.filter_by(username='patient0').one()
+    start, _ = booking.available_slots(doctor_id, date.today(), 7)[0]
+
+    seen, stop = _statements(app)
+    try:
+        booking.book_appointment(user, doctor_id, start)
+    finally:
+        stop()
+
+    assert not [statement for statement in seen if statement.startswith('UPDATE DASHBOARD_STAT')]
+    assert DashboardStatDelta.query.count() == 2
+    assert stats.snapshot()['total_appointments'] == 1
+    assert stats.snapshot()['appointments_by_status']['Booked'] == 1
+
+
+def test_the_worker_folds_deltas_into_the_counters(app, hospital):
+    hospital(doctors=1, patients=1, appointments=0)
+    stats.bump('appointments', 3)
+    stats.bump(stats.status_key('Booked'), 3)
+    stats.bump(stats.status_key('Booked'), -1)
+    stats.bump(stats.status_key('Canceled'))
+    db.session.commit()
+    before = stats.snapshot()
+
+    jobs.work(once=True)
+
+    assert DashboardStatDelta.query.count() == 0
+    assert stats.snapshot() == before
+    stored = dict(db.session.query(DashboardStat.key, DashboardStat.value))
+    assert stored['appointments'] == 3 and stored[stats.status_key('Booked')] == 2
+
+
+def test_reading_the_counters_never_writes(app):
+    db.session.query(DashboardStat).delete()
+    db.session.commit()
+
+    seen, stop = _statements(app)
+    try:
+        assert stats.snapshot()['total_appointments'] == 0
+    finally:
+        stop()
+
+    assert all(statement.startswith('SELECT') for statement in seen)
+    assert DashboardStat.query.count() == 0
@@ -0,0 +1,102 @@
+import pytest
+
+from model import db, User, Patient, TenantLogin
+import tenants
+
+
+@pytest.fixture
+def hospitals(tmp_path, monkeypatch):
+    # Two hospitals, north and south, each with its own database, plus the
+    # directory database, initialised like `flask init-tenants`
+    monkeypatch.setenv('SQLALCHEMY_DATABASE_URI', f"sqlite:///{tmp_path / 'directory.db'}")
+    monkeypatch.setenv('TENANTS', 'north,south')
+    monkeypatch.setenv('TENANT_DATABASE_URI', f"sqlite:///{tmp_path}/{{tenant}}.db")
+    monkeypatch.setenv('SECRET_KEY', 'test')
+    monkeypatch.setenv('REQUEST_LOG', 'false')
+    from app import create_app
+    app = create_app()
+    result = app.test_cli_runner().invoke(args=['init-tenants'])
+    assert result.exit_code == 0, result.output
+    # Requests run with no app context pushed, as they do when served
+    return app
+
+
+def _directory():
+    with db.engine.connect() as directory:
+        return sorted(directory.execute(db.select(TenantLogin.tenant, TenantLogin.username)).all())
+
+
+def _add_user(username):
+    user = User(full_name=username.title(), username=username, email=f'{username}@example.com',
+                password_hash='x', role='patient')
+    db.session.add(user)
+    db.session.flush()
+    return user
+
+
+def _add_patient(app, tenant, username):
+    with app.app_context(), tenants.use(tenant):
+        db.session.add(Patient(user_id=_add_user(username).id, contact_number='0700'))
+        db.session.commit()
+
+
+def _admin(app, tenant):
+    client = app.test_client()
+    response = client.post('/doctor-admin-login', data={'username': 'admin', 'password': 'admin123'},
+                           headers={'X-Hospital': tenant})
+    assert response.status_code == 302
+    return client
+
+
+def test_directory_rows_are_written_only_once_the_hospital_commits(hospitals):
+    with hospitals.app_context():
+        with tenants.use('north'):
+            _add_user('nora')
+            assert ('north', 'nora') not in _directory()
+            db.session.commit()
+        assert ('north', 'nora') in _directory()
+
+
+def test_a_rolled_back_user_leaves_no_directory_row(hospitals):
+    with hospitals.app_context():
+        with tenants.use('north'):
+            _add_user('ghost')
+            db.session.rollback()
+            assert User.query.filter_by(username='ghost').count() == 0
+
+        assert ('north', 'ghost') not in _directory()
+
+
+def test_a_hospital_never_sees_another_hospitals_rows(hospitals):
+    _add_patient(hospitals, 'north', 'nora')
+    _add_patient(hospitals, 'south', 'sam')
+    north, south = _admin(hospitals, 'north'), _admin(hospitals, 'south')
+
+    for client, own, other in ((north, 'Nora', 'Sam'), (south, 'Sam', 'Nora')):
+        # The signed-in session picks the hospital, with or without the header
+        for headers in ({}, {'X-Hospital': 'north' if client is north else 'south'}):
+            page = client.get(f'/search-users/results?query={own}', headers=headers)
+            assert own.encode() in page.data
+            page = client.get(f'/search-users/results?query={other}', headers=headers)
+            assert page.status_code == 200 and other.encode() not in page.data
+
+    with hospitals.app_context():
+        for tenant, username in (('north', 'nora'), ('south', 'sam')):
+            with tenants.use(tenant):
+                assert [user.username for user in User.query.filter_by(role='patient')] == [username]
+        assert ('north', 'nora') in _directory() and ('south', 'sam') in _directory()
+
+
+def test_a_session_is_not_honoured_at_another_hospital(hospitals):
+    _add_patient(hospitals, 'north', 'nora')
+    south = _admin(hospitals, 'south')
+
+    page = south.get('/search-users/results?query=Nora', headers={'X-Hospital': 'north'})
+
+    assert page.status_code == 302 and b'Nora' not in page.data
+    # The session was signed out rather than carried over
+    assert south.get('/search-users/results?query=Sam').status_code == 302
+
+
+def test_unknown_hospitals_are_not_found(hospitals):
+    assert hospitals.test_client().get('/', headers={'X-Hospital': 'east'}).status_code == 404
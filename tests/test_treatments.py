@@ -0,0 +1,71 @@
+from datetime import datetime
+
+import pytest
+from werkzeug.datastructures import MultiDict
+
+from model import db, Doctor, Appointment, PrescriptionItem
+import stats
+import treatments
+
+
+def _form(*rows):
+    return MultiDict([(field, value) for row in rows
+                      for field, value in zip(('drug', 'dose', 'frequency', 'duration_days'), row)])
+
+
+def test_prescription_rows_are_parsed_and_blank_rows_skipped():
+    items = treatments.parse_items(_form(('Amoxicillin', '500mg', 'tds', '7'), ('', '', '', ''),
+                                         ('Paracetamol', '1g', 'prn', '')))
+
+    assert items == [
+        {'drug': 'Amoxicillin', 'dose': '500mg', 'frequency': 'tds', 'duration_days': 7},
+        {'drug': 'Paracetamol', 'dose': '1g', 'frequency': 'prn', 'duration_days': None},
+    ]
+    assert treatments.prescription_summary(items) == 'Amoxicillin 500mg tds for 7 days; Paracetamol 1g prn'
+
+
+@pytest.mark.parametrize('row', [('Amoxicillin', '', 'tds', '7'), ('Amoxicillin', '500mg', 'tds', 'week')])
+def test_incomplete_prescription_rows_are_rejected(row):
+    with pytest.raises(treatments.TreatmentError):
+        treatments.parse_items(_form(row))
+
+
+def test_saving_a_treatment_completes_the_appointment_and_replaces_its_items(app, hospital):
+    created = hospital(doctors=1, patients=1, appointments=1)
+    doctor = Doctor.query.one()
+    appointment = treatments.appointment_for_doctor(doctor, created['appointments'][0])
+    first = treatments.parse_items(_form(('Amoxicillin', '500mg', 'tds', '7'), ('Paracetamol', '1g', 'prn', '')))
+
+    treatments.save_treatment(doctor, appointment, 'Chest infection', '', first)
+    treatments.save_treatment(doctor, appointment, 'Chest infection', 'Review in a week', first[:1])
+
+    db.session.expire_all()
+    appointment = db.session.get(Appointment, created['appointments'][0])
+    assert appointment.status == 'Completed'
+    assert appointment.treatment_record.notes == 'Review in a week'
+    assert [(item.drug, item.prescribed_at) for item in PrescriptionItem.query] == \
+        [('Amoxicillin', appointment.start_time)]
+    counts = stats.snapshot()['appointments_by_status']
+    assert (counts['Booked'], counts['Completed']) == (0, 1)
+
+
+def test_only_the_appointments_doctor_can_record_a_treatment(app, hospital):
+    created = hospital(doctors=2, patients=1, appointments=1)
+    other = db.session.get(Doctor, created['doctors'][1])
+
+    with pytest.raises(treatments.TreatmentError):
+        treatments.appointment_for_doctor(other, created['appointments'][0])
+
+
+def test_the_drug_report_lists_a_months_prescriptions(app, hospital):
+    created = hospital(doctors=1, patients=2, appointments=4, treated=4, items_per_treatment=2)
+    prescribed = [appointment.start_time for appointment in
+                  Appointment.query.filter(Appointment.id.in_(created['appointments']))]
+    month = min(prescribed).strftime('%Y-%m')
+    start, end = treatments.month_range(month)
+
+    rows = treatments.drug_report('Drug 1', start, end)
+
+    assert treatments.drug_names() == ['Drug 0', 'Drug 1']
+    assert [row.prescribed_at for row in rows] == sorted(at for at in prescribed if start <= at < end)
+    assert treatments.month_range('2025-12') == (datetime(2025, 12, 1), datetime(2026, 1, 1))
@@ -0,0 +1,116 @@
+from datetime import datetime
+
+from sqlalchemy import select
+
+from model import db, User, Patient, Appointment, Treatment, PrescriptionItem, \
+    ArchivedAppointment, ArchivedTreatment, ArchivedPrescriptionItem
+import stats
+import agenda
+import archive
+import live
+
+
+class TreatmentError(Exception):
+    pass
+
+
+# --- Authoring ---
+
+def parse_items(form):
+    # The treatment form posts parallel drug/dose/frequency/duration_days
+    # lists, one entry per prescription row; blank rows are ignored.
+    rows = zip(form.getlist('drug'), form.getlist('dose'),
+               form.getlist('frequency'), form.getlist('duration_days'))
+    items = []
+    for drug, dose, frequency, duration_days in rows:
+        drug, dose, frequency = drug.strip(), dose.strip(), frequency.strip()
+        if not (drug or dose or frequency):
+            continue
+        if not (drug and dose and frequency):
+            raise TreatmentError('Each prescription line needs a drug, dose and frequency.')
+        try:
+            duration_days = int(duration_days) if duration_days.strip() else None
+        except ValueError:
+            raise TreatmentError(f'Invalid duration for {drug}.')
+        items.append({'drug': drug, 'dose': dose, 'frequency': frequency,
+                      'duration_days': duration_days})
+    return items
+
+
+def prescription_summary(items):
+    return '; '.join(f"{item['drug']} {item['dose']} {item['frequency']}"
+                     + (f" for {item['duration_days']} days" if item['duration_days'] else '')
+                     for item in items)
+
+
+def appointment_for_doctor(doctor, appointment_id):
+    appointment = Appointment.query.get(appointment_id)
+    if not appointment or appointment.doctor_id != doctor.id:
+        raise TreatmentError('Appointment not found.')
+    return appointment
+
+
+def save_treatment(doctor, appointment, diagnosis, notes, items):
+    # Creates or replaces the appointment's treatment record and marks the
+    # appointment Completed.
+    diagnosis = (diagnosis or '').strip()
+    if not diagnosis:
+        raise TreatmentError('Please enter a diagnosis.')
+    if appointment.status == 'Canceled':
+        raise TreatmentError('Canceled appointments cannot have a treatment record.')
+
+    treatment = appointment.treatment_record
+    if treatment is None:
+        treatment = Treatment(appointment_id=appointment.id, created_by_doctor_id=doctor.id)
+        db.session.add(treatment)
+    treatment.diagnosis = diagnosis
+    treatment.notes = (notes or '').strip() or None
+    treatment.prescription = prescription_summary(items)
+    treatment.items = [PrescriptionItem(prescribed_at=appointment.start_time, **item) for item in items]
+
+    stats.appointment_status_changed(appointment.status, 'Completed')
+    appointment.status = 'Completed'
+    live.appointments_changed([appointment], 'Completed')
+    db.session.commit()
+    agenda.invalidate(appointment.doctor_id)
+    return treatment
+
+
+# --- Pharmacy report ---
+# Both queries are answered from ix_prescription_item_drug_prescribed.
+
+def drug_names():
+    names = select(PrescriptionItem.drug).union(select(ArchivedPrescriptionItem.drug)).subquery()
+    return [drug for (drug,) in db.session.query(names.c.drug).order_by(names.c.drug)]
+
+
+def month_range(month):
+    # 'YYYY-MM' -> [first day, first day of next month)
+    start = datetime.strptime(month, '%Y-%m')
+    end = start.replace(year=start.year + 1, month=1) if start.month == 12 \
+        else start.replace(month=start.month + 1)
+    return start, end
+
+
+def _drug_rows(drug, start, end, item=PrescriptionItem, treatment=Treatment, appointment=Appointment):
+    return db.session.query(item.prescribed_at, item.dose, item.frequency, item.duration_days,
+                            Patient.id, User.full_name) \
+        .join(treatment, treatment.id == item.treatment_id) \
+        .join(appointment, appointment.id == treatment.appointment_id) \
+        .join(Patient, Patient.id == appointment.patient_id) \
+        .join(User, User.id == Patient.user_id) \
+        .filter(item.drug == drug,
+                item.prescribed_at >= start,
+                item.prescribed_at < end) \
+        .order_by(item.prescribed_at) \
+        .all()
+
+
+def drug_report(drug, start, end):
+    # prescribed_at copies the appointment's start_time, so archived
+    # prescriptions are only read when the range reaches the archive
+    rows = _drug_rows(drug, start, end)
+    if not archive.reaches(start):
+        return rows
+    archived = _drug_rows(drug, start, end, ArchivedPrescriptionItem, ArchivedTreatment, ArchivedAppointment)
+    return sorted(rows + archived, key=lambda row: row.prescribed_at)
@@ -0,0 +1,12 @@
+# Production entry point:
+#
+#   flask --app app init-db
+#   flask --app app init-tenants        (instead, with TENANTS set)
+#   gunicorn -c gunicorn.conf.py wsgi:app
+#   uvicorn --interface wsgi wsgi:app
+#   flask --app app run-jobs            (background jobs, reminders, analytics)
+#   flask --app app sync-replica PATH --every 5   (local SQLite read replica)
+#   HMS_TENANT=<hospital> flask --app app run-jobs   (one worker per hospital)
+from app import create_app
+
+app = create_app()